@@ -1,4 +1,5 @@
 from django.contrib import admin
+from .images import schedule_variants
 from .models import (Category, Product, Store, Order, Cart, Message, Payment,
                      ProductImage, CategoryImage, HeroImage, ProductReview, ProductRating)
 
@@ -96,6 +97,15 @@ class ProductImageAdmin(admin.ModelAdmin):
 class HeroImageAdmin(admin.ModelAdmin):
     list_display = ['title', 'description', 'active']
 
+    def save_model(self, request, obj, form, change):
+        # Hero images are added here, render their variants like the upload views do.
+        changed = 'image' in form.changed_data
+        if changed:
+            obj.variants = None
+        super().save_model(request, obj, form, change)
+        if changed and obj.image:
+            schedule_variants(obj, 'hero_image')
+
 @admin.register(ProductReview)
 class ProductReviewAdmin(admin.ModelAdmin):
     list_display = ['author', 'product', 'review']
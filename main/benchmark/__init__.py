@@ -0,0 +1,5 @@
+"""
+Benchmark tooling: main.benchmark.data generates a synthetic catalog and
+main.benchmark.load drives a running server with shopper traffic. See the
+benchmark_data and benchmark_load management commands.
+"""
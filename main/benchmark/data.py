@@ -0,0 +1,216 @@
+import random
+import uuid
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from ..category_tree import invalidate_category_tree
+from ..models import (Cart, CartItem, Category, CategoryImage, Conversation, ConversationMember, HeroImage, Message,
+                      Order, OrderItem, Payment, Product, ProductImage, ProductRating, ProductReview, Store,
+                      StoreRating, StoreReview)
+from ..sales import record_sales
+from ..search import index_products
+from ..signals import resources_changed
+
+# Every generated user and category is named with this prefix, flush() removes
+# them and, through the cascades, everything else that was generated.
+PREFIX = 'bench'
+PASSWORD = 'bench-password'
+
+SCALES = {
+    'small': {'users': 50, 'stores': 3, 'categories': 4, 'products': 500},
+    'medium': {'users': 500, 'stores': 10, 'categories': 8, 'products': 10000},
+    'large': {'users': 5000, 'stores': 50, 'categories': 12, 'products': 100000},
+}
+
+ADJECTIVES = ['Wireless', 'Portable', 'Smart', 'Classic', 'Compact', 'Premium', 'Rugged', 'Solar', 'Vintage', 'Mini']
+NOUNS = ['Speaker', 'Lamp', 'Backpack', 'Watch', 'Charger', 'Kettle', 'Headphones', 'Blender', 'Camera', 'Jacket']
+MATERIALS = ['steel', 'cotton', 'aluminium', 'leather', 'bamboo', 'ceramic', 'glass', 'silicone']
+CATEGORY_NAMES = ['Electronics', 'Home', 'Fashion', 'Sports', 'Beauty', 'Toys', 'Garden', 'Automotive',
+                  'Office', 'Kitchen', 'Health', 'Books']
+# Every product name contains one of these, the load driver searches for them.
+SEARCH_TERMS = [noun.lower() for noun in NOUNS] + [material for material in MATERIALS]
+
+IMAGES_PER_PRODUCT = 3
+MAX_RATINGS_PER_PRODUCT = 8
+ORDERS_PER_USER = 3
+CART_ITEMS_PER_USER = 2
+
+
+def generate(users, stores, categories, products, seed=0, batch_size=1000, log=None):
+    """
+    Creates a deterministic synthetic catalog: users with stores, three
+    level categories, products with images, ratings and reviews, active
+    carts, an order history with payments and messages. The same seed and
+    sizes always produce the same data. Returns the number of rows created
+    per model.
+    """
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+    counts = {}
+
+    def create(model, objects):
+        created = model.objects.bulk_create(objects, batch_size=batch_size)
+        counts[model.__name__] = counts.get(model.__name__, 0) + len(created)
+        return created
+
+    with transaction.atomic():
+        # Hashing is deliberately slow, every user shares one hash.
+        password = make_password(PASSWORD)
+        user_rows = create(User, [User(username=f'{PREFIX}-user-{i}', email=f'{PREFIX}-user-{i}@example.com',
+                                       password=password) for i in range(users)])
+        store_rows = create(Store, [
+            Store(user=user_rows[i % len(user_rows)], name=f'{PREFIX.title()} Store {i}',
+                  description=f'Store {i} sells {rng.choice(NOUNS).lower()}s.', contact_info=f'080{i:08d}',
+                  address=f'{i} Market Street', logo=f'https://cdn.example.com/{PREFIX}/logo-{i}.png')
+            for i in range(stores)
+        ])
+        log(f'{len(user_rows)} users, {len(store_rows)} stores')
+
+        # Each root category has three subcategories of two leaves each.
+        roots = create(Category, [
+            Category(name=CATEGORY_NAMES[i % len(CATEGORY_NAMES)] + (f' {i}' if i >= len(CATEGORY_NAMES) else ''),
+                     slug=f'{PREFIX}-{i}')
+            for i in range(categories)
+        ])
+        subs = create(Category, [
+            Category(name=f'{root.name} {j}', slug=f'{root.slug}-{j}', parent=root) for root in roots for j in range(3)
+        ])
+        leaves = create(Category, [
+            Category(name=f'{sub.name}.{k}', slug=f'{sub.slug}-{k}', parent=sub) for sub in subs for k in range(2)
+        ])
+        create(CategoryImage, [
+            CategoryImage(category=root, image=f'https://cdn.example.com/{PREFIX}/{root.slug}.jpg') for root in roots
+        ])
+        create(HeroImage, [
+            HeroImage(title=f'Hero {i}', image=f'https://cdn.example.com/{PREFIX}/hero-{i}.jpg', ordering=i)
+            for i in range(3)
+        ])
+        log(f'{len(roots) + len(subs) + len(leaves)} categories')
+
+        parents = {sub.pk: sub.parent for sub in subs}
+        for start in range(0, products, batch_size):
+            batch = []
+            ratings = []
+            for i in range(start, min(start + batch_size, products)):
+                leaf = rng.choice(leaves)
+                sub = leaf.parent
+                base_price = Decimal(rng.randint(100, 50000)) / 100
+                markup = rng.choice([20, 30, 40])
+                scores = [rng.randint(1, 5) for _ in range(rng.randint(0, min(MAX_RATINGS_PER_PRODUCT, users)))]
+                ratings.append(scores)
+                batch.append(Product(
+                    store=store_rows[i % len(store_rows)],
+                    category=parents[sub.pk], subcategory=sub, sub_subcategory=leaf,
+                    name=f'{rng.choice(ADJECTIVES)} {rng.choice(MATERIALS).title()} {rng.choice(NOUNS)} {i}',
+                    description=f'A {rng.choice(ADJECTIVES).lower()} {rng.choice(NOUNS).lower()} for every day.',
+                    specification=f'Material: {rng.choice(MATERIALS)}\nWeight: {rng.randint(50, 5000)}g',
+                    is_dropshipping=True, aliexpress_id=f'{PREFIX}-{seed}-{i}', base_price=base_price,
+                    markup_percentage=markup, unit_price=Product.calculate_unit_price(base_price, markup),
+                    # Enough stock that load tests never run out.
+                    inventory=1000000,
+                    rating_count=len(scores), rating_sum=sum(scores),
+                    average_rating=sum(scores) / len(scores) if scores else 0,
+                ))
+            product_rows = create(Product, batch)
+            create(ProductImage, [
+                ProductImage(product=product, image=f'https://cdn.example.com/{PREFIX}/{product.aliexpress_id}-{n}.jpg')
+                for product in product_rows for n in range(IMAGES_PER_PRODUCT)
+            ])
+            rating_rows, review_rows = [], []
+            for product, scores in zip(product_rows, ratings):
+                for user, score in zip(rng.sample(user_rows, len(scores)), scores):
+                    rating_rows.append(ProductRating(product=product, user=user, rating=score))
+                    if rng.random() < 0.5:
+                        review_rows.append(ProductReview(product=product, author=user, review=f'{score} stars, would buy again.'))
+            create(ProductRating, rating_rows)
+            create(ProductReview, review_rows)
+            log(f'{start + len(product_rows)} products')
+        product_ids = list(Product.objects.filter(aliexpress_id__startswith=f'{PREFIX}-{seed}-')
+                           .order_by('pk').values_list('pk', 'unit_price'))
+
+        store_ratings, store_reviews = [], []
+        for store in store_rows:
+            for user in rng.sample(user_rows, min(10, len(user_rows))):
+                store_ratings.append(StoreRating(store=store, user=user, rating=rng.randint(1, 5)))
+                store_reviews.append(StoreReview(store=store, user=user, review='Fast delivery.'))
+        create(StoreRating, store_ratings)
+        create(StoreReview, store_reviews)
+
+        # Past orders are on inactive carts, every user also has an active one.
+        for start in range(0, len(user_rows), batch_size):
+            chunk = user_rows[start:start + batch_size]
+            history = create(Cart, [
+                Cart(user=user, store=rng.choice(store_rows), status=Cart.STATUS_INACTIVE)
+                for user in chunk for _ in range(ORDERS_PER_USER)
+            ])
+            order_rows, item_rows = [], []
+            for cart in history:
+                items = [(product_id, price, rng.randint(1, 3)) for product_id, price in rng.sample(product_ids, 3)]
+                order = Order(id=uuid.UUID(int=rng.getrandbits(128)), cart=cart, user=cart.user, store=cart.store, shipping_address='1 Main Street',
+                              contact_info='0800000000', order_reference=f'{PREFIX}-{cart.pk}',
+                              status=rng.choice([Order.STATUS_PROCESSING, Order.STATUS_DELIVERED]),
+                              total_price=sum(price * quantity for _, price, quantity in items))
+                order_rows.append(order)
+                item_rows += [OrderItem(order=order, product_id=product_id, quantity=quantity, price_at_purchase=price)
+                              for product_id, price, quantity in items]
+            create(Order, order_rows)
+            create(OrderItem, item_rows)
+            # The orders are all paid for, bulk_create skipped the signal that rolls them up.
+            record_sales([order.pk for order in order_rows])
+            create(Payment, [
+                Payment(order=order, payment_reference=f'{PREFIX}-{order.order_reference}', amount=order.total_price,
+                        status=Payment.STATUS_SUCCESSFUL, is_verified=True, payment_method='card')
+                for order in order_rows
+            ])
+
+            carts = create(Cart, [Cart(user=user, store=rng.choice(store_rows)) for user in chunk])
+            create(CartItem, [
+                CartItem(cart=cart, product_id=product_id, quantity=rng.randint(1, 3))
+                for cart in carts for product_id, _ in rng.sample(product_ids, CART_ITEMS_PER_USER)
+            ])
+            # One unread question per user to a store of someone else, filed
+            # the way main.messaging files it.
+            askers, stores = [], []
+            for user in chunk:
+                others = [store for store in store_rows if store.user_id != user.pk]
+                if others:
+                    askers.append(user)
+                    stores.append(rng.choice(others))
+            conversations = create(Conversation, [
+                Conversation(key=f'store:{store.pk}:{user.pk}', store=store) for user, store in zip(askers, stores)
+            ])
+            messages = create(Message, [
+                Message(conversation=conversation, sender=user, receiver_store=store, content='Is this still in stock?')
+                for conversation, user, store in zip(conversations, askers, stores)
+            ])
+            for conversation, message in zip(conversations, messages):
+                conversation.last_message, conversation.last_message_at = message, message.timestamp
+            Conversation.objects.bulk_update(conversations, ['last_message', 'last_message_at'], batch_size=batch_size)
+            create(ConversationMember, [
+                ConversationMember(conversation=conversation, user_id=user_id, last_message_at=message.timestamp,
+                                   unread_count=int(user_id != user.pk))
+                for conversation, message, user, store in zip(conversations, messages, askers, stores)
+                for user_id in (user.pk, store.user_id)
+            ])
+        log(f"{counts.get('Order', 0)} orders")
+
+    # The bulk inserts bypassed the signals.
+    index_products([product_id for product_id, _ in product_ids])
+    invalidate_category_tree()
+    resources_changed(['categories', 'hero', 'products', 'stores'])
+    return counts
+
+
+def flush():
+    """Deletes everything generate() created."""
+    with transaction.atomic():
+        # Products, orders, carts, ratings and messages cascade from the users and stores.
+        deleted, _ = User.objects.filter(username__startswith=f'{PREFIX}-user-').delete()
+        deleted += Category.objects.filter(slug__startswith=f'{PREFIX}-').delete()[0]
+        deleted += HeroImage.objects.filter(image__contains=f'/{PREFIX}/').delete()[0]
+    invalidate_category_tree()
+    resources_changed(['categories', 'hero', 'products', 'stores'])
+    return deleted
@@ -0,0 +1,176 @@
+import math
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.urls import reverse
+
+# Relative weights of the actions of each mix.
+MIXES = {
+    'realistic': {'browse': 55, 'search': 25, 'store': 5, 'add_to_cart': 10, 'checkout': 5},
+    'browse': {'browse': 80, 'store': 20},
+    'search': {'search': 100},
+    'cart': {'add_to_cart': 70, 'checkout': 30},
+}
+
+# Upper bounds in milliseconds of the latency histogram buckets.
+HISTOGRAM_BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, math.inf)
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))]
+
+
+class LoadResult:
+    """Latencies (in seconds) and failures of every request, by endpoint."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, ok):
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+
+    @property
+    def total(self):
+        return sum(len(values) for values in self.latencies.values())
+
+    def summary(self):
+        """One row per endpoint and an 'all' row: count, errors, requests/s and latency percentiles in ms."""
+        rows = []
+        groups = sorted(self.latencies.items()) + [('all', [v for values in self.latencies.values() for v in values])]
+        for endpoint, values in groups:
+            values = sorted(values)
+            errors = sum(self.errors.values()) if endpoint == 'all' else self.errors[endpoint]
+            rows.append({
+                'endpoint': endpoint,
+                'count': len(values),
+                'errors': errors,
+                'rps': len(values) / self.elapsed if self.elapsed else 0,
+                'p50': percentile(values, 0.50) * 1000,
+                'p90': percentile(values, 0.90) * 1000,
+                'p99': percentile(values, 0.99) * 1000,
+                'max': (values[-1] if values else 0) * 1000,
+            })
+        return rows
+
+    def histogram(self, endpoint=None):
+        """(upper bound in ms, count) of every HISTOGRAM_BOUNDS bucket."""
+        values = self.latencies[endpoint] if endpoint else [v for vs in self.latencies.values() for v in vs]
+        counts = [0] * len(HISTOGRAM_BOUNDS)
+        for value in values:
+            milliseconds = value * 1000
+            counts[next(i for i, bound in enumerate(HISTOGRAM_BOUNDS) if milliseconds <= bound)] += 1
+        return list(zip(HISTOGRAM_BOUNDS, counts))
+
+
+class LoadDriver:
+    """
+    Sends a weighted mix of shopper actions to a running server from
+    `concurrency` threads, each with its own keep-alive session and its own
+    user. Browsing and search are anonymous, like most storefront traffic;
+    cart and checkout actions are authenticated with the given JWT access
+    tokens. Runs are reproducible for a given seed, up to thread scheduling.
+
+    catalog holds the ids the actions pick from: 'category_slugs',
+    'product_ids', 'store_ids' and 'search_terms'.
+    """
+
+    def __init__(self, base_url, catalog, tokens, mix='realistic', concurrency=8, seed=0, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.catalog = catalog
+        self.tokens = tokens
+        self.actions, self.weights = zip(*MIXES[mix].items())
+        self.concurrency = concurrency
+        self.seed = seed
+        self.timeout = timeout
+        self.paths = {name: reverse(name) for name in ('categories-list', 'products-list', 'products-facets',
+                                                       'cart-items-list', 'orders-list')}
+
+    def run(self, duration=None, requests_limit=None):
+        """Runs until duration seconds have passed or about requests_limit requests were sent."""
+        result = LoadResult()
+        deadline = time.monotonic() + duration if duration else None
+        remaining = [requests_limit]
+        lock = threading.Lock()
+
+        def keep_going():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            with lock:
+                if remaining[0] is None:
+                    return True
+                remaining[0] -= 1
+                return remaining[0] >= 0
+
+        def worker(index):
+            rng = random.Random(f'{self.seed}-{index}')
+            session = requests.Session()
+            token = self.tokens[index % len(self.tokens)] if self.tokens else None
+            while keep_going():
+                action = rng.choices(self.actions, self.weights)[0]
+                getattr(self, action)(session, token, rng, result)
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for future in [executor.submit(worker, index) for index in range(self.concurrency)]:
+                future.result()
+        result.elapsed = time.monotonic() - started
+        return result
+
+    def request(self, session, result, endpoint, method, path, token=None, **kwargs):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        started = time.perf_counter()
+        try:
+            response = session.request(method, self.base_url + path, headers=headers, timeout=self.timeout, **kwargs)
+            ok = response.status_code < 400
+        except requests.RequestException:
+            response, ok = None, False
+        result.record(endpoint, time.perf_counter() - started, ok)
+        return response
+
+    # Actions, each is what one page view or click sends.
+
+    def browse(self, session, token, rng, result):
+        self.request(session, result, 'GET categories-list', 'GET', self.paths['categories-list'])
+        self.request(session, result, 'GET products-list', 'GET', self.paths['products-list'],
+                     params={'category__slug': rng.choice(self.catalog['category_slugs'])})
+        product_id = rng.choice(self.catalog['product_ids'])
+        self.request(session, result, 'GET products-detail', 'GET', reverse('products-detail', args=[product_id]))
+        self.request(session, result, 'GET product-reviews-list', 'GET',
+                     reverse('product-reviews-list', kwargs={'product_pk': product_id}))
+
+    def search(self, session, token, rng, result):
+        params = {'search': rng.choice(self.catalog['search_terms'])}
+        self.request(session, result, 'GET products-list?search', 'GET', self.paths['products-list'], params=params)
+        self.request(session, result, 'GET products-facets', 'GET', self.paths['products-facets'], params=params)
+
+    def store(self, session, token, rng, result):
+        self.request(session, result, 'GET stores-detail', 'GET',
+                     reverse('stores-detail', args=[rng.choice(self.catalog['store_ids'])]))
+
+    def add_to_cart(self, session, token, rng, result):
+        if token is None:
+            return
+        self.request(session, result, 'POST cart-items-list', 'POST', self.paths['cart-items-list'], token,
+                     json={'product_id': rng.choice(self.catalog['product_ids']), 'quantity': rng.randint(1, 3)})
+        self.request(session, result, 'GET cart-items-list', 'GET', self.paths['cart-items-list'], token)
+
+    def checkout(self, session, token, rng, result):
+        if token is None:
+            return
+        self.request(session, result, 'POST cart-items-list', 'POST', self.paths['cart-items-list'], token,
+                     json={'product_id': rng.choice(self.catalog['product_ids']), 'quantity': 1})
+        self.request(session, result, 'POST orders-list', 'POST', self.paths['orders-list'], token,
+                     json={'shipping_address': '1 Main Street', 'contact_info': '0800000000'})
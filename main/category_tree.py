@@ -0,0 +1,167 @@
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Subquery
+
+from .images import srcset
+from .models import Category, CategoryImage, ResourceVersion
+from .versioning import get_versions
+
+
+VERSION_CACHE_KEY = 'category_tree:version'
+
+# Seconds a process serves its tree before checking it against the
+# 'categories' version stamp (see main.versioning).
+MAX_AGE = getattr(settings, 'CATEGORY_TREE_MAX_AGE', 5)
+
+
+class CategoryTree:
+    """
+    Read-only snapshot of the whole category table.
+
+    Holds the parent/children maps, a slug lookup and the images of every
+    category so the category endpoints never have to walk the table node by
+    node. Serialized nodes are memoized, a tree is never mutated once built.
+    """
+
+    def __init__(self, categories, images, stamp=None):
+        # The 'categories' version stamp (see main.versioning) the tree was read at.
+        self.stamp = stamp
+        self.nodes = {}
+        self.by_slug = {}
+        self.child_ids = defaultdict(list)
+        self.images = defaultdict(list)
+        self._serialized = {}
+
+        # Categories arrive in Meta.ordering (name), so children lists keep that order.
+        for category in categories:
+            self.nodes[category['id']] = category
+            self.by_slug[category['slug']] = category['id']
+        for category in self.nodes.values():
+            parent_id = category['parent'] if category['parent'] in self.nodes else None
+            self.child_ids[parent_id].append(category['id'])
+        for image in images:
+            self.images[image['category']].append(image)
+
+    @classmethod
+    def load(cls):
+        # The stamp comes with the rows, read in the same statement.
+        categories = list(Category.objects.values(
+            'id', 'name', 'slug', 'parent', 'aliexpress_id', 'is_active',
+            stamp=Subquery(ResourceVersion.objects.filter(key='categories').values('version')[:1]),
+        ))
+        stamp = categories[0]['stamp'] if categories else None
+        for category in categories:
+            del category['stamp']
+        images = [
+            {'id': image['id'], 'category': image['category'], 'image': image['image'], 'srcset': srcset(image['variants'])}
+            for image in CategoryImage.objects.order_by('id').values('id', 'category', 'image', 'variants')
+        ]
+        return cls(categories, images, stamp)
+
+    def get(self, pk):
+        return self.nodes.get(pk)
+
+    def get_by_slug(self, slug):
+        return self.nodes.get(self.by_slug.get(slug))
+
+    def roots(self):
+        return self.child_ids[None]
+
+    def children(self, pk, active_only=True):
+        return [
+            self.nodes[child_id] for child_id in self.child_ids.get(pk, [])
+            if self.nodes[child_id]['is_active'] or not active_only
+        ]
+
+    def ancestors(self, pk):
+        """Returns the path from the root down to pk (inclusive)."""
+        path = []
+        while pk in self.nodes and pk not in path:
+            path.append(pk)
+            pk = self.nodes[pk]['parent']
+        return [self.nodes[node_id] for node_id in reversed(path)]
+
+    def descendants(self, pk):
+        """Returns pk and the ids of every category below it."""
+        found, pending = [], [pk]
+        while pending:
+            node_id = pending.pop()
+            if node_id in self.nodes and node_id not in found:
+                found.append(node_id)
+                pending.extend(self.child_ids.get(node_id, []))
+        return found
+
+    def serialize(self, pk, _path=()):
+        """Same shape as CategorySerializer, subcategories only list active categories."""
+        if pk in self._serialized:
+            return self._serialized[pk]
+
+        node = self.nodes[pk]
+        data = {
+            'id': node['id'],
+            'name': node['name'],
+            'slug': node['slug'],
+            'images': self.images.get(pk, []),
+            'parent': node['parent'],
+            'aliexpress_id': node['aliexpress_id'],
+            'is_active': node['is_active'],
+            'subcategories': [
+                self.serialize(child['id'], _path + (pk,))
+                for child in self.children(pk)
+                if child['id'] not in _path
+            ],
+        }
+        self._serialized[pk] = data
+        return data
+
+
+_tree = None
+_tree_version = None
+_checked_at = None
+_lock = threading.Lock()
+
+
+def _categories_version():
+    return get_versions(['categories']).get('categories', {}).get('version')
+
+
+def get_category_tree():
+    """
+    Returns the process-wide category tree, loading it on first use.
+
+    The version counter lives in the cache so that, with a shared cache
+    backend, an invalidation in one process also reaches the others at
+    once. Without one, the 'categories' version stamp, which every category
+    write bumps, is checked every MAX_AGE seconds.
+    """
+    global _tree, _tree_version, _checked_at
+
+    version = cache.get(VERSION_CACHE_KEY, 0)
+    now = time.monotonic()
+    tree = _tree
+    if tree is not None and _tree_version == version and now - _checked_at < MAX_AGE:
+        return tree
+
+    with _lock:
+        if _tree is not None and _tree_version == version:
+            if now - _checked_at < MAX_AGE or _categories_version() == _tree.stamp:
+                _checked_at = now
+                return _tree
+        _tree = CategoryTree.load()
+        _tree_version, _checked_at = version, now
+        return _tree
+
+
+def invalidate_category_tree():
+    global _tree
+
+    with _lock:
+        _tree = None
+    try:
+        cache.incr(VERSION_CACHE_KEY)
+    except ValueError:
+        cache.set(VERSION_CACHE_KEY, 1, timeout=None)
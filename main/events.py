@@ -0,0 +1,216 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Dotted path of the backend that carries events to the hub of every process.
+    'BACKEND': 'main.events.LocalBackend',
+    'OPTIONS': {},
+    # Seconds between keep-alive comments, and the longest one stream stays open.
+    'HEARTBEAT': 15,
+    'MAX_DURATION': 300,
+    # Events a slow stream may fall behind by before its oldest ones are dropped.
+    'QUEUE_SIZE': 100,
+}
+
+
+class Subscription:
+    """The queue of one stream, fed from any thread, read from its event loop."""
+
+    def __init__(self, topics, queue_size):
+        self.topics = frozenset(topics)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(queue_size)
+        self.dropped = 0
+
+    def put(self, event):
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout):
+        """The next event, or None when there was none for timeout seconds."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class EventHub:
+    """
+    In-process pub/sub of events by topic: 'user:<id>' for what concerns a
+    user, 'store:<id>' for what concerns a store and so its owner. Streams
+    subscribe() from their event loop. publish() hands events to the
+    backend, which dispatch()es them to the hub of every process.
+    """
+
+    def __init__(self, options=None):
+        options = {**DEFAULTS, **(options or {})}
+        self.heartbeat = options['HEARTBEAT']
+        self.max_duration = options['MAX_DURATION']
+        self.queue_size = options['QUEUE_SIZE']
+        self._backend_path = options['BACKEND']
+        self._backend_options = options['OPTIONS']
+        self._backend = None
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        # Built on first use, the backend module may import this one.
+        with self._lock:
+            if self._backend is None:
+                self._backend = import_string(self._backend_path)(self, **self._backend_options)
+            return self._backend
+
+    def subscribe(self, topics):
+        subscription = Subscription(topics, self.queue_size)
+        self.backend.start()
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, topics, event, data):
+        self.backend.publish({'id': uuid.uuid4().hex, 'topics': list(topics), 'event': event, 'data': data})
+
+    def publish_on_commit(self, topics, event, data):
+        # Streams must never announce a write that is then rolled back.
+        transaction.on_commit(lambda: self.publish(topics, event, data))
+
+    def dispatch(self, event):
+        """Delivers an event to the subscriptions of this process, from any thread."""
+        topics = set(event['topics'])
+        with self._lock:
+            subscriptions = [subscription for subscription in self._subscriptions if subscription.topics & topics]
+        for subscription in subscriptions:
+            subscription.put(event)
+
+    async def stream(self, topics, duration):
+        """
+        Server-sent events of topics for up to duration seconds, with a
+        keep-alive comment every HEARTBEAT seconds.
+        """
+        subscription = self.subscribe(topics)
+        try:
+            yield 'retry: 3000\n\n'
+            deadline = time.monotonic() + duration
+            while (remaining := deadline - time.monotonic()) > 0:
+                event = await subscription.get(min(self.heartbeat, remaining))
+                if event is None:
+                    yield ': keep-alive\n\n'
+                else:
+                    yield f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+        finally:
+            self.unsubscribe(subscription)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscriptions)
+
+
+class LocalBackend:
+    """Delivers events within this process only. The default, and what the tests use."""
+
+    def __init__(self, hub):
+        self.hub = hub
+
+    def start(self):
+        pass
+
+    def publish(self, event):
+        self.hub.dispatch(event)
+
+
+class PostgresBackend:
+    """
+    Carries events between processes with PostgreSQL NOTIFY on CHANNEL.
+    Every process LISTENs from its own connection in a daemon thread, so
+    publishers reach their own streams the same way as everyone else's.
+    PostgreSQL caps payloads at 8000 bytes, events carry ids and previews.
+    """
+
+    def __init__(self, hub, CHANNEL='storefront_events', DATABASE='default'):
+        self.hub = hub
+        self.channel = CHANNEL
+        self.alias = DATABASE
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._listen, name='events-listener', daemon=True)
+                self._thread.start()
+
+    def publish(self, event):
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.channel, json.dumps(event)])
+
+    def _listen(self):
+        database = connections[self.alias]
+        while True:
+            connection = None
+            try:
+                connection = database.get_new_connection(database.get_connection_params())
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN {database.ops.quote_name(self.channel)}')
+                while True:
+                    if select.select([connection], [], [], 5) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        self.hub.dispatch(json.loads(connection.notifies.pop(0).payload))
+            except Exception:
+                logger.exception("Event listener lost its connection, reconnecting")
+                if connection is not None:
+                    connection.close()
+                time.sleep(1)
+
+
+event_hub = EventHub(getattr(settings, 'EVENTS', None))
+
+
+def publish_message(message):
+    """Announces a new message to its sender's and its receiver's streams."""
+    topics = [f'user:{message.sender_id}']
+    if message.receiver_user_id is not None:
+        topics.append(f'user:{message.receiver_user_id}')
+    if message.receiver_store_id is not None:
+        topics.append(f'store:{message.receiver_store_id}')
+    event_hub.publish_on_commit(topics, 'message', {
+        'id': message.pk,
+        'conversation': message.conversation_id,
+        'sender': message.sender_id,
+        'preview': message.content[:200],
+        'timestamp': message.timestamp.isoformat(),
+    })
+
+
+def publish_order_status(order, previous_status):
+    """Announces a status change to the customer's and the store's streams."""
+    event_hub.publish_on_commit([f'user:{order.user_id}', f'store:{order.store_id}'], 'order_status', {
+        'id': str(order.pk),
+        'order_reference': order.order_reference,
+        'store': order.store_id,
+        'status': order.status,
+        'previous_status': previous_status,
+    })
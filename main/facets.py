@@ -0,0 +1,71 @@
+from decimal import Decimal
+
+from django.db.models import Case, Count, F, IntegerField, Max, Min, Value, When
+
+from .category_tree import get_category_tree
+
+
+# Lower bounds of the price buckets, the last one is open ended.
+PRICE_BUCKETS = (0, 10, 25, 50, 100, 250, 500, 1000)
+
+CATEGORY_FACETS = ('category', 'subcategory', 'sub_subcategory')
+
+CENT = Decimal('0.01')
+
+
+def _price_bucket():
+    return Case(
+        *[When(unit_price__gte=bound, then=Value(index)) for index, bound in reversed(list(enumerate(PRICE_BUCKETS)))],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def _grouped(queryset, facet, key):
+    return queryset.annotate(facet=Value(facet), key=key).values('facet', 'key').annotate(
+        count=Count('pk'), min_price=Min('unit_price'), max_price=Max('unit_price'),
+    )
+
+
+def _price(value):
+    # SQLite computes aggregates of decimals as floats: rounded back to
+    # cents, and a string like unit_price in the serializers.
+    return None if value is None else str(Decimal(value).quantize(CENT))
+
+
+def product_facets(queryset):
+    """
+    Counts of queryset's products per category level and price bucket, plus
+    the overall count and price range (as decimal strings). Every facet is a
+    grouped aggregate and they are sent as a single UNION ALL query.
+    """
+    queryset = queryset.order_by()
+    branches = [_grouped(queryset, 'total', Value(0, output_field=IntegerField()))]
+    branches += [_grouped(queryset, facet, F(f'{facet}_id')) for facet in CATEGORY_FACETS]
+    branches.append(_grouped(queryset, 'price', _price_bucket()))
+    rows = branches[0].union(*branches[1:], all=True)
+
+    tree = get_category_tree()
+    facets = {'count': 0, 'min_price': None, 'max_price': None, 'price': []}
+    facets.update({facet: [] for facet in CATEGORY_FACETS})
+    for row in rows:
+        if row['facet'] == 'total':
+            facets.update(count=row['count'], min_price=_price(row['min_price']), max_price=_price(row['max_price']))
+        elif row['facet'] == 'price':
+            index = row['key']
+            facets['price'].append({
+                'min': PRICE_BUCKETS[index],
+                'max': PRICE_BUCKETS[index + 1] if index + 1 < len(PRICE_BUCKETS) else None,
+                'count': row['count'],
+            })
+        else:
+            node = tree.get(row['key'])
+            if node is not None:
+                facets[row['facet']].append({
+                    'id': node['id'], 'name': node['name'], 'slug': node['slug'], 'count': row['count'],
+                })
+
+    for facet in CATEGORY_FACETS:
+        facets[facet].sort(key=lambda entry: (-entry['count'], entry['name']))
+    facets['price'].sort(key=lambda entry: entry['min'])
+    return facets
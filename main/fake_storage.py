@@ -0,0 +1,105 @@
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeObjectStorage:
+    """
+    Local stand-in for the Supabase Storage object API.
+
+    Accepts PUT /storage/v1/object/<bucket>/<key> and keeps the bodies in
+    `objects`, keyed by (bucket, key), and the request headers in `headers`.
+    GET serves them back, also under /storage/v1/object/public/.
+    Bodies are read in blocks as they arrive, so streaming clients are
+    exercised the way a real server would. Set `fail_status` to make every
+    upload fail.
+
+        with FakeObjectStorage() as storage:
+            settings.SUPABASE_URL = storage.url
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.objects = {}
+        self.headers = {}
+        self.fail_status = None
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _handler_class(self):
+        storage = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_PUT(self):
+                match = re.fullmatch(r'/storage/v1/object/([^/]+)/(.+)', self.path)
+                length = self.headers.get('Content-Length')
+                if match is None or length is None:
+                    self.discard_body()
+                    return self.reply(400, b'{"error": "Content-Length and an object path are required"}')
+
+                body = bytearray()
+                remaining = int(length)
+                while remaining:
+                    block = self.rfile.read(min(remaining, 64 * 1024))
+                    if not block:
+                        break
+                    body += block
+                    remaining -= len(block)
+
+                if storage.fail_status:
+                    return self.reply(storage.fail_status, b'{"error": "Fake failure"}')
+                with storage._lock:
+                    storage.objects[match.groups()] = bytes(body)
+                    storage.headers[match.groups()] = dict(self.headers)
+                self.reply(200, b'{"Key": "%s"}' % self.path.encode('utf-8'))
+
+            def do_GET(self):
+                # Objects are readable at their API path and at /public/ like public buckets.
+                match = re.fullmatch(r'/storage/v1/object/(?:public/)?([^/]+)/(.+)', self.path)
+                body = storage.objects.get(match.groups()) if match else None
+                if body is None:
+                    return self.reply(404, b'{"error": "Object not found"}')
+                self.reply(200, body)
+
+            def discard_body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    self.rfile.read(length)
+                else:
+                    self.close_connection = True
+
+            def reply(self, status, body):
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -1,5 +1,7 @@
 from django_filters.rest_framework import FilterSet
+from rest_framework.filters import SearchFilter
 from .models import Product, Store
+from .search import search_products
 
 class ProductFilter(FilterSet):
     class Meta:
@@ -12,9 +14,20 @@ class ProductFilter(FilterSet):
         }
 
 
+class ProductSearchFilter(SearchFilter):
+    """
+    Keeps the ?search= parameter but answers it from the product search index,
+    best matches first unless an explicit ?ordering= is given.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        return search_products(queryset, query)
+
+
 class StoreFilter(FilterSet):
     class Meta:
         model = Store
         fields = {
             "name": ['exact']
-        }
\ No newline at end of file
+        }
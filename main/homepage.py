@@ -0,0 +1,151 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .category_tree import get_category_tree
+from .models import HeroImage, Product
+from .serializers import HeroImageSerializer, ProductCardSerializer
+from .versioning import get_versions
+
+logger = logging.getLogger(__name__)
+
+VERSION_CACHE_KEY = 'homepage:version'
+
+# The version stamps (see main.versioning) of what the homepage shows.
+VERSION_KEYS = ['categories', 'hero', 'products']
+
+DEFAULTS = {
+    # Product cards in each of the featured and newest sections.
+    'PRODUCTS': 12,
+    # Seconds a rebuild waits, so a burst of writes is rendered once.
+    'DELAY': 1,
+    # Seconds the snapshot is served before its version stamps are checked
+    # for writes of other processes.
+    'MAX_AGE': 5,
+}
+
+# A rendered homepage and the version stamps (see get_versions) it was rendered from.
+Rendered = namedtuple('Rendered', ['payload', 'versions'])
+
+
+def render_homepage(product_count):
+    """
+    The homepage payload: the active hero images, the active top-level
+    categories with their images, and the featured (best rated) and newest
+    product cards. A handful of queries however big the catalogue is.
+    Returns it as Rendered.
+    """
+    # Read first, so the payload is never older than the stamps it is served under.
+    versions = get_versions(VERSION_KEYS)
+    tree = get_category_tree()
+    products = ProductCardSerializer.setup_queryset(Product.objects.filter(is_active=True), None)
+    featured = products.filter(rating_count__gt=0).order_by('-average_rating', '-rating_count', '-pk')
+    newest = products.order_by('-date_created', '-pk')
+    return Rendered({
+        'hero_images': HeroImageSerializer(
+            HeroImage.objects.filter(active=True).order_by('ordering'), many=True,
+        ).data,
+        'categories': [
+            {key: node[key] for key in ('id', 'name', 'slug', 'images')}
+            for node in map(tree.serialize, tree.roots()) if node['is_active']
+        ],
+        'featured_products': ProductCardSerializer(featured[:product_count], many=True).data,
+        'newest_products': ProductCardSerializer(newest[:product_count], many=True).data,
+        'generated_at': timezone.now(),
+    }, versions)
+
+
+class HomepageSnapshot:
+    """
+    The rendered homepage, served as is until what it shows changes.
+
+    invalidate_homepage() bumps a version counter in the cache and has the
+    snapshot rendered again in a background thread. Requests meanwhile get
+    the previous snapshot, only the first request of a process waits for a
+    render. With a shared cache backend, the other processes notice the new
+    version on their next request and rebuild the same way. Every MAX_AGE
+    seconds the stamps the snapshot was rendered from are also compared with
+    the current ones, so writes that bypass the counter (other processes
+    with a per-process cache, management commands, queryset updates) are
+    picked up too. get() returns the payload together with those stamps, so
+    its ETag never names a newer state than the one served.
+    """
+
+    def __init__(self, options=None):
+        options = {**DEFAULTS, **(options or {})}
+        self.product_count = options['PRODUCTS']
+        self.delay = options['DELAY']
+        self.max_age = options['MAX_AGE']
+        self._rendered = None
+        self._version = None
+        self._checked_at = None
+        self._rebuilding = False
+        self._lock = threading.Lock()
+
+    def get(self):
+        """The current snapshot, as Rendered."""
+        version = cache.get(VERSION_CACHE_KEY, 0)
+        now = time.monotonic()
+        rendered = self._rendered
+        if rendered is not None:
+            if self._version != version:
+                self.rebuild()
+            elif now - self._checked_at >= self.max_age:
+                self._checked_at = now
+                if get_versions(VERSION_KEYS) != rendered.versions:
+                    self.rebuild()
+            return rendered
+
+        with self._lock:
+            if self._rendered is None:
+                self._rendered, self._version = render_homepage(self.product_count), version
+                self._checked_at = now
+            return self._rendered
+
+    def rebuild(self):
+        """Renders the snapshot again in a background thread, unless one already is."""
+        with self._lock:
+            # A process that never served the homepage (a management
+            # command) has nothing to keep fresh.
+            if self._rebuilding or self._rendered is None:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild, name='homepage-snapshot', daemon=True).start()
+
+    def _rebuild(self):
+        try:
+            time.sleep(self.delay)
+            # Read before rendering: a write committed during the render
+            # leaves the snapshot a version behind, so it is rendered again.
+            version = cache.get(VERSION_CACHE_KEY, 0)
+            checked_at = time.monotonic()
+            rendered = render_homepage(self.product_count)
+            with self._lock:
+                self._rendered, self._version, self._checked_at = rendered, version, checked_at
+        except Exception:
+            logger.exception("Rebuilding the homepage snapshot failed, serving the previous one")
+        finally:
+            with self._lock:
+                self._rebuilding = False
+            close_old_connections()
+
+    def clear(self):
+        with self._lock:
+            self._rendered = self._version = self._checked_at = None
+
+
+homepage_snapshot = HomepageSnapshot(getattr(settings, 'HOMEPAGE', None))
+
+
+def invalidate_homepage():
+    try:
+        cache.incr(VERSION_CACHE_KEY)
+    except ValueError:
+        cache.set(VERSION_CACHE_KEY, 1, timeout=None)
+    homepage_snapshot.rebuild()
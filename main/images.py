@@ -0,0 +1,147 @@
+import hashlib
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from .storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+
+VARIANT_WIDTHS = (160, 320, 640, 1024)
+
+# extension: (Pillow format, content type, save options)
+VARIANT_FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def render_variants(data):
+    """
+    Decodes an image and returns its (width, height) and the encoded
+    variants as (width, extension, bytes), for every VARIANT_WIDTHS smaller
+    than the image (or the image's own width when it's smaller than all).
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        # EXIF orientations 5 to 8 are rotated by 90 degrees.
+        size = image.size if image.getexif().get(0x0112, 1) < 5 else image.size[::-1]
+        # Lets JPEG decode at a reduced scale, when that's still large enough.
+        image.draft('RGB', (VARIANT_WIDTHS[-1], VARIANT_WIDTHS[-1]))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+        width = image.width
+
+        variants = []
+        for variant_width in [w for w in VARIANT_WIDTHS if w < width] or [width]:
+            resized = image.resize((variant_width, max(1, round(image.height * variant_width / width))), Image.LANCZOS)
+            for extension, (format, _, options) in VARIANT_FORMATS.items():
+                frame = resized.convert('RGB') if format == 'JPEG' and resized.mode != 'RGB' else resized
+                buffer = io.BytesIO()
+                frame.save(buffer, format, **options)
+                variants.append((variant_width, extension, buffer.getvalue()))
+    return size, variants
+
+
+def create_variants(bucket_key, data, stem):
+    """
+    Renders and stores the variants of an image next to it, as
+    <stem>_<width>.<extension>, and returns the variants record:
+    {'base': <URL prefix>, 'widths': [...], 'formats': [...], 'width': w, 'height': h}
+    """
+    storage = get_storage()
+    (width, height), variants = render_variants(data)
+    for variant_width, extension, body in variants:
+        storage.put(bucket_key, f'{stem}_{variant_width}.{extension}', body, VARIANT_FORMATS[extension][1])
+    return {
+        'base': storage.url(bucket_key, stem),
+        'widths': sorted({variant_width for variant_width, _, _ in variants}),
+        'formats': list(VARIANT_FORMATS),
+        'width': width,
+        'height': height,
+    }
+
+
+def image_stem(url):
+    """
+    The key the variants of the image at url are stored under: its file name
+    without the extension plus a hash of the whole URL, as images of other
+    hosts and folders can share a file name.
+    """
+    name = url.split('?', 1)[0].rstrip('/').rsplit('/', 1)[-1]
+    name = name.rsplit('.', 1)[0] or name
+    digest = hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]
+    return f'{name}-{digest}' if name else digest
+
+
+def srcset(variants):
+    """
+    The srcset-ready form of a variants record, one source per format,
+    preferred format first:
+    {'width': w, 'height': h, 'sources': [{'type': 'image/webp', 'srcset': '<url> 160w, ...'}, ...]}
+    """
+    if not variants:
+        return None
+    return {
+        'width': variants['width'],
+        'height': variants['height'],
+        'sources': [
+            {
+                'type': VARIANT_FORMATS[extension][1],
+                'srcset': ', '.join(f"{variants['base']}_{width}.{extension} {width}w" for width in variants['widths']),
+            }
+            for extension in variants['formats'] if extension in VARIANT_FORMATS
+        ],
+    }
+
+
+_executor = None
+_pending = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor, _pending
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.IMAGE_WORKERS, thread_name_prefix='image-variants')
+            _pending = threading.BoundedSemaphore(settings.IMAGE_QUEUE_SIZE)
+        return _executor
+
+
+def schedule_variants(instance, bucket_key, url_field='image', variants_field='variants'):
+    """
+    Generates the variants of instance's just uploaded image in the image
+    worker pool once the current transaction commits, and saves them on the
+    instance. The worker downloads the stored object itself, so nothing of
+    the upload is held while the task waits. When IMAGE_QUEUE_SIZE tasks
+    are already waiting the image is skipped, generate_image_variants picks
+    it up later.
+    """
+    def generate():
+        try:
+            url = getattr(instance, url_field)
+            variants = create_variants(bucket_key, get_storage().get(url), image_stem(url))
+            setattr(instance, variants_field, variants)
+            # A save, not an UPDATE, so the signals invalidate what shows the image.
+            instance.save(update_fields=[variants_field])
+        except Exception:
+            logger.exception("Generating the variants of %s %s failed", type(instance).__name__, instance.pk)
+        finally:
+            _pending.release()
+            close_old_connections()
+
+    def submit():
+        executor = get_executor()
+        if not _pending.acquire(blocking=False):
+            logger.warning("Image variant queue is full, skipping %s %s", type(instance).__name__, instance.pk)
+            return
+        executor.submit(generate)
+
+    transaction.on_commit(submit)
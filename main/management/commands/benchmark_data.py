@@ -0,0 +1,39 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from main.benchmark import data
+
+
+class Command(BaseCommand):
+    help = 'Generates a deterministic synthetic catalog for benchmarks, or removes it with --flush.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=list(data.SCALES), default='small',
+                            help='Preset sizes, the options below override them.')
+        parser.add_argument('--users', type=int)
+        parser.add_argument('--stores', type=int)
+        parser.add_argument('--categories', type=int, help='Root categories, each with 3 subcategories of 2 leaves.')
+        parser.add_argument('--products', type=int)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--flush', action='store_true', help='Delete the generated data instead.')
+
+    def handle(self, *args, **options):
+        if options['flush']:
+            deleted = data.flush()
+            self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} benchmark rows.'))
+            return
+
+        if User.objects.filter(username__startswith=f'{data.PREFIX}-user-').exists():
+            raise CommandError('Benchmark data already exists, remove it first with --flush.')
+        sizes = {
+            name: options[name] if options[name] is not None else default
+            for name, default in data.SCALES[options['scale']].items()
+        }
+        if min(sizes.values()) < 1:
+            raise CommandError('Every size must be at least 1.')
+
+        counts = data.generate(**sizes, seed=options['seed'], batch_size=options['batch_size'], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(
+            'Created ' + ', '.join(f'{count} {model}' for model, count in sorted(counts.items())) + '.'
+        ))
@@ -0,0 +1,75 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from main.benchmark import data
+from main.benchmark.load import MIXES, LoadDriver
+from main.models import Category, Product, Store
+
+
+class Command(BaseCommand):
+    help = (
+        'Sends shopper traffic to a running server and reports requests per second and latency '
+        'percentiles per endpoint. Run benchmark_data first.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--mix', choices=list(MIXES), default='realistic')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--duration', type=float, default=None, help='Seconds to run for.')
+        parser.add_argument('--requests', type=int, default=None, help='Actions to run, 1000 by default.')
+        parser.add_argument('--users', type=int, default=50, help='Benchmark users the threads log in as.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', dest='json_path', default=None, help='Also write the summary to this file.')
+
+    def handle(self, *args, **options):
+        users = list(User.objects.filter(username__startswith=f'{data.PREFIX}-user-').order_by('pk')[:options['users']])
+        if not users:
+            raise CommandError('No benchmark data, run benchmark_data first.')
+        catalog = {
+            'category_slugs': list(Category.objects.filter(slug__startswith=f'{data.PREFIX}-').values_list('slug', flat=True)),
+            'product_ids': list(Product.objects.filter(aliexpress_id__startswith=f'{data.PREFIX}-')
+                                .order_by('pk').values_list('pk', flat=True)[:5000]),
+            'store_ids': list(Store.objects.filter(user__in=users).values_list('pk', flat=True))
+                         or list(Store.objects.values_list('pk', flat=True)[:10]),
+            'search_terms': data.SEARCH_TERMS,
+        }
+        tokens = [str(AccessToken.for_user(user)) for user in users]
+
+        driver = LoadDriver(options['base_url'], catalog, tokens, mix=options['mix'],
+                            concurrency=options['concurrency'], seed=options['seed'])
+        requests_limit = options['requests']
+        if requests_limit is None and options['duration'] is None:
+            requests_limit = 1000
+        self.stdout.write(f"Running the {options['mix']} mix against {options['base_url']} "
+                          f"with {options['concurrency']} threads...")
+        result = driver.run(duration=options['duration'], requests_limit=requests_limit)
+
+        summary = result.summary()
+        self.stdout.write(f"\n{'endpoint':<28} {'count':>7} {'errors':>6} {'req/s':>8} "
+                          f"{'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        for row in summary:
+            self.stdout.write(f"{row['endpoint']:<28} {row['count']:>7} {row['errors']:>6} {row['rps']:>8.1f} "
+                              f"{row['p50']:>8.1f} {row['p90']:>8.1f} {row['p99']:>8.1f} {row['max']:>8.1f}")
+
+        histogram = result.histogram()
+        peak = max(count for _, count in histogram) or 1
+        self.stdout.write('\nLatency histogram, all requests:')
+        for bound, count in histogram:
+            label = f'<= {bound:g} ms' if bound != float('inf') else '> 5000 ms'
+            self.stdout.write(f"{label:>12} {count:>7} {'#' * round(50 * count / peak)}")
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump({'mix': options['mix'], 'concurrency': options['concurrency'],
+                           'elapsed': result.elapsed, 'endpoints': summary}, f, indent=2)
+
+        total = summary[-1]
+        style = self.style.SUCCESS if not total['errors'] else self.style.WARNING
+        self.stdout.write(style(
+            f"\n{total['count']} requests in {result.elapsed:.1f}s, {total['rps']:.1f} req/s, "
+            f"p50 {total['p50']:.1f} ms, p99 {total['p99']:.1f} ms, {total['errors']} errors."
+        ))
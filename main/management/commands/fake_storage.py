@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from main.fake_storage import FakeObjectStorage
+
+
+class Command(BaseCommand):
+    help = 'Runs a local fake object storage, point SUPABASE_URL at it.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8002)
+
+    def handle(self, *args, **options):
+        storage = FakeObjectStorage(port=options['port'])
+        self.stdout.write(f'Fake object storage listening on {storage.url}')
+        try:
+            storage.serve_forever()
+        except KeyboardInterrupt:
+            storage.stop()
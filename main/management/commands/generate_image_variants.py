@@ -0,0 +1,74 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main.category_tree import invalidate_category_tree
+from main.images import create_variants, image_stem
+from main.models import CategoryImage, HeroImage, ProductImage, Store
+from main.signals import resources_changed, version_keys
+from main.storage import StorageError, get_storage
+
+# (model, bucket key, URL field, variants field)
+IMAGE_MODELS = [
+    (ProductImage, 'product_image', 'image', 'variants'),
+    (CategoryImage, 'category_image', 'image', 'variants'),
+    (HeroImage, 'hero_image', 'image', 'variants'),
+    (Store, 'store_logo', 'logo', 'logo_variants'),
+]
+
+
+class Command(BaseCommand):
+    help = 'Generates the resized variants of every stored image that has none yet.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Images processed concurrently.')
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for model, bucket_key, url_field, variants_field in IMAGE_MODELS:
+                done = failed = 0
+                missing = (
+                    model.objects.filter(**{f'{variants_field}__isnull': True})
+                    .exclude(**{url_field: ''}).exclude(**{f'{url_field}__isnull': True})
+                    .order_by('pk')
+                )
+                last_pk = 0
+                while True:
+                    batch = list(missing.filter(pk__gt=last_pk)[:options['batch_size']])
+                    if not batch:
+                        break
+                    last_pk = batch[-1].pk
+
+                    def generate(instance):
+                        url = getattr(instance, url_field)
+                        try:
+                            return create_variants(bucket_key, get_storage().get(url), image_stem(url))
+                        except (StorageError, OSError) as e:
+                            self.stderr.write(f'{model.__name__} {instance.pk}: {e}')
+                            return None
+
+                    updated = []
+                    for instance, variants in zip(batch, executor.map(generate, batch)):
+                        if variants is None:
+                            failed += 1
+                            continue
+                        setattr(instance, variants_field, variants)
+                        updated.append(instance)
+                    done += len(updated)
+                    self.save(model, updated, variants_field)
+
+                self.stdout.write(f'{model.__name__}: {done} generated, {failed} failed.')
+
+        self.stdout.write(self.style.SUCCESS('Image variants generated.'))
+
+    def save(self, model, instances, variants_field):
+        if not instances:
+            return
+        with transaction.atomic():
+            model.objects.bulk_update(instances, [variants_field])
+            # bulk_update sends no post_save, do what the signals would.
+            resources_changed({key for instance in instances for key in version_keys(instance)})
+            if model is CategoryImage:
+                transaction.on_commit(invalidate_category_tree)
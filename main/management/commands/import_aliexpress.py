@@ -0,0 +1,188 @@
+import csv
+import json
+import math
+import sys
+import time
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from main.category_tree import get_category_tree
+from main.models import Product, Store
+from main.search import index_products
+from main.signals import resources_changed
+from main.utils import get_default_store
+
+# Written on conflict, the store and is_active of an existing product are left alone.
+UPDATE_FIELDS = [
+    'name', 'description', 'specification', 'aliexpress_url', 'base_price', 'markup_percentage',
+    'unit_price', 'inventory', 'category', 'subcategory', 'sub_subcategory', 'is_dropshipping',
+]
+
+ALIEXPRESS_ID_LENGTH = Product._meta.get_field('aliexpress_id').max_length
+URL_LENGTH = Product._meta.get_field('aliexpress_url').max_length
+# Prices are DecimalField(max_digits=12, decimal_places=2).
+MAX_PRICE = Decimal(10) ** (
+    Product._meta.get_field('unit_price').max_digits - Product._meta.get_field('unit_price').decimal_places
+)
+
+
+class FeedError(ValueError):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Imports an AliExpress supplier feed (JSON lines or CSV), creating or updating products '
+        'by aliexpress_id. Columns: aliexpress_id, name, description, specification, base_price, '
+        'and optionally markup_percentage, inventory, aliexpress_url and category_id (the '
+        'AliExpress category id).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('feed', help='Path of the feed, - reads standard input.')
+        parser.add_argument('--format', choices=['jsonl', 'csv'], default=None,
+                            help='Defaults to the file extension, jsonl for standard input.')
+        parser.add_argument('--store', type=int, default=None, help='Store of new products, the default store otherwise.')
+        parser.add_argument('--markup', type=float, default=Product._meta.get_field('markup_percentage').default,
+                            help='Markup percentage of rows without one.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options['store'] is None:
+            store = get_default_store()
+            if store is None:
+                raise CommandError('There is no store to import into, pass --store.')
+        else:
+            store = Store.objects.filter(pk=options['store']).first()
+            if store is None:
+                raise CommandError(f"Store {options['store']} does not exist.")
+        self.store_id = store.pk
+        self.markup = options['markup']
+        if not math.isfinite(self.markup):
+            raise CommandError('--markup must be a finite number.')
+
+        # aliexpress_id: [category, subcategory, sub_subcategory] ids, from the root down.
+        tree = get_category_tree()
+        self.categories = {
+            node['aliexpress_id']: [ancestor['id'] for ancestor in tree.ancestors(node['id'])][:3]
+            for node in tree.nodes.values() if node['aliexpress_id']
+        }
+
+        feed_format = options['format']
+        if feed_format is None:
+            feed_format = 'csv' if options['feed'].lower().endswith('.csv') else 'jsonl'
+
+        totals = Counter()
+        started = time.monotonic()
+        feed = sys.stdin if options['feed'] == '-' else open(options['feed'], newline='', encoding='utf-8')
+        try:
+            batch = {}
+            for line, row in self.read(feed, feed_format):
+                try:
+                    product = self.build(row)
+                except FeedError as e:
+                    totals['skipped'] += 1
+                    self.stderr.write(f'Line {line}: {e}')
+                    continue
+                # A batch may only touch a product once, the last row wins.
+                batch[product.aliexpress_id] = product
+                if len(batch) >= options['batch_size']:
+                    self.save(list(batch.values()), totals, started)
+                    batch = {}
+            if batch:
+                self.save(list(batch.values()), totals, started)
+        finally:
+            if feed is not sys.stdin:
+                feed.close()
+
+        elapsed = time.monotonic() - started
+        rate = totals['imported'] / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {totals['imported']} products in {elapsed:.1f}s ({rate:.0f}/s), "
+            f"{totals['uncategorized']} without a known category, {totals['skipped']} rows skipped."
+        ))
+
+    def read(self, feed, feed_format):
+        """Yields (line number, row dict), one row at a time."""
+        if feed_format == 'csv':
+            reader = csv.DictReader(feed)
+            for row in reader:
+                yield reader.line_num, row
+            return
+        for line, text in enumerate(feed, 1):
+            if not text.strip():
+                continue
+            try:
+                row = json.loads(text)
+            except ValueError as e:
+                row = e
+            yield line, row
+
+    def build(self, row):
+        if not isinstance(row, dict):
+            raise FeedError(f'Not a JSON object: {row}')
+        aliexpress_id = str(row.get('aliexpress_id') or '').strip()
+        name = (row.get('name') or '').strip()
+        if not aliexpress_id or not name:
+            raise FeedError('aliexpress_id and name are required.')
+        if len(aliexpress_id) > ALIEXPRESS_ID_LENGTH:
+            raise FeedError(f'aliexpress_id is longer than {ALIEXPRESS_ID_LENGTH} characters.')
+        aliexpress_url = row.get('aliexpress_url') or None
+        if aliexpress_url is not None and len(str(aliexpress_url)) > URL_LENGTH:
+            raise FeedError(f'aliexpress_url is longer than {URL_LENGTH} characters.')
+
+        try:
+            base_price = Decimal(str(row.get('base_price')).strip())
+            markup = row.get('markup_percentage')
+            markup = float(markup) if markup not in (None, '') else self.markup
+            inventory = row.get('inventory')
+            inventory = int(inventory) if inventory not in (None, '') else None
+        except (InvalidOperation, TypeError, ValueError) as e:
+            raise FeedError(f'Invalid price, markup or inventory: {e!r}')
+        if not base_price.is_finite() or base_price < 0 or (inventory is not None and inventory < 0):
+            raise FeedError('base_price and inventory must not be negative.')
+        if not math.isfinite(markup):
+            raise FeedError('markup_percentage must be a finite number.')
+        unit_price = Product.calculate_unit_price(base_price, markup)
+        if base_price >= MAX_PRICE or not 0 <= unit_price < MAX_PRICE:
+            raise FeedError(f'base_price and unit_price must be between 0 and {MAX_PRICE}.')
+
+        category_ids = self.categories.get(str(row.get('category_id') or '').strip(), [])
+        category_ids = category_ids + [None] * (3 - len(category_ids))
+        return Product(
+            store_id=self.store_id,
+            aliexpress_id=aliexpress_id,
+            aliexpress_url=aliexpress_url,
+            name=name[:255],
+            description=row.get('description') or '',
+            specification=row.get('specification') or '',
+            is_dropshipping=True,
+            base_price=base_price,
+            markup_percentage=markup,
+            unit_price=unit_price,
+            inventory=inventory,
+            category_id=category_ids[0],
+            subcategory_id=category_ids[1],
+            sub_subcategory_id=category_ids[2],
+        )
+
+    def save(self, products, totals, started):
+        with transaction.atomic():
+            Product.objects.bulk_create(
+                products,
+                update_conflicts=True,
+                unique_fields=['aliexpress_id'],
+                update_fields=UPDATE_FIELDS,
+            )
+            product_ids = [product.pk for product in products]
+            # bulk_create sends no post_save, do what the signals would.
+            transaction.on_commit(lambda: index_products(product_ids))
+            resources_changed(['products'] + [f'product:{product_id}' for product_id in product_ids])
+
+        totals['imported'] += len(products)
+        totals['uncategorized'] += sum(1 for product in products if product.category_id is None)
+        elapsed = time.monotonic() - started
+        self.stdout.write(f"{totals['imported']} imported, {totals['imported'] / elapsed:.0f} products/s")
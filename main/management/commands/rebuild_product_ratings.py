@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from main.models import Product, ProductRating
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the stored rating count, sum and average of every product from ProductRating.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        totals = {
+            row['product_id']: (row['count'], row['total'])
+            for row in ProductRating.objects.order_by().values('product_id').annotate(
+                count=Count('id'), total=Sum('rating')
+            )
+        }
+
+        updated = []
+        with transaction.atomic():
+            # Products that lost all their ratings have to be reset as well.
+            Product.objects.exclude(pk__in=totals.keys()).exclude(rating_count=0).update(
+                rating_count=0, rating_sum=0, average_rating=0
+            )
+
+            for product_id, (count, total) in totals.items():
+                updated.append(Product(
+                    pk=product_id,
+                    rating_count=count,
+                    rating_sum=total,
+                    average_rating=total / count,
+                ))
+            Product.objects.bulk_update(
+                updated, ['rating_count', 'rating_sum', 'average_rating'], batch_size=batch_size
+            )
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rating totals for {len(updated)} products.'))
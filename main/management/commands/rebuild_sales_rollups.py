@@ -0,0 +1,46 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from main.models import Order, Store
+from main.sales import rebuild_sales
+
+
+class Command(BaseCommand):
+    help = ('Rebuilds the daily store and product sales rollups from the orders, '
+            'one transaction per chunk of days.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--store', type=int, help='Only rebuild the rollups of this store id.')
+        parser.add_argument('--since', type=date.fromisoformat, help='First day to rebuild (YYYY-MM-DD).')
+        parser.add_argument('--until', type=date.fromisoformat, help='Last day to rebuild (YYYY-MM-DD).')
+        parser.add_argument('--days', type=int, default=31, help='Days rebuilt per transaction.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        store = None
+        if options['store'] is not None:
+            store = Store.objects.filter(pk=options['store']).first()
+            if store is None:
+                raise CommandError(f"Store {options['store']} does not exist.")
+        if options['days'] < 1:
+            raise CommandError('--days must be at least 1.')
+
+        orders = Order.objects.all() if store is None else Order.objects.filter(store=store)
+        bounds = orders.aggregate(first=Min('created_at'), last=Max('created_at'))
+        if bounds['first'] is None and options['since'] is None:
+            self.stdout.write('No orders to roll up.')
+            return
+        start = options['since'] or timezone.localdate(bounds['first'])
+        end = (options['until'] or timezone.localdate(bounds['last'] or timezone.now())) + timedelta(days=1)
+
+        written = 0
+        while start < end:
+            chunk_end = min(start + timedelta(days=options['days']), end)
+            written += rebuild_sales(start, chunk_end, store=store, batch_size=options['batch_size'])
+            self.stdout.write(f'{start} to {chunk_end - timedelta(days=1)}: {written} store days')
+            start = chunk_end
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} store days of sales rollups.'))
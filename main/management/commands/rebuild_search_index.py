@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from main.search import index_products
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the search document of every product.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        written = index_products(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {written} products.'))
@@ -0,0 +1,59 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.models import Category, Store
+from main.pricing import reprice
+
+
+class Command(BaseCommand):
+    help = (
+        'Sets the markup of dropshipped products and recalculates their unit price in one UPDATE. '
+        'The products can be narrowed by store, category subtree and base price band.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('markup', type=float, help='New markup percentage.')
+        parser.add_argument('--store', type=int, default=None)
+        parser.add_argument('--category', default=None, help='Category id or slug, its subcategories are included.')
+        parser.add_argument('--min-price', type=Decimal, default=None, help='Lowest base price, inclusive.')
+        parser.add_argument('--max-price', type=Decimal, default=None, help='Highest base price, exclusive.')
+        parser.add_argument('--dry-run', action='store_true', help='Only show what would change.')
+        parser.add_argument('--show', type=int, default=20, help='Number of changes to list.')
+
+    def handle(self, *args, **options):
+        store = category = None
+        if options['store'] is not None:
+            store = Store.objects.filter(pk=options['store']).first()
+            if store is None:
+                raise CommandError(f"Store {options['store']} does not exist.")
+        if options['category'] is not None:
+            lookup = {'pk': options['category']} if options['category'].isdigit() else {'slug': options['category']}
+            category = Category.objects.filter(**lookup).first()
+            if category is None:
+                raise CommandError(f"Category {options['category']} does not exist.")
+
+        diff = reprice(
+            options['markup'],
+            store=store,
+            category=category,
+            min_base_price=options['min_price'],
+            max_base_price=options['max_price'],
+            dry_run=options['dry_run'],
+            sample_size=options['show'],
+        )
+
+        for change in diff['changes']:
+            self.stdout.write(
+                f"{change['product']:>8}  {change['old_unit_price']:>12} -> {change['new_unit_price']:<12} {change['name']}"
+            )
+        if diff['count'] > len(diff['changes']):
+            self.stdout.write(f"... and {diff['count'] - len(diff['changes'])} more")
+
+        summary = (
+            f"{diff['count']} products, unit price total {diff['old_total']} -> {diff['new_total']}"
+        )
+        if options['dry_run']:
+            self.stdout.write(f'Dry run, nothing changed: {summary}.')
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Repricing {diff['repricing']} applied to {summary}."))
@@ -0,0 +1,71 @@
+from django.db import transaction
+from django.db.models import Case, F, When
+
+from .models import Conversation, ConversationMember, Message
+
+
+def conversation_key(sender, receiver_user=None, receiver_store=None):
+    """The Conversation.key of the thread between sender and a user or a store."""
+    if receiver_store is not None:
+        return f'store:{receiver_store.pk}:{sender.pk}'
+    low, high = sorted([sender.pk, receiver_user.pk])
+    return f'user:{low}:{high}'
+
+
+def get_conversation(sender, receiver_user=None, receiver_store=None):
+    """The thread between sender and receiver_user or receiver_store, created on first use."""
+    conversation, created = Conversation.objects.get_or_create(
+        key=conversation_key(sender, receiver_user, receiver_store), defaults={'store': receiver_store},
+    )
+    if created:
+        # The store side of a thread is its owner.
+        other = receiver_store.user_id if receiver_store is not None else receiver_user.pk
+        ConversationMember.objects.bulk_create([
+            ConversationMember(conversation=conversation, user_id=user_id, last_message_at=conversation.last_message_at)
+            for user_id in sorted({sender.pk, other})
+        ])
+    return conversation
+
+
+def send_message(conversation, sender, content):
+    """
+    Appends a message from sender, who must be a member, to conversation.
+    The thread's last message and every other member's unread count are
+    moved with one UPDATE each, however long the thread is.
+    """
+    kind, first, second = conversation.key.split(':')
+    if kind == 'store' and sender.pk == int(second):
+        receivers = {'receiver_store_id': int(first)}
+    elif kind == 'store':
+        receivers = {'receiver_user_id': int(second)}
+    else:
+        receivers = {'receiver_user_id': int(first) if sender.pk == int(second) else int(second)}
+
+    with transaction.atomic():
+        message = Message.objects.create(conversation=conversation, sender=sender, content=content, **receivers)
+        Conversation.objects.filter(pk=conversation.pk).update(last_message=message, last_message_at=message.timestamp)
+        ConversationMember.objects.filter(conversation=conversation).update(
+            last_message_at=message.timestamp,
+            unread_count=Case(When(user=sender, then=F('unread_count')), default=F('unread_count') + 1),
+        )
+    conversation.last_message, conversation.last_message_at = message, message.timestamp
+    return message
+
+
+def mark_read(user, conversation_ids=None):
+    """
+    Marks the conversations of user (all of them unless conversation_ids
+    are given) read, with one UPDATE of the unread counters and one UPDATE
+    of the messages. Returns the number of messages marked.
+    """
+    members = ConversationMember.objects.filter(user=user)
+    messages = Message.objects.filter(conversation__members__user=user, is_read=False).exclude(sender=user)
+    if conversation_ids is not None:
+        members = members.filter(conversation_id__in=conversation_ids)
+        messages = messages.filter(conversation_id__in=conversation_ids)
+
+    with transaction.atomic():
+        # Counters first: a message sent meanwhile waits for this transaction
+        # and is counted again afterwards, rather than being lost.
+        members.filter(unread_count__gt=0).update(unread_count=0)
+        return messages.update(is_read=True)
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.6 on 2026-10-18 11:33
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def populate_rating_totals(apps, schema_editor):
+    Product = apps.get_model('main', 'Product')
+    ProductRating = apps.get_model('main', 'ProductRating')
+
+    rows = ProductRating.objects.order_by().values('product_id').annotate(count=Count('id'), total=Sum('rating'))
+    products = [
+        Product(pk=row['product_id'], rating_count=row['count'], rating_sum=row['total'],
+                average_rating=row['total'] / row['count'])
+        for row in rows
+    ]
+    Product.objects.bulk_update(products, ['rating_count', 'rating_sum', 'average_rating'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='average_rating',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_rating_totals, migrations.RunPython.noop),
+    ]
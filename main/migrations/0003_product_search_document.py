@@ -0,0 +1,115 @@
+# Generated by Django 5.1.6 on 2026-10-18 11:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+POSTGRESQL_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """
+    ALTER TABLE main_productsearchdocument ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(categories, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(body, '')), 'C')
+    ) STORED
+    """,
+    "CREATE INDEX main_productsearch_vector_idx ON main_productsearchdocument USING gin (search_vector)",
+    "CREATE INDEX main_productsearch_name_trgm_idx ON main_productsearchdocument USING gin (name gin_trgm_ops)",
+]
+
+POSTGRESQL_REVERSE = [
+    "DROP INDEX IF EXISTS main_productsearch_name_trgm_idx",
+    "DROP INDEX IF EXISTS main_productsearch_vector_idx",
+    "ALTER TABLE main_productsearchdocument DROP COLUMN IF EXISTS search_vector",
+]
+
+# External content FTS5 table, the triggers keep it in sync with the document table.
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE main_productsearch_fts USING fts5(
+        name, categories, body,
+        content='main_productsearchdocument', content_rowid='product_id',
+        tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER main_productsearch_ai AFTER INSERT ON main_productsearchdocument BEGIN
+        INSERT INTO main_productsearch_fts(rowid, name, categories, body)
+        VALUES (new.product_id, new.name, new.categories, new.body);
+    END
+    """,
+    """
+    CREATE TRIGGER main_productsearch_ad AFTER DELETE ON main_productsearchdocument BEGIN
+        INSERT INTO main_productsearch_fts(main_productsearch_fts, rowid, name, categories, body)
+        VALUES ('delete', old.product_id, old.name, old.categories, old.body);
+    END
+    """,
+    """
+    CREATE TRIGGER main_productsearch_au AFTER UPDATE ON main_productsearchdocument BEGIN
+        INSERT INTO main_productsearch_fts(main_productsearch_fts, rowid, name, categories, body)
+        VALUES ('delete', old.product_id, old.name, old.categories, old.body);
+        INSERT INTO main_productsearch_fts(rowid, name, categories, body)
+        VALUES (new.product_id, new.name, new.categories, new.body);
+    END
+    """,
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS main_productsearch_au",
+    "DROP TRIGGER IF EXISTS main_productsearch_ad",
+    "DROP TRIGGER IF EXISTS main_productsearch_ai",
+    "DROP TABLE IF EXISTS main_productsearch_fts",
+]
+
+
+def run_vendor_sql(statements):
+    def run(apps, schema_editor):
+        vendor_statements = statements.get(schema_editor.connection.vendor, [])
+        for statement in vendor_statements:
+            schema_editor.execute(statement)
+    return run
+
+
+def populate_documents(apps, schema_editor):
+    Product = apps.get_model('main', 'Product')
+    ProductSearchDocument = apps.get_model('main', 'ProductSearchDocument')
+
+    rows = Product.objects.values('id', 'name', 'description', 'specification', 'category__name',
+                                  'subcategory__name', 'sub_subcategory__name')
+    documents = [
+        ProductSearchDocument(
+            product_id=row['id'],
+            name=row['name'],
+            categories=' '.join(filter(None, [row['category__name'], row['subcategory__name'],
+                                              row['sub_subcategory__name']])),
+            body=f"{row['description']}\n{row['specification']}",
+        )
+        for row in rows.iterator()
+    ]
+    ProductSearchDocument.objects.bulk_create(documents, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0002_product_rating_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchDocument',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='main.product')),
+                ('name', models.CharField(max_length=255)),
+                ('categories', models.TextField(blank=True)),
+                ('body', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(
+            run_vendor_sql({'postgresql': POSTGRESQL_FORWARD, 'sqlite': SQLITE_FORWARD}),
+            run_vendor_sql({'postgresql': POSTGRESQL_REVERSE, 'sqlite': SQLITE_REVERSE}),
+        ),
+        migrations.RunPython(populate_documents, migrations.RunPython.noop),
+    ]
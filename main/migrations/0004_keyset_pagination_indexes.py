@@ -0,0 +1,55 @@
+# Generated by Django 5.1.6 on 2026-10-18 11:38
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_product_search_document'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['timestamp', 'id'], name='message_timestamp_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='order_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['store', 'created_at', 'id'], name='order_store_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['date_created', 'id'], name='product_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['unit_price', 'id'], name='product_price_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productrating',
+            index=models.Index(fields=['product', 'date_created', 'id'], name='productrating_product_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productreview',
+            index=models.Index(fields=['product', 'date_created', 'id'], name='productreview_product_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='store',
+            index=models.Index(fields=['name', 'id'], name='store_name_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='storerating',
+            index=models.Index(fields=['store', 'date_created', 'id'], name='storerating_store_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='storereview',
+            index=models.Index(fields=['store', 'date_created', 'id'], name='storereview_store_date_idx'),
+        ),
+    ]
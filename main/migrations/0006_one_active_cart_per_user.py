@@ -0,0 +1,45 @@
+# Generated by Django 5.1.6 on 2026-10-18 11:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def merge_active_carts(apps, schema_editor):
+    """Keeps the newest active cart of each user and merges the others into it."""
+    Cart = apps.get_model('main', 'Cart')
+    CartItem = apps.get_model('main', 'CartItem')
+
+    duplicated = (
+        Cart.objects.filter(status='active').values('user').annotate(n=models.Count('id')).filter(n__gt=1)
+        .values_list('user', flat=True)
+    )
+    for user_id in duplicated:
+        carts = list(Cart.objects.filter(user_id=user_id, status='active').order_by('-created_at', '-id'))
+        keep, others = carts[0], carts[1:]
+        items = {item.product_id: item for item in CartItem.objects.filter(cart=keep)}
+        for item in CartItem.objects.filter(cart__in=others).order_by('id'):
+            if item.product_id in items:
+                items[item.product_id].quantity += item.quantity
+                items[item.product_id].save(update_fields=['quantity'])
+                item.delete()
+            else:
+                item.cart = keep
+                item.save(update_fields=['cart'])
+                items[item.product_id] = item
+        Cart.objects.filter(pk__in=[cart.pk for cart in others]).update(status='inactive')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_resource_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_active_carts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'active')), fields=('user',), name='one_active_cart_per_user'),
+        ),
+    ]
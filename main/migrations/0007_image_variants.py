@@ -0,0 +1,33 @@
+# Generated by Django 5.1.6 on 2026-10-18 11:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_one_active_cart_per_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='categoryimage',
+            name='variants',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='heroimage',
+            name='variants',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='variants',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='store',
+            name='logo_variants',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
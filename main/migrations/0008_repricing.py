@@ -0,0 +1,41 @@
+# Generated by Django 5.1.6 on 2026-10-18 11:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_image_variants'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Repricing',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('markup_percentage', models.FloatField()),
+                ('min_base_price', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('max_base_price', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('product_count', models.PositiveIntegerField(default=0)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='main.category')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('store', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='main.store')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PriceChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('old_unit_price', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('old_markup_percentage', models.FloatField()),
+                ('new_unit_price', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='price_changes', to='main.product')),
+                ('repricing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='price_changes', to='main.repricing')),
+            ],
+        ),
+    ]
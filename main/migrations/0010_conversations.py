@@ -0,0 +1,108 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:16
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_conversations(apps, schema_editor):
+    """Files the existing messages into conversations, see main.messaging.conversation_key."""
+    Conversation = apps.get_model('main', 'Conversation')
+    ConversationMember = apps.get_model('main', 'ConversationMember')
+    Message = apps.get_model('main', 'Message')
+    Store = apps.get_model('main', 'Store')
+
+    store_owners = dict(Store.objects.values_list('pk', 'user_id'))
+    threads = {}
+    for message in Message.objects.order_by('timestamp', 'pk').values(
+        'pk', 'sender_id', 'receiver_user_id', 'receiver_store_id', 'is_read', 'timestamp'
+    ).iterator():
+        if message['receiver_store_id'] is not None:
+            key = f"store:{message['receiver_store_id']}:{message['sender_id']}"
+            members = {message['sender_id'], store_owners[message['receiver_store_id']]}
+        elif message['receiver_user_id'] is not None:
+            low, high = sorted([message['sender_id'], message['receiver_user_id']])
+            key = f'user:{low}:{high}'
+            members = {low, high}
+        else:
+            continue
+        thread = threads.setdefault(key, {
+            'store_id': message['receiver_store_id'], 'messages': [], 'unread': dict.fromkeys(members, 0),
+        })
+        thread['messages'].append(message['pk'])
+        thread['last'] = message
+        if not message['is_read']:
+            for user_id in thread['unread']:
+                if user_id != message['sender_id']:
+                    thread['unread'][user_id] += 1
+
+    for key, thread in threads.items():
+        last = thread['last']
+        conversation = Conversation.objects.create(
+            key=key, store_id=thread['store_id'], last_message_id=last['pk'], last_message_at=last['timestamp'],
+        )
+        ConversationMember.objects.bulk_create([
+            ConversationMember(conversation=conversation, user_id=user_id, unread_count=unread,
+                               last_message_at=last['timestamp'])
+            for user_id, unread in thread['unread'].items()
+        ])
+        Message.objects.filter(pk__in=thread['messages']).update(conversation=conversation)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_sales_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationMember',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('last_message_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100, unique=True)),
+                ('last_message_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='main.message')),
+                ('store', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to='main.store')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='conversation',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='main.conversation'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', '-timestamp', '-id'], name='message_conversation_idx'),
+        ),
+        migrations.AddField(
+            model_name='conversationmember',
+            name='conversation',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='members', to='main.conversation'),
+        ),
+        migrations.AddField(
+            model_name='conversationmember',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversation_memberships', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='conversationmember',
+            index=models.Index(fields=['user', '-last_message_at', '-id'], name='member_inbox_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='conversationmember',
+            constraint=models.UniqueConstraint(fields=('conversation', 'user'), name='one_membership_per_conversation'),
+        ),
+        migrations.RunPython(create_conversations, migrations.RunPython.noop),
+    ]
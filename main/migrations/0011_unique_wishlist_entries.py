@@ -0,0 +1,27 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:23
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def remove_duplicates(apps, schema_editor):
+    """Keeps the oldest entry of every (user, product) pair."""
+    WishList = apps.get_model('main', 'WishList')
+    keep = WishList.objects.values('user', 'product').annotate(first=models.Min('id')).values('first')
+    WishList.objects.exclude(id__in=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_conversations'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='wishlist',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='one_wishlist_entry_per_product'),
+        ),
+    ]
@@ -1,7 +1,9 @@
 import uuid
-from django.db import models
+from decimal import ROUND_HALF_UP, Decimal
+from django.db import connection, models
 from django.contrib.auth.models import User
 from django.db.models import Avg
+from django.utils import timezone
 from django.utils.text import slugify
 
 
@@ -10,6 +12,7 @@ class Store(models.Model):
     name = models.CharField(max_length=150)
     description = models.TextField()
     logo = models.URLField(max_length=500, blank=True, null=True)
+    logo_variants = models.JSONField(null=True, blank=True, editable=False)
     contact_info = models.CharField(max_length=300)
     address = models.CharField(max_length=300)
     date_created = models.DateTimeField(auto_now_add=True)
@@ -18,6 +21,9 @@ class Store(models.Model):
 
     class Meta:
         ordering = ['name']
+        indexes = [
+            models.Index(fields=['name', 'id'], name='store_name_id_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -47,6 +53,9 @@ class StoreRating(models.Model):
     class Meta:
         unique_together = ('store', 'user')
         ordering = ['-date_created']
+        indexes = [
+            models.Index(fields=['store', 'date_created', 'id'], name='storerating_store_date_idx'),
+        ]
 
     def __str__(self):
         return f'{self.store} - {self.user}: {self.rating}'
@@ -59,6 +68,11 @@ class StoreReview(models.Model):
 
     objects = models.Manager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['store', 'date_created', 'id'], name='storereview_store_date_idx'),
+        ]
+
     def __str__(self):
         return f'{self.store}-{self.review}'
 
@@ -95,6 +109,8 @@ class Category(models.Model):
 class CategoryImage(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='category_images')
     image = models.URLField(max_length=500, blank=True, null=True)
+    # Resized and WebP copies, see main.images.create_variants.
+    variants = models.JSONField(null=True, blank=True, editable=False)
 
     objects = models.Manager()
 
@@ -103,6 +119,8 @@ class HeroImage(models.Model):
     title = models.CharField(max_length=255, blank=True, null=True)
     description = models.TextField(blank=True, null=True)
     image = models.URLField(max_length=500, blank=True, null=True)
+    # Resized and WebP copies, see main.images.create_variants.
+    variants = models.JSONField(null=True, blank=True, editable=False)
     link = models.URLField(blank=True, null=True)
     active = models.BooleanField(default=True)
     ordering = models.PositiveIntegerField(default=0)
@@ -144,26 +162,78 @@ class Product(models.Model):
     is_active = models.BooleanField(default=True)
     date_created = models.DateTimeField(auto_now_add=True)
 
+    # Rating aggregates, kept in sync by ProductRatingViewSet and rebuilt
+    # with the rebuild_product_ratings management command.
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    average_rating = models.FloatField(default=0, editable=False)
+
     objects = models.Manager()
 
-    @property
-    def average_rating(self):
-        result = self.product_ratings.aggregate(average=Avg('rating'))
-        return result['average'] or 0
+    class Meta:
+        indexes = [
+            models.Index(fields=['date_created', 'id'], name='product_created_id_idx'),
+            models.Index(fields=['unit_price', 'id'], name='product_price_id_idx'),
+        ]
+
+    @classmethod
+    def update_rating_totals(cls, product_id, count_delta, sum_delta):
+        """
+        Applies a rating change to the stored aggregates of one product.
+        Must be called inside a transaction, the product row stays locked until it commits.
+        """
+        product = cls.objects.select_for_update().only('rating_count', 'rating_sum').get(pk=product_id)
+        rating_count = max(product.rating_count + count_delta, 0)
+        rating_sum = max(product.rating_sum + sum_delta, 0) if rating_count else 0
+        cls.objects.filter(pk=product_id).update(
+            rating_count=rating_count,
+            rating_sum=rating_sum,
+            average_rating=rating_sum / rating_count if rating_count else 0,
+        )
+
+    @staticmethod
+    def calculate_unit_price(base_price, markup_percentage):
+        """The selling price of a dropshipped product, rounded to the cent."""
+        base_price = Decimal(str(base_price))
+        markup = Decimal(str(markup_percentage))
+        return (base_price * (100 + markup) / 100).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
 
     def save(self, *args, **kwargs):
 
         if self.is_dropshipping and self.base_price:
-            self.unit_price = self.base_price * (1 + self.markup_percentage / 100)
+            self.unit_price = self.calculate_unit_price(self.base_price, self.markup_percentage)
         super().save(*args, **kwargs)
 
     def __str__(self):
         return f'{self.name} - {self.unit_price} - {self.is_active}'
 
 
+class ProductSearchDocument(models.Model):
+    """
+    Searchable text of a product, maintained by main.search.
+
+    Migration 0003 adds the database specific index on top of this table: a
+    weighted tsvector column with GIN and trigram indexes on PostgreSQL, an
+    FTS5 table kept in sync by triggers on SQLite.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True,
+                                   related_name='search_document')
+    name = models.CharField(max_length=255)
+    categories = models.TextField(blank=True)
+    body = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = models.Manager()
+
+    def __str__(self):
+        return self.name
+
+
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='product_images')
     image = models.URLField(max_length=500, blank=True, null=True)
+    # Resized and WebP copies, see main.images.create_variants.
+    variants = models.JSONField(null=True, blank=True, editable=False)
 
 
     objects = models.Manager()
@@ -197,6 +267,11 @@ class ProductRating(models.Model):
 
     objects = models.Manager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'date_created', 'id'], name='productrating_product_date_idx'),
+        ]
+
     def __str__(self):
         return f'{self.product}-{self.rating}'
 
@@ -209,10 +284,64 @@ class ProductReview(models.Model):
 
     objects = models.Manager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'date_created', 'id'], name='productreview_product_date_idx'),
+        ]
+
     def __str__(self):
         return f'{self.product}-{self.review}'
 
 
+class Repricing(models.Model):
+    """
+    One markup rule applied by main.pricing.reprice, with the prices it
+    replaced in its price_changes.
+    """
+    markup_percentage = models.FloatField()
+    store = models.ForeignKey(Store, on_delete=models.SET_NULL, null=True, blank=True)
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True)
+    min_base_price = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    max_base_price = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    product_count = models.PositiveIntegerField(default=0)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+
+    objects = models.Manager()
+
+    def __str__(self):
+        return f'Repricing {self.pk} - {self.markup_percentage}% - {self.product_count} products'
+
+
+class PriceChange(models.Model):
+    repricing = models.ForeignKey(Repricing, on_delete=models.CASCADE, related_name='price_changes')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='price_changes')
+    old_unit_price = models.DecimalField(max_digits=12, decimal_places=2)
+    old_markup_percentage = models.FloatField()
+    new_unit_price = models.DecimalField(max_digits=12, decimal_places=2)
+
+    objects = models.Manager()
+
+    def __str__(self):
+        return f'{self.product_id}: {self.old_unit_price} -> {self.new_unit_price}'
+
+
+class CartManager(models.Manager):
+    def get_active(self, user, store=None):
+        """
+        Returns the user's active cart, creating it for store (the default
+        store when omitted) if there is none. The one_active_cart_per_user
+        constraint makes concurrent first adds converge on the same cart.
+        """
+        cart = self.filter(user=user, status=Cart.STATUS_ACTIVE).first()
+        if cart is None:
+            if store is None:
+                store = Store.objects.first()
+            self.bulk_create([self.model(user=user, store=store)], ignore_conflicts=True)
+            cart = self.get(user=user, status=Cart.STATUS_ACTIVE)
+        return cart
+
+
 class Cart(models.Model):
     STATUS_ACTIVE = "active"
     STATUS_INACTIVE = "inactive"
@@ -228,7 +357,14 @@ class Cart(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_ACTIVE)
 
-    objects = models.Manager()
+    objects = CartManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user'], condition=models.Q(status='active'), name='one_active_cart_per_user'
+            ),
+        ]
 
     def __str__(self):
         return f'{self.user} - {self.status}'
@@ -238,6 +374,88 @@ class Cart(models.Model):
         return sum(item.total_price for item in self.cart_items.all())
 
 
+class CartItemManager(models.Manager):
+    def add(self, user, product_id, quantity):
+        """
+        Adds quantity of a product to the user's active cart and returns the
+        id of the cart item, or None when the product doesn't exist.
+
+        One INSERT ... SELECT ... ON CONFLICT DO UPDATE statement resolves the
+        cart and the product, and inserts the item or bumps its quantity.
+        Only the first add of a new cart costs more queries.
+        """
+        item_id = self._upsert(user, product_id, quantity)
+        if item_id is None:
+            Cart.objects.get_active(user)
+            item_id = self._upsert(user, product_id, quantity)
+        return item_id
+
+    def _upsert(self, user, product_id, quantity):
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        sql = (
+            f"INSERT INTO {table} (cart_id, product_id, quantity, updated_at) "
+            f"SELECT c.id, p.id, %s, %s FROM {qn(Cart._meta.db_table)} c, {qn(Product._meta.db_table)} p "
+            f"WHERE c.user_id = %s AND c.status = %s AND p.id = %s "
+            f"ON CONFLICT (cart_id, product_id) DO UPDATE "
+            f"SET quantity = {table}.quantity + EXCLUDED.quantity, updated_at = EXCLUDED.updated_at "
+            f"RETURNING id"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [quantity, timezone.now(), user.pk, Cart.STATUS_ACTIVE, product_id])
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def apply(self, cart, operations):
+        """
+        Applies (op, product_id, quantity) operations to cart, op being 'add',
+        'set' or 'remove', in order. The operations are first folded into one
+        outcome per product, then written with at most one DELETE, one
+        overwriting upsert and one incrementing upsert. Products must exist.
+        """
+        deltas, targets = {}, {}
+        for op, product_id, quantity in operations:
+            if op == 'add':
+                if product_id in targets:
+                    targets[product_id] += quantity
+                else:
+                    deltas[product_id] = deltas.get(product_id, 0) + quantity
+            else:
+                deltas.pop(product_id, None)
+                targets[product_id] = quantity if op == 'set' else 0
+
+        removed = [product_id for product_id, quantity in targets.items() if quantity <= 0]
+        if removed:
+            self.filter(cart=cart, product_id__in=removed).delete()
+
+        now = timezone.now()
+        overwritten = [
+            self.model(cart=cart, product_id=product_id, quantity=quantity, updated_at=now)
+            for product_id, quantity in targets.items() if quantity > 0
+        ]
+        if overwritten:
+            self.bulk_create(
+                overwritten, update_conflicts=True,
+                unique_fields=['cart', 'product'], update_fields=['quantity', 'updated_at'],
+            )
+
+        if deltas:
+            qn = connection.ops.quote_name
+            table = qn(self.model._meta.db_table)
+            cart_id = Cart._meta.pk.get_db_prep_value(cart.pk, connection)
+            params = []
+            for product_id, quantity in deltas.items():
+                params += [cart_id, product_id, quantity, now]
+            sql = (
+                f"INSERT INTO {table} (cart_id, product_id, quantity, updated_at) "
+                f"VALUES {', '.join(['(%s, %s, %s, %s)'] * len(deltas))} "
+                f"ON CONFLICT (cart_id, product_id) DO UPDATE "
+                f"SET quantity = {table}.quantity + EXCLUDED.quantity, updated_at = EXCLUDED.updated_at"
+            )
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+
+
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='cart_items')
     product = models.ForeignKey('Product', on_delete=models.SET_NULL, null=True, blank=True)
@@ -252,17 +470,14 @@ class CartItem(models.Model):
         return self.product.unit_price * self.quantity if self.product else 0
 
     def save(self, *args, **kwargs):
+        # Adds go through CartItem.objects.add, (cart, product) is unique.
         if self.quantity <= 0:
-            self.delete()
-            return
-        existing_item = CartItem.objects.filter(cart=self.cart, product=self.product).exclude(id=self.id).first()
-        if existing_item:
-            existing_item.quantity += self.quantity
-            existing_item.save()  # Call save() properly to update the existing item
+            if self.pk:
+                self.delete()
             return
         super().save(*args, **kwargs)
 
-    objects = models.Manager()
+    objects = CartItemManager()
 
     def __str__(self):
         return f'{self.product} - {self.quantity}'
@@ -298,10 +513,26 @@ class Order(models.Model):
 
     objects = models.Manager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='order_user_created_idx'),
+            models.Index(fields=['store', 'created_at', 'id'], name='order_store_created_idx'),
+        ]
+
     @property
     def calculated_total_price(self):
         return sum(item.total_price for item in self.order_items.all())
 
+    # Orders in these statuses are paid for and count in the sales rollups.
+    SALE_STATUSES = (STATUS_PROCESSING, STATUS_SHIPPED, STATUS_DELIVERED)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The stored status, so a save can tell whether the order became or stopped being a sale.
+        instance.loaded_status = instance.__dict__.get('status')
+        return instance
+
     def save(self, *args, **kwargs):
         if not self.order_reference:
             self.order_reference = f'ORD-{uuid.uuid4().hex[:8]}'
@@ -329,12 +560,102 @@ class OrderItem(models.Model):
         return f'{self.order} - {self.quantity}'
 
 
+class StoreDailySales(models.Model):
+    """
+    Sales of a store on one day (of Order.created_at), maintained
+    incrementally by main.sales and rebuilt by rebuild_sales_rollups.
+    """
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='daily_sales')
+    date = models.DateField()
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    order_count = models.IntegerField(default=0)
+    units_sold = models.IntegerField(default=0)
+
+    objects = models.Manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['store', 'date'], name='one_sales_rollup_per_store_day'),
+        ]
+
+    def __str__(self):
+        return f'{self.store_id} {self.date}: {self.revenue}'
+
+
+class ProductDailySales(models.Model):
+    """Sales of a product on one day, the per-product breakdown of StoreDailySales."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='product_daily_sales')
+    date = models.DateField()
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    order_count = models.IntegerField(default=0)
+    units_sold = models.IntegerField(default=0)
+
+    objects = models.Manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'date'], name='one_sales_rollup_per_product_day'),
+        ]
+        indexes = [
+            models.Index(fields=['store', 'date'], name='productsales_store_date_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id} {self.date}: {self.revenue}'
+
+
 
 
     
 
 
+class Conversation(models.Model):
+    """
+    A message thread between two users, or between a customer and a store.
+    Each participant has a ConversationMember row, which carries their
+    unread count and is what their inbox lists. Written by main.messaging.
+    """
+    # 'user:<lower id>:<higher id>' or 'store:<store id>:<customer id>', see main.messaging.conversation_key.
+    key = models.CharField(max_length=100, unique=True)
+    store = models.ForeignKey(Store, null=True, blank=True, on_delete=models.CASCADE, related_name='conversations')
+    last_message = models.ForeignKey(
+        'Message', null=True, blank=True, on_delete=models.SET_NULL, related_name='+'
+    )
+    last_message_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = models.Manager()
+
+    def __str__(self):
+        return self.key
+
+
+class ConversationMember(models.Model):
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='members')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversation_memberships')
+    unread_count = models.PositiveIntegerField(default=0)
+    # Copy of Conversation.last_message_at, so an inbox page is one index range.
+    last_message_at = models.DateTimeField(default=timezone.now)
+
+    objects = models.Manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['conversation', 'user'], name='one_membership_per_conversation'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-last_message_at', '-id'], name='member_inbox_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} in {self.conversation}'
+
+
 class Message(models.Model):
+    conversation = models.ForeignKey(
+        Conversation, null=True, blank=True, on_delete=models.CASCADE, related_name='messages'
+    )
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
     receiver_user = models.ForeignKey(
         User, null=True, blank=True, on_delete=models.CASCADE, related_name='received_messages'
@@ -346,6 +667,12 @@ class Message(models.Model):
     is_read = models.BooleanField(default=False)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['timestamp', 'id'], name='message_timestamp_id_idx'),
+            models.Index(fields=['conversation', '-timestamp', '-id'], name='message_conversation_idx'),
+        ]
+
     @property
     def receiver(self):
         # Return whichever receiver is set
@@ -369,11 +696,32 @@ class WishList(models.Model):
 
     objects = models.Manager()
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='one_wishlist_entry_per_product'),
+        ]
+
     def __str__(self):
         return f'{self.user}-{self.product}-{self.date_added}'
 
 
 
+class ResourceVersion(models.Model):
+    """
+    Version stamp of a cached resource ('product:12') or collection
+    ('products'), bumped on every write by main.versioning. Conditional GETs
+    are answered from these rows instead of rebuilding the response.
+    """
+    key = models.CharField(max_length=100, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = models.Manager()
+
+    def __str__(self):
+        return f'{self.key}@{self.version}'
+
+
 class Payment(models.Model):
     STATUS_PENDING = 'pending'
     STATUS_SUCCESSFUL = 'successful'
@@ -0,0 +1,143 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import connection, transaction
+from django.db.models import BigIntegerField, Count, DecimalField, F, Func, IntegerField, Q, Sum, Value
+from django.db.models.functions import Cast, Round
+
+from .category_tree import get_category_tree
+from .models import PriceChange, Product, Repricing
+from .signals import resources_changed
+
+
+def repricing_scope(store=None, category=None, min_base_price=None, max_base_price=None):
+    """
+    The dropshipped products a markup rule applies to: those of store, in
+    the subtree of category, with min_base_price <= base_price < max_base_price.
+    """
+    products = Product.objects.filter(is_dropshipping=True, base_price__isnull=False)
+    if store is not None:
+        products = products.filter(store=store)
+    if category is not None:
+        category_ids = get_category_tree().descendants(category.pk)
+        products = products.filter(
+            Q(category_id__in=category_ids) | Q(subcategory_id__in=category_ids) | Q(sub_subcategory_id__in=category_ids)
+        )
+    if min_base_price is not None:
+        products = products.filter(base_price__gte=min_base_price)
+    if max_base_price is not None:
+        products = products.filter(base_price__lt=max_base_price)
+    return products
+
+
+class _CentsToPrice(Func):
+    # 100.0 is an exact numeric literal on PostgreSQL. SQLite, which has no
+    # decimal type, divides in floating point and the value is quantized to
+    # cents when read, so the result is exact there as well.
+    template = '(%(expressions)s / 100.0)'
+    output_field = DecimalField(max_digits=12, decimal_places=2)
+
+
+def unit_price_expression(markup_percentage):
+    """
+    SQL form of Product.calculate_unit_price, for a markup with at most two
+    decimal places. Computed in integer cents and rounded half up like the
+    Decimal code, so both agree to the cent on every database.
+    """
+    # (100 + markup) in hundredths of a percent, the price in ten thousandths of a cent.
+    factor = int(Decimal(str(markup_percentage)) * 100) + 10000
+    base_cents = Cast(Round(F('base_price') * 100), BigIntegerField())
+    return _CentsToPrice((base_cents * factor + 5000) / 10000)
+
+
+def reprice(markup_percentage, store=None, category=None, min_base_price=None, max_base_price=None,
+            dry_run=False, user=None, sample_size=20):
+    """
+    Sets the markup of every product in the repricing_scope and recalculates
+    their unit_price, as one INSERT ... SELECT of the audit rows and one
+    UPDATE, however many products match. Products whose price and markup
+    already match the rule are left alone.
+
+    Returns the diff: the number of products changed, the old and new sums
+    of their unit prices and a sample of the changes. With dry_run nothing
+    is written and the diff is what the rule would do. The markup is
+    rounded to two decimal places, see unit_price_expression.
+    """
+    markup_percentage = float(Decimal(str(markup_percentage)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
+    new_unit_price = unit_price_expression(markup_percentage)
+    changed = repricing_scope(store, category, min_base_price, max_base_price).annotate(
+        new_unit_price=new_unit_price,
+    ).exclude(unit_price=new_unit_price, markup_percentage=markup_percentage)
+
+    if dry_run:
+        totals = changed.aggregate(count=Count('pk'), old_total=Sum('unit_price'), new_total=Sum('new_unit_price'))
+        sample = changed.order_by('pk').values('pk', 'name', 'unit_price', 'new_unit_price')[:sample_size]
+        return _diff(None, totals, [
+            {'product': row['pk'], 'name': row['name'], 'old_unit_price': _cents(row['unit_price']),
+             'new_unit_price': _cents(row['new_unit_price'])}
+            for row in sample
+        ])
+
+    with transaction.atomic():
+        repricing = Repricing.objects.create(
+            markup_percentage=markup_percentage,
+            store=store,
+            category=category,
+            min_base_price=min_base_price,
+            max_base_price=max_base_price,
+            created_by=user,
+        )
+
+        # The audit rows are the old prices of exactly the products the UPDATE below touches.
+        rows = changed.order_by().annotate(
+            audit_repricing=Value(repricing.pk, output_field=IntegerField()),
+            audit_product=F('pk'),
+            audit_unit_price=F('unit_price'),
+            audit_markup=F('markup_percentage'),
+            audit_new_unit_price=new_unit_price,
+        ).values('audit_repricing', 'audit_product', 'audit_unit_price', 'audit_markup', 'audit_new_unit_price')
+        select_sql, params = rows.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {PriceChange._meta.db_table} '
+                '(repricing_id, product_id, old_unit_price, old_markup_percentage, new_unit_price) '
+                f'{select_sql}',
+                params,
+            )
+
+        changes = PriceChange.objects.filter(repricing=repricing)
+        Product.objects.filter(price_changes__repricing=repricing).update(
+            unit_price=new_unit_price,
+            markup_percentage=markup_percentage,
+        )
+        totals = changes.aggregate(count=Count('pk'), old_total=Sum('old_unit_price'), new_total=Sum('new_unit_price'))
+        repricing.product_count = totals['count']
+        repricing.save(update_fields=['product_count'])
+
+        # The UPDATE bypasses the Product signals.
+        product_ids = list(changes.values_list('product_id', flat=True))
+        if product_ids:
+            resources_changed(['products'] + [f'product:{product_id}' for product_id in product_ids])
+
+        sample = changes.order_by('product_id').values(
+            'product_id', 'product__name', 'old_unit_price', 'new_unit_price'
+        )[:sample_size]
+        return _diff(repricing.pk, totals, [
+            {'product': row['product_id'], 'name': row['product__name'], 'old_unit_price': _cents(row['old_unit_price']),
+             'new_unit_price': _cents(row['new_unit_price'])}
+            for row in sample
+        ])
+
+
+def _cents(amount):
+    # SQLite computes decimals as floats.
+    return Decimal(amount or 0).quantize(Decimal('0.01'))
+
+
+def _diff(repricing_id, totals, sample):
+    return {
+        'repricing': repricing_id,
+        'count': totals['count'],
+        'old_total': _cents(totals['old_total']),
+        'new_total': _cents(totals['new_total']),
+        'changes': sample,
+    }
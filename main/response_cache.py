@@ -0,0 +1,220 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+
+DEFAULTS = {
+    'MAX_ENTRIES': 1000,
+    'MAX_BYTES': 32 * 1024 * 1024,
+    'TIMEOUT': 300,
+    # Alias of a CACHES entry shared by all processes, None for in-process only.
+    'SHARED_CACHE': None,
+}
+
+
+class LRUCache:
+    """Thread-safe in-process LRU, bounded by entry count, total size and age."""
+
+    def __init__(self, max_entries, max_bytes, timeout):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.size = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, size, tags, expires = entry
+            if expires < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, size, tags=()):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, frozenset(tags), time.monotonic() + self.timeout)
+            self.size += size
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def purge(self, tags):
+        """Drops every entry tagged with one of tags."""
+        tags = set(tags)
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry[2] & tags]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        _, size, _, _ = self._entries.pop(key)
+        self.size -= size
+
+
+class ResponseCache:
+    """
+    Two tier cache for rendered-ready response data.
+
+    Entries are tagged with namespaces ('products', 'categories', ...). Each
+    namespace has a generation that is part of every key, so invalidating a
+    namespace is one counter bump. With a shared backend the generations
+    live there too and invalidations reach every process; local entries are
+    purged right away in the invalidating process and expire after TIMEOUT
+    in the others. Without one, generations are per process, so run a single
+    process or accept responses up to TIMEOUT seconds old.
+    """
+
+    def __init__(self, options=None):
+        options = {**DEFAULTS, **(options or {})}
+        self.timeout = options['TIMEOUT']
+        self.local = LRUCache(options['MAX_ENTRIES'], options['MAX_BYTES'], options['TIMEOUT'])
+        self.shared_alias = options['SHARED_CACHE']
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.counters = {'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'stores': 0, 'invalidations': 0}
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias] if self.shared_alias else None
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def get_generations(self, namespaces):
+        if self.shared is None:
+            return {namespace: self._generations.get(namespace, 0) for namespace in namespaces}
+        stored = self.shared.get_many([f'response_cache:gen:{namespace}' for namespace in namespaces])
+        return {namespace: stored.get(f'response_cache:gen:{namespace}', 0) for namespace in namespaces}
+
+    def make_key(self, namespaces, route, params):
+        generations = self.get_generations(sorted(namespaces))
+        source = json.dumps([route, sorted(params), sorted(generations.items())], default=str)
+        return 'response_cache:' + hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        data = self.local.get(key)
+        if data is not None:
+            self._count('local_hits')
+            return data
+        if self.shared is not None:
+            data = self.shared.get(key)
+            if data is not None:
+                self._count('shared_hits')
+                return data
+        self._count('misses')
+        return None
+
+    def set(self, key, data, namespaces):
+        size = len(json.dumps(data, cls=JSONEncoder))
+        self.local.set(key, data, size, namespaces)
+        if self.shared is not None:
+            self.shared.set(key, data, self.timeout)
+        self._count('stores')
+
+    def invalidate(self, namespaces):
+        with self._lock:
+            for namespace in namespaces:
+                self._generations[namespace] = self._generations.get(namespace, 0) + 1
+            self.counters['invalidations'] += 1
+        self.local.purge(namespaces)
+        if self.shared is not None:
+            for namespace in namespaces:
+                key = f'response_cache:gen:{namespace}'
+                if not self.shared.add(key, 1, None):
+                    self.shared.incr(key)
+
+    def get_or_set(self, namespaces, route, params, compute):
+        key = self.make_key(namespaces, route, params)
+        data = self.get(key)
+        if data is None:
+            data = compute()
+            self.set(key, data, namespaces)
+        return data
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = counters['local_hits'] + counters['shared_hits'] + counters['misses']
+        return {
+            **counters,
+            'hit_ratio': (lookups - counters['misses']) / lookups if lookups else 0,
+            'local_entries': len(self.local),
+            'local_bytes': self.local.size,
+            'local_evictions': self.local.evictions,
+            'shared_backend': self.shared_alias,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._generations.clear()
+        self.local.clear()
+
+
+response_cache = ResponseCache(getattr(settings, 'RESPONSE_CACHE', None))
+
+
+class CachedResponseMixin:
+    """
+    Caches list and retrieve payloads of read-only viewsets for anonymous
+    GETs, keyed on the route, its kwargs, the host and the query string.
+    get_cache_namespaces() names the data the payload is built from, so
+    writes to it (see main.signals) invalidate the entry.
+    """
+    cache_namespaces = ()
+
+    def get_cache_namespaces(self):
+        return self.cache_namespaces
+
+    def cached_response(self, build_response):
+        request = self.request
+        namespaces = self.get_cache_namespaces()
+        if request.method != 'GET' or request.user.is_authenticated or not namespaces:
+            return build_response()
+
+        route = [self.basename, self.action, sorted(self.kwargs.items()), request.scheme, request.get_host()]
+        key = response_cache.make_key(namespaces, route, request.query_params.lists())
+        data = response_cache.get(key)
+        if data is not None:
+            return Response(data)
+
+        response = build_response()
+        if response.status_code == 200:
+            response_cache.set(key, response.data, namespaces)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(partial(super().list, request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(partial(super().retrieve, request, *args, **kwargs))
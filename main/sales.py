@@ -0,0 +1,159 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import TruncDate
+
+from .models import Order, OrderItem, ProductDailySales, StoreDailySales
+
+# Date range of the sales endpoint when none is given, and the longest it serves.
+DEFAULT_SALES_DAYS = 30
+MAX_SALES_DAYS = 366
+
+
+def _rollups(orders):
+    """
+    ({(store_id, date): [revenue, order_count, units_sold]},
+     {(product_id, date): [store_id, revenue, order_count, units_sold]})
+    of the orders queryset, grouped by the day each order was placed.
+    """
+    stores = {
+        (row['store_id'], row['day']): [row['revenue'], row['order_count'], 0]
+        for row in orders.order_by().annotate(day=TruncDate('created_at')).values('store_id', 'day').annotate(
+            revenue=Sum('total_price'), order_count=Count('pk'),
+        )
+    }
+    products = {}
+    items = OrderItem.objects.filter(order__in=orders.order_by().values('pk')).order_by().annotate(
+        day=TruncDate('order__created_at'),
+    ).values('order__store_id', 'product_id', 'day').annotate(
+        revenue=Sum(F('price_at_purchase') * F('quantity'), output_field=DecimalField(max_digits=14, decimal_places=2)),
+        order_count=Count('order_id', distinct=True),
+        units_sold=Sum('quantity'),
+    ).order_by('order__store_id')
+    for row in items:
+        stores[row['order__store_id'], row['day']][2] += row['units_sold']
+        # Items of deleted products still count towards the store.
+        if row['product_id'] is None:
+            continue
+        # A product sold by two stores on one day (it changed hands) gets
+        # one row with both stores' sales, under the lowest store id.
+        product = products.setdefault((row['product_id'], row['day']), [row['order__store_id'], 0, 0, 0])
+        product[1] += row['revenue']
+        product[2] += row['order_count']
+        product[3] += row['units_sold']
+    return stores, products
+
+
+def _upsert(model, columns, rows):
+    """
+    Adds rows, of the key columns then revenue, order_count and units_sold,
+    to the rollup table of model in one INSERT ... ON CONFLICT DO UPDATE.
+    The first key column and the date identify a rollup row.
+    """
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    columns = columns + ['revenue', 'order_count', 'units_sold']
+    placeholders = f"({', '.join(['%s'] * len(columns))})"
+    sql = (
+        f"INSERT INTO {table} ({', '.join(qn(column) for column in columns)}) "
+        f"VALUES {', '.join([placeholders] * len(rows))} "
+        f"ON CONFLICT ({qn(columns[0])}, {qn('date')}) DO UPDATE SET "
+        + ', '.join(f"{qn(column)} = {table}.{qn(column)} + EXCLUDED.{qn(column)}" for column in columns[-3:])
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [value for row in rows for value in row])
+
+
+def record_sales(order_ids, sign=1):
+    """
+    Adds the orders to the daily rollups, or takes them out again with
+    sign=-1. Called when orders become or stop being sales (see
+    Order.SALE_STATUSES). Each rollup row is bumped in place by an upsert,
+    so concurrent checkouts of one store never lose an update.
+    """
+    order_ids = list(order_ids)
+    if not order_ids:
+        return
+    stores, products = _rollups(Order.objects.filter(pk__in=order_ids))
+    adapt_date = connection.ops.adapt_datefield_value
+    if stores:
+        _upsert(StoreDailySales, ['store_id', 'date'], [
+            (store_id, adapt_date(day), sign * revenue, sign * order_count, sign * units_sold)
+            for (store_id, day), (revenue, order_count, units_sold) in sorted(stores.items())
+        ])
+    if products:
+        _upsert(ProductDailySales, ['product_id', 'store_id', 'date'], [
+            (product_id, store_id, adapt_date(day), sign * revenue, sign * order_count, sign * units_sold)
+            for (product_id, day), (store_id, revenue, order_count, units_sold) in sorted(products.items())
+        ])
+
+
+def rebuild_sales(start, end, store=None, batch_size=1000):
+    """
+    Recomputes the rollups of the days start <= date < end, of one store or
+    of all of them, from the orders. Returns the number of store days written.
+    """
+    orders = Order.objects.filter(
+        status__in=Order.SALE_STATUSES, created_at__date__gte=start, created_at__date__lt=end,
+    )
+    store_rows = StoreDailySales.objects.filter(date__gte=start, date__lt=end)
+    product_rows = ProductDailySales.objects.filter(date__gte=start, date__lt=end)
+    if store is not None:
+        orders = orders.filter(store=store)
+        store_rows = store_rows.filter(store=store)
+        product_rows = product_rows.filter(store=store)
+
+    with transaction.atomic():
+        stores, products = _rollups(orders)
+        store_rows.delete()
+        product_rows.delete()
+        StoreDailySales.objects.bulk_create([
+            StoreDailySales(store_id=store_id, date=day, revenue=revenue, order_count=order_count, units_sold=units_sold)
+            for (store_id, day), (revenue, order_count, units_sold) in stores.items()
+        ], batch_size=batch_size)
+        ProductDailySales.objects.bulk_create([
+            ProductDailySales(product_id=product_id, store_id=store_id, date=day, revenue=revenue,
+                              order_count=order_count, units_sold=units_sold)
+            for (product_id, day), (store_id, revenue, order_count, units_sold) in products.items()
+        ], batch_size=batch_size)
+    return len(stores)
+
+
+def sales_series(store, start, end, product=None):
+    """
+    Daily revenue, order count and units sold of store (or of one of its
+    products) for start <= date <= end, days without sales included, and
+    the totals of the range. Reads the rollups only.
+    """
+    if product is not None:
+        rows = ProductDailySales.objects.filter(store=store, product=product)
+    else:
+        rows = StoreDailySales.objects.filter(store=store)
+    by_day = defaultdict(lambda: (Decimal('0.00'), 0, 0))
+    for row in rows.filter(date__gte=start, date__lte=end).values_list('date', 'revenue', 'order_count', 'units_sold'):
+        by_day[row[0]] = row[1:]
+
+    days = []
+    for offset in range((end - start).days + 1):
+        day = start + timedelta(days=offset)
+        revenue, order_count, units_sold = by_day[day]
+        days.append({
+            'date': day.isoformat(),
+            'revenue': _cents(revenue),
+            'order_count': order_count,
+            'units_sold': units_sold,
+        })
+    return {
+        'revenue': _cents(sum((Decimal(day['revenue']) for day in days), Decimal('0'))),
+        'order_count': sum(day['order_count'] for day in days),
+        'units_sold': sum(day['units_sold'] for day in days),
+        'days': days,
+    }
+
+
+def _cents(value):
+    # SQLite hands sums back as floats.
+    return str(Decimal(str(value)).quantize(Decimal('0.01')))
@@ -0,0 +1,125 @@
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+
+from .models import Product, ProductSearchDocument
+
+
+DOCUMENT_TABLE = ProductSearchDocument._meta.db_table
+FTS_TABLE = 'main_productsearch_fts'
+
+# bm25 column weights for name, categories and body on SQLite.
+FTS_WEIGHTS = (10.0, 4.0, 1.0)
+
+
+def build_document(row):
+    categories = [row['category__name'], row['subcategory__name'], row['sub_subcategory__name']]
+    return ProductSearchDocument(
+        product_id=row['id'],
+        name=row['name'],
+        categories=' '.join(name for name in categories if name),
+        body=f"{row['description']}\n{row['specification']}",
+    )
+
+
+def index_products(product_ids=None, batch_size=500):
+    """
+    Creates or refreshes the search documents of the given products (all of
+    them when product_ids is None). Returns the number of documents written.
+    """
+    products = Product.objects.order_by('pk')
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+    rows = products.values('id', 'name', 'description', 'specification', 'category__name',
+                           'subcategory__name', 'sub_subcategory__name')
+
+    written = 0
+    batch = []
+    for row in rows.iterator(chunk_size=batch_size):
+        batch.append(build_document(row))
+        if len(batch) >= batch_size:
+            written += _write_documents(batch)
+            batch = []
+    if batch:
+        written += _write_documents(batch)
+    return written
+
+
+def _write_documents(documents):
+    ProductSearchDocument.objects.bulk_create(
+        documents,
+        update_conflicts=True,
+        unique_fields=['product'],
+        update_fields=['name', 'categories', 'body', 'updated_at'],
+    )
+    return len(documents)
+
+
+def search_terms(query):
+    return re.findall(r'\w+', query.lower())
+
+
+def search_products(queryset, query, ranked=True):
+    """
+    Restricts a Product queryset to the products matching query.
+
+    With ranked=True the result is annotated with search_rank and ordered by
+    it, best match first. PostgreSQL uses the weighted tsvector (prefix
+    matching) plus trigram similarity on the name, SQLite uses FTS5 with
+    bm25. Other databases fall back to icontains on the search documents.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return queryset
+
+    vendor = connection.vendor
+    if vendor == 'postgresql':
+        matches, rank = _postgresql_search(terms, query)
+    elif vendor == 'sqlite':
+        matches, rank = _sqlite_search(terms)
+    else:
+        for term in terms:
+            queryset = queryset.filter(
+                Q(search_document__name__icontains=term)
+                | Q(search_document__categories__icontains=term)
+                | Q(search_document__body__icontains=term)
+            )
+        return queryset
+
+    queryset = queryset.filter(pk__in=matches)
+    if ranked:
+        queryset = queryset.annotate(search_rank=rank).order_by('-search_rank', '-pk')
+    return queryset
+
+
+def _postgresql_search(terms, query):
+    tsquery = ' & '.join(f'{term}:*' for term in terms)
+    matches = RawSQL(
+        f"SELECT product_id FROM {DOCUMENT_TABLE} "
+        f"WHERE search_vector @@ to_tsquery('english', %s) OR name %% %s",
+        (tsquery, query),
+    )
+    # Cast to float8 so the rank survives the round trip through a pagination cursor.
+    rank = RawSQL(
+        f"SELECT (ts_rank_cd(d.search_vector, to_tsquery('english', %s)) + similarity(d.name, %s))::float8 "
+        f"FROM {DOCUMENT_TABLE} d WHERE d.product_id = {Product._meta.db_table}.id",
+        (tsquery, query),
+        output_field=FloatField(),
+    )
+    return matches, rank
+
+
+def _sqlite_search(terms):
+    match = ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+    matches = RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", (match,))
+    weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+    # bm25 is lower for better matches, negate it so higher ranks come first everywhere.
+    rank = RawSQL(
+        f"SELECT -bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} "
+        f"WHERE {FTS_TABLE} MATCH %s AND rowid = {Product._meta.db_table}.id",
+        (match,),
+        output_field=FloatField(),
+    )
+    return matches, rank
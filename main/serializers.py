@@ -1,18 +1,113 @@
+from datetime import timedelta
+
 from django.contrib.auth.models import User
+from django.db.models import Count, Prefetch
+from django.utils import timezone
 
 from rest_framework import serializers
 
 
+from .category_tree import get_category_tree
+from .images import srcset
+from .sales import DEFAULT_SALES_DAYS, MAX_SALES_DAYS
 from .models import (Category, Product, ProductImage, ProductReview,
                      ProductRating, Store, Message, Cart, CartItem, CategoryImage,
-                     StoreReview, StoreRating, WishList, Payment, OrderItem, Order)
-
+                     StoreReview, StoreRating, WishList, Payment, OrderItem, Order, ConversationMember)
+
+
+class SparseFieldsetMixin:
+    """
+    Trims a serializer down to ?fields=a,b and swaps in the heavier
+    representations listed in expandable_fields for ?expand=x,y. Dotted
+    names trim nested representations too: ?fields=id,store.name&expand=store.
+    Unknown names are ignored.
+
+    select_related_fields and prefetch_related_fields map a field name to the
+    lookups it needs, so views can build the query plan for exactly the
+    fields that will be rendered (see setup_queryset).
+    """
+    fields_query_param = 'fields'
+    expand_query_param = 'expand'
+    expandable_fields = {}
+    select_related_fields = {}
+    prefetch_related_fields = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None:
+            return
+
+        paths = self._parse(request, self.fields_query_param)
+        _, expand = self.get_requested_fields(request)
+        for name in expand:
+            serializer_class, options = self.expandable_fields[name]
+            self.fields[name] = serializer_class(**options)
+        if paths:
+            _trim_fields(self, paths | expand)
+
+    @staticmethod
+    def _parse(request, param):
+        value = request.query_params.get(param, '')
+        return {name.strip() for name in value.split(',') if name.strip()}
+
+    @classmethod
+    def get_requested_fields(cls, request):
+        """The top-level names of ?fields= and the expandable names of ?expand=."""
+        fields = {path.split('.', 1)[0] for path in cls._parse(request, cls.fields_query_param)}
+        expand = cls._parse(request, cls.expand_query_param) & cls.expandable_fields.keys()
+        return fields, expand
+
+    @classmethod
+    def setup_queryset(cls, queryset, request):
+        """Adds the select_related/prefetch_related lookups the rendered fields need."""
+        names = set(cls.Meta.fields)
+        expand = set()
+        if request is not None:
+            fields, expand = cls.get_requested_fields(request)
+            names |= expand
+            if fields:
+                names &= fields | expand
+        # An expandable field that was not expanded renders as a plain id (or not at all).
+        names -= cls.expandable_fields.keys() - expand
+
+        select_related = [lookup for name in names for lookup in cls.select_related_fields.get(name, [])]
+        prefetch_related = [lookup for name in names for lookup in cls.prefetch_related_fields.get(name, [])]
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        return queryset
+
+
+def _trim_fields(serializer, paths):
+    """Keeps the fields of serializer named by paths, 'a' or 'a.b' for a field of a nested serializer."""
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    if not isinstance(serializer, serializers.Serializer):
+        return
+    nested = {}
+    for path in paths:
+        name, _, rest = path.partition('.')
+        nested.setdefault(name, set())
+        if rest:
+            nested[name].add(rest)
+    for name in set(serializer.fields) - nested.keys():
+        serializer.fields.pop(name)
+    for name, rest in nested.items():
+        if rest and name in serializer.fields:
+            _trim_fields(serializer.fields[name], rest)
 
 
 class CategoryImageSerializer(serializers.ModelSerializer):
+    srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = CategoryImage
-        fields = ['id', 'category', 'image']
+        fields = ['id', 'category', 'image', 'srcset']
+
+    def get_srcset(self, obj):
+        return srcset(obj.variants)
 
     def create(self, validated_data):
         category_id = self.context('category_pk')
@@ -38,17 +133,22 @@ class CategorySerializer(serializers.ModelSerializer):
         read_only_fields = ['slug']
 
     def get_subcategories(self, obj):
-        subcats = obj.subcategories.filter(is_active=True)
-        return CategorySerializer(subcats, many=True).data
+        tree = get_category_tree()
+        return [tree.serialize(child['id']) for child in tree.children(obj.id)]
 
 
 from rest_framework import serializers
 from .models import HeroImage
 
 class HeroImageSerializer(serializers.ModelSerializer):
+    srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = HeroImage
-        fields = ['id', 'title', 'description', 'image', 'link', 'active', 'ordering']
+        fields = ['id', 'title', 'description', 'image', 'srcset', 'link', 'active', 'ordering']
+
+    def get_srcset(self, obj):
+        return srcset(obj.variants)
 
 
 class ProductRatingSerializer(serializers.ModelSerializer):
@@ -68,9 +168,14 @@ class ProductRatingSerializer(serializers.ModelSerializer):
 
 
 class ProductImageSerializer(serializers.ModelSerializer):
+    srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = ProductImage
-        fields = ['image']
+        fields = ['image', 'srcset']
+
+    def get_srcset(self, obj):
+        return srcset(obj.variants)
 
     def create(self, validated_data):
         product_id = self.context.get('product_pk')
@@ -123,12 +228,14 @@ class OrderItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'product', 'quantity', 'total_price']
 
     def get_total_price(self, obj):
-        return obj.product.unit_price * obj.quantity
+        # What was paid, not what the product costs today.
+        return obj.total_price
 
 
 
 class OrderSerializer(serializers.ModelSerializer):
     items = OrderItemSerializer(source='order_items', many=True, read_only=True)
+    item_count = serializers.SerializerMethodField()
     user_email = serializers.EmailField(source='user.email', read_only=True)
     amount = serializers.SerializerMethodField()
     shipping_address = serializers.CharField(required=True)
@@ -137,17 +244,33 @@ class OrderSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Order
-        fields = ['id', 'user_email', 'items', 'status', 'contact_info',
+        fields = ['id', 'user_email', 'items', 'item_count', 'status', 'contact_info',
                   'shipping_address', 'created_at', 'amount']
 
+    @staticmethod
+    def setup_queryset(queryset):
+        """
+        The query plan of a list of orders: the orders with their user and
+        item count, then one query for all their items with the products and
+        category names, and one for the product images, however many orders.
+        """
+        items = OrderItem.objects.select_related(
+            'product__category', 'product__subcategory', 'product__sub_subcategory'
+        ).prefetch_related('product__product_images').order_by('pk')
+        return queryset.select_related('user').annotate(item_count=Count('order_items')).prefetch_related(
+            Prefetch('order_items', queryset=items)
+        )
 
     def get_created_at(self, obj):
         return obj.created_at.strftime("%A, %d %B %Y")
 
-
+    def get_item_count(self, obj):
+        if hasattr(obj, 'item_count'):
+            return obj.item_count
+        return len(obj.order_items.all())
 
     def get_amount(self, obj):
-        return sum(item.product.unit_price * item.quantity for item in obj.order_items.all())
+        return obj.total_price
 
 
 
@@ -169,7 +292,7 @@ class StoreReviewSerializer(serializers.ModelSerializer):
 
 class StoreRatingSerializer(serializers.ModelSerializer):
 
-    user = serializers.ReadOnlyField()
+    user = serializers.PrimaryKeyRelatedField(read_only=True)
 
     class Meta:
         model = StoreRating
@@ -186,17 +309,27 @@ class StoreSerializer(serializers.ModelSerializer):
 
     reviews = StoreReviewSerializer(source='store_reviews', many=True)
     orders = OrderSerializer(many=True, read_only=True)
+    logo_srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = Store
-        fields = ['id', 'name', 'description', 'logo', 'contact_info', 'reviews', 'orders', 'date_created']
+        fields = ['id', 'name', 'description', 'logo', 'logo_srcset', 'contact_info', 'reviews', 'orders',
+                  'date_created']
+
+    def get_logo_srcset(self, obj):
+        return srcset(obj.logo_variants)
 
 class SimpleStoreSerializer(serializers.ModelSerializer):
+    logo_srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = Store
-        fields = ['id', 'name', 'logo', 'contact_info', 'description', 'date_created']
+        fields = ['id', 'name', 'logo', 'logo_srcset', 'contact_info', 'description', 'date_created']
+
+    def get_logo_srcset(self, obj):
+        return srcset(obj.logo_variants)
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     ratings = ProductRatingSerializer(source='product_ratings', many=True)
     reviews = ProductReviewSerializer(source='product_reviews', many=True, read_only=True)
     store = StoreSerializer(read_only=True)
@@ -227,11 +360,28 @@ class ProductSerializer(serializers.ModelSerializer):
             'ratings',
             'category',
             'average_rating',
+            'rating_count',
             'subcategory',
             'sub_subcategory',
             'images'
         ]
-        read_only_fields = ['unit_price', 'date_created']
+        read_only_fields = ['unit_price', 'date_created', 'average_rating', 'rating_count']
+
+    select_related_fields = {
+        'store': ['store'],
+        'category': ['category'],
+        'subcategory': ['subcategory'],
+        'sub_subcategory': ['sub_subcategory'],
+    }
+    prefetch_related_fields = {
+        'store': [
+            'store__store_reviews',
+            Prefetch('store__orders', queryset=OrderSerializer.setup_queryset(Order.objects.order_by('-created_at'))),
+        ],
+        'ratings': ['product_ratings__user'],
+        'reviews': ['product_reviews__author'],
+        'images': ['product_images'],
+    }
 
     def get_category(self, obj):
         return obj.category.name if obj.category else None
@@ -250,6 +400,61 @@ class ProductSerializer(serializers.ModelSerializer):
 
 
 
+class ProductCardSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """
+    Lightweight product representation for list pages. The store, ratings and
+    reviews are only embedded when asked for with ?expand=.
+    """
+    store = serializers.PrimaryKeyRelatedField(read_only=True)
+    category = serializers.SerializerMethodField()
+    subcategory = serializers.SerializerMethodField()
+    sub_subcategory = serializers.SerializerMethodField()
+    images = ProductImageSerializer(source='product_images', many=True, read_only=True)
+
+    class Meta:
+        model = Product
+        fields = [
+            'id',
+            'store',
+            'name',
+            'unit_price',
+            'average_rating',
+            'rating_count',
+            'category',
+            'subcategory',
+            'sub_subcategory',
+            'images',
+            'date_created',
+        ]
+        read_only_fields = fields
+
+    expandable_fields = {
+        'store': (SimpleStoreSerializer, {'read_only': True}),
+        'ratings': (ProductRatingSerializer, {'source': 'product_ratings', 'many': True, 'read_only': True}),
+        'reviews': (ProductReviewSerializer, {'source': 'product_reviews', 'many': True, 'read_only': True}),
+    }
+    select_related_fields = {
+        'store': ['store'],
+        'category': ['category'],
+        'subcategory': ['subcategory'],
+        'sub_subcategory': ['sub_subcategory'],
+    }
+    prefetch_related_fields = {
+        'ratings': ['product_ratings__user'],
+        'reviews': ['product_reviews__author'],
+        'images': ['product_images'],
+    }
+
+    def get_category(self, obj):
+        return obj.category.name if obj.category else None
+
+    def get_subcategory(self, obj):
+        return obj.subcategory.name if obj.subcategory else None
+
+    def get_sub_subcategory(self, obj):
+        return obj.sub_subcategory.name if obj.sub_subcategory else None
+
+
 class MessageSerializer(serializers.ModelSerializer):
     sender = serializers.StringRelatedField(read_only=True)
     receiver_user = serializers.PrimaryKeyRelatedField(
@@ -261,8 +466,48 @@ class MessageSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Message
-        fields = ['id', 'sender', 'receiver_user', 'receiver_store', 'content', 'is_read', 'timestamp']
-        read_only_fields = ['id', 'sender', 'is_read', 'timestamp']
+        fields = ['id', 'conversation', 'sender', 'receiver_user', 'receiver_store', 'content', 'is_read', 'timestamp']
+        read_only_fields = ['id', 'conversation', 'sender', 'is_read', 'timestamp']
+
+    def validate(self, attrs):
+        # New messages go to exactly one user or store, never to their own sender.
+        if self.instance is not None or self.context.get('conversation') is not None:
+            return attrs
+        receiver_user, receiver_store = attrs.get('receiver_user'), attrs.get('receiver_store')
+        if (receiver_user is None) == (receiver_store is None):
+            raise serializers.ValidationError('Set exactly one of receiver_user and receiver_store.')
+        sender = self.context['request'].user
+        if receiver_user == sender or (receiver_store is not None and receiver_store.user_id == sender.pk):
+            raise serializers.ValidationError('You cannot message yourself.')
+        return attrs
+
+
+class ConversationSerializer(serializers.ModelSerializer):
+    # Serializes the ConversationMember of the requesting user: one inbox entry.
+    id = serializers.IntegerField(source='conversation_id', read_only=True)
+    store = serializers.SerializerMethodField()
+    participants = serializers.SerializerMethodField()
+    last_message = MessageSerializer(source='conversation.last_message', read_only=True)
+
+    class Meta:
+        model = ConversationMember
+        fields = ['id', 'store', 'participants', 'last_message', 'last_message_at', 'unread_count']
+
+    def get_store(self, obj):
+        store = obj.conversation.store
+        return {'id': store.pk, 'name': store.name} if store is not None else None
+
+    def get_participants(self, obj):
+        # The other members, from the members prefetched by ConversationViewSet.
+        return [
+            {'id': member.user_id, 'username': member.user.username}
+            for member in obj.conversation.members.all() if member.user_id != obj.user_id
+        ]
+
+
+class MarkReadSerializer(serializers.Serializer):
+    # Conversation ids, all of the user's conversations when left out.
+    conversations = serializers.ListField(child=serializers.IntegerField(), required=False, max_length=500)
 
 
 
@@ -272,6 +517,24 @@ class WishListSerializer(serializers.ModelSerializer):
         fields = ['id', 'product', 'date_added']
 
 
+class WishlistProductSerializer(serializers.Serializer):
+    product = serializers.IntegerField(min_value=1)
+
+
+class WishlistMembershipSerializer(serializers.Serializer):
+    # ?products=1,2,3, the product ids of a page of product cards.
+    products = serializers.CharField(required=False, allow_blank=True, default='')
+
+    def validate_products(self, value):
+        try:
+            ids = {int(product_id) for product_id in value.split(',') if product_id.strip()}
+        except ValueError:
+            raise serializers.ValidationError('Must be a comma separated list of product ids.')
+        if len(ids) > 100:
+            raise serializers.ValidationError('At most 100 product ids per request.')
+        return ids
+
+
 
 class PaymentSerializer(serializers.ModelSerializer):
     class Meta:
@@ -293,8 +556,8 @@ class CartItemSerializer(serializers.ModelSerializer):
     product = SimpleProductSerializer(read_only=True)
     # Use product_id as the write-only field
     product_id = serializers.IntegerField(write_only=True)
-    # Include quantity for both reading and writing
-    quantity = serializers.IntegerField()
+    # Include quantity for both reading and writing, 0 removes the item
+    quantity = serializers.IntegerField(min_value=0)
     # Compute total_price on the fly (adjust the calculation if needed)
     total_price = serializers.SerializerMethodField()
 
@@ -307,6 +570,54 @@ class CartItemSerializer(serializers.ModelSerializer):
         return obj.quantity * obj.product.unit_price if obj.product and obj.quantity else 0
 
 
+class CartOperationSerializer(serializers.Serializer):
+    OPERATIONS = ['add', 'set', 'remove']
+
+    op = serializers.ChoiceField(choices=OPERATIONS, default='add')
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0, default=1)
+
+    def validate(self, attrs):
+        if attrs['op'] == 'add' and attrs['quantity'] == 0:
+            raise serializers.ValidationError({'quantity': 'Quantity must be greater than 0'})
+        return attrs
+
+
+class CartBulkSerializer(serializers.Serializer):
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=500)
+
+
+class RepricingSerializer(serializers.Serializer):
+    markup_percentage = serializers.FloatField(min_value=0)
+    store = serializers.PrimaryKeyRelatedField(queryset=Store.objects.all(), required=False, allow_null=True, default=None)
+    category = serializers.PrimaryKeyRelatedField(queryset=Category.objects.all(), required=False, allow_null=True, default=None)
+    min_base_price = serializers.DecimalField(max_digits=12, decimal_places=2, required=False, allow_null=True, default=None)
+    max_base_price = serializers.DecimalField(max_digits=12, decimal_places=2, required=False, allow_null=True, default=None)
+    dry_run = serializers.BooleanField(default=False)
+
+    def validate(self, attrs):
+        if (attrs['min_base_price'] is not None and attrs['max_base_price'] is not None
+                and attrs['min_base_price'] >= attrs['max_base_price']):
+            raise serializers.ValidationError({'max_base_price': 'Must be greater than min_base_price.'})
+        return attrs
+
+
+class SalesRangeSerializer(serializers.Serializer):
+    # Query parameters of the store sales time series, the range is inclusive.
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    product = serializers.IntegerField(required=False, min_value=1)
+
+    def validate(self, attrs):
+        end = attrs.setdefault('end', timezone.localdate())
+        start = attrs.setdefault('start', end - timedelta(days=DEFAULT_SALES_DAYS - 1))
+        if start > end:
+            raise serializers.ValidationError({'end': 'Must not be before start.'})
+        if (end - start).days >= MAX_SALES_DAYS:
+            raise serializers.ValidationError({'end': f'The range can span at most {MAX_SALES_DAYS} days.'})
+        return attrs
+
+
 
 
 
@@ -0,0 +1,125 @@
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from .category_tree import invalidate_category_tree
+from .events import publish_message, publish_order_status
+from .homepage import VERSION_KEYS as HOMEPAGE_KEYS, invalidate_homepage
+from .models import (Category, CategoryImage, HeroImage, Message, Order, OrderItem, Product, ProductImage,
+                     ProductRating, ProductReview, Store, StoreReview, WishList)
+from .response_cache import response_cache
+from .sales import record_sales
+from .search import index_products
+from .versioning import bump_versions
+from .wishlist import wishlist_cache
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=CategoryImage)
+def category_changed(sender, **kwargs):
+    # Wait for the commit, otherwise a concurrent request could reload the
+    # tree from the old rows and keep it.
+    transaction.on_commit(invalidate_category_tree)
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, **kwargs):
+    transaction.on_commit(lambda: index_products([instance.pk]))
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, created, **kwargs):
+    # The category names are part of the search documents of its products.
+    if created:
+        return
+    product_ids = list(Product.objects.filter(
+        Q(category=instance) | Q(subcategory=instance) | Q(sub_subcategory=instance)
+    ).values_list('pk', flat=True))
+    if product_ids:
+        transaction.on_commit(lambda: index_products(product_ids))
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, **kwargs):
+    # Orders count in the sales rollups from the moment they are paid for
+    # until they are cancelled.
+    loaded_status = getattr(instance, 'loaded_status', None)
+    was_sale = loaded_status in Order.SALE_STATUSES
+    is_sale = instance.status in Order.SALE_STATUSES
+    if was_sale != is_sale:
+        record_sales([instance.pk], 1 if is_sale else -1)
+    if loaded_status is not None and loaded_status != instance.status:
+        publish_order_status(instance, loaded_status)
+    instance.loaded_status = instance.status
+
+
+@receiver(post_save, sender=Message)
+def message_saved(sender, instance, created, **kwargs):
+    if created:
+        publish_message(instance)
+
+
+@receiver([post_save, post_delete], sender=WishList)
+def wishlist_changed(sender, instance, **kwargs):
+    wishlist_cache.invalidate(instance.user_id)
+
+
+@receiver(pre_delete, sender=Order)
+def order_deleted(sender, instance, **kwargs):
+    if getattr(instance, 'loaded_status', None) in Order.SALE_STATUSES:
+        record_sales([instance.pk], -1)
+
+
+def version_keys(instance):
+    """The version stamps (see main.versioning) a write to instance moves."""
+    if isinstance(instance, (Category, CategoryImage)):
+        return ['categories']
+    if isinstance(instance, HeroImage):
+        return ['hero']
+    if isinstance(instance, Product):
+        return ['products', f'product:{instance.pk}']
+    if isinstance(instance, (ProductImage, ProductRating, ProductReview)):
+        return ['products', f'product:{instance.product_id}']
+    if isinstance(instance, Store):
+        return ['stores', f'store:{instance.pk}']
+    if isinstance(instance, (StoreReview, Order)):
+        return ['stores', f'store:{instance.store_id}']
+    if isinstance(instance, OrderItem):
+        return ['stores', f'store:{instance.order.store_id}']
+    return []
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=CategoryImage)
+@receiver([post_save, post_delete], sender=HeroImage)
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductImage)
+@receiver([post_save, post_delete], sender=ProductRating)
+@receiver([post_save, post_delete], sender=ProductReview)
+@receiver([post_save, post_delete], sender=Store)
+@receiver([post_save, post_delete], sender=StoreReview)
+@receiver([post_save, post_delete], sender=Order)
+@receiver([post_save, post_delete], sender=OrderItem)
+def bump_resource_versions(sender, instance, **kwargs):
+    resources_changed(version_keys(instance))
+
+
+def resources_changed(keys):
+    """
+    Bumps the version stamps of keys, invalidates the response cache
+    namespaces among them and the homepage snapshot. For writes that bypass the model signals
+    (queryset updates, bulk_create).
+    """
+    # Bumped after commit so the hot collection rows are never locked for the
+    # length of the writing transaction. The collection keys double as the
+    # response cache namespaces.
+    keys = list(keys)
+    namespaces = [key for key in keys if ':' not in key]
+
+    def bump():
+        bump_versions(keys)
+        response_cache.invalidate(namespaces)
+        if set(namespaces) & set(HOMEPAGE_KEYS):
+            invalidate_homepage()
+    transaction.on_commit(bump)
@@ -0,0 +1,141 @@
+import mimetypes
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+
+BUCKETS = {
+    "store_logo": "store-logos",
+    "product_image": "product-images",
+    "category_image": "category-images",
+    "hero_image": "hero-images",
+}
+
+
+class StorageError(Exception):
+    pass
+
+
+class _ChunkedBody:
+    """
+    Request body that hands the upload's chunks to the socket one at a time.
+    Having a length makes requests send a Content-Length instead of a
+    chunked transfer encoding, which Supabase Storage expects.
+    """
+
+    def __init__(self, upload):
+        self.upload = upload
+
+    def __len__(self):
+        return self.upload.size
+
+    def __iter__(self):
+        self.upload.seek(0)
+        return iter(self.upload.chunks())
+
+
+class ObjectStorage:
+    """
+    Supabase Storage client. Uploads are streamed from Django's uploaded
+    file chunks over one pooled keep-alive session, under a unique object
+    key so equal file names never overwrite each other.
+    """
+
+    def __init__(self, base_url, api_key, public_url, pool_size=10, connect_timeout=3.05, read_timeout=60):
+        self.base_url = base_url.rstrip('/')
+        self.public_url = public_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = pool_size
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'apikey': api_key, 'Authorization': f'Bearer {api_key}'})
+
+    @staticmethod
+    def object_key(filename):
+        extension = os.path.splitext(filename or '')[1].lower()
+        return f'{uuid.uuid4().hex}{extension}'
+
+    @staticmethod
+    def bucket(bucket_key):
+        if bucket_key not in BUCKETS:
+            raise StorageError(f'Invalid bucket key {bucket_key!r}, allowed keys are {list(BUCKETS)}.')
+        return BUCKETS[bucket_key]
+
+    def url(self, bucket_key, key):
+        return f'{self.public_url}{self.bucket(bucket_key)}/{key}'
+
+    def put(self, bucket_key, key, body, content_type):
+        """Stores body (bytes, or an iterable with a length) and returns its public URL."""
+        bucket = self.bucket(bucket_key)
+
+        try:
+            response = self.session.put(
+                f'{self.base_url}/storage/v1/object/{bucket}/{key}',
+                data=body,
+                headers={'Content-Type': content_type or 'application/octet-stream'},
+                timeout=self.timeout,
+            )
+        except requests.RequestException as e:
+            raise StorageError(f'Upload of {key} failed: {e}') from e
+        if response.status_code not in (200, 201):
+            raise StorageError(f'Upload of {key} failed with status {response.status_code}: {response.text[:200]}')
+        return self.url(bucket_key, key)
+
+    def upload(self, bucket_key, upload, key=None):
+        """Streams a Django UploadedFile to storage and returns its public URL."""
+        content_type = upload.content_type or mimetypes.guess_type(upload.name)[0]
+        return self.put(bucket_key, key or self.object_key(upload.name), _ChunkedBody(upload), content_type)
+
+    def get(self, url):
+        """Downloads an object (or any URL) over the pooled session."""
+        # The storage credentials are only for the storage API itself.
+        headers = None if url.startswith(self.base_url) else {'apikey': None, 'Authorization': None}
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise StorageError(f'Download of {url} failed: {e}') from e
+        if response.status_code != 200:
+            raise StorageError(f'Download of {url} failed with status {response.status_code}')
+        return response.content
+
+    def upload_many(self, bucket_key, uploads):
+        """
+        Uploads several files in parallel. Returns one (url, error) pair per
+        upload, in order, error being None on success.
+        """
+        def upload(file):
+            try:
+                return self.upload(bucket_key, file), None
+            except StorageError as e:
+                return None, str(e)
+
+        if len(uploads) == 1:
+            return [upload(uploads[0])]
+        with ThreadPoolExecutor(max_workers=min(len(uploads), self.pool_size)) as executor:
+            return list(executor.map(upload, uploads))
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """The process wide ObjectStorage, configured from the SUPABASE_* and STORAGE_* settings."""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            _storage = ObjectStorage(
+                settings.SUPABASE_URL,
+                settings.SUPABASE_KEY,
+                settings.STORAGE_PUBLIC_URL,
+                pool_size=settings.STORAGE_POOL_SIZE,
+            )
+        return _storage
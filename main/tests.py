@@ -1,3 +1,1841 @@
-from django.test import TestCase
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from base64 import urlsafe_b64encode
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, reverse
+from django.utils import timezone
+from PIL import Image as PILImage
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+import main.urls
+import payment.urls
+from main.benchmark import data as benchmark_data
+from main.category_tree import get_category_tree, invalidate_category_tree
+from main.checkout import CheckoutError, place_order
+from main.events import event_hub
+from main.fake_storage import FakeObjectStorage
+from main.homepage import homepage_snapshot
+from main.images import image_stem
+from main.messaging import get_conversation, mark_read, send_message
+from main.models import (Cart, CartItem, Category, CategoryImage, Conversation, ConversationMember, HeroImage, Message,
+                         Order, OrderItem, Payment, PriceChange, Product, ProductDailySales, ProductImage,
+                         ProductRating, ProductReview, Repricing, Store, StoreDailySales, StoreRating, StoreReview,
+                         WishList)
+from main.pricing import reprice
+from main.response_cache import LRUCache, ResponseCache, response_cache
+from main.search import search_products
+from main.sales import rebuild_sales
+from main.storage import get_storage
+from main.versioning import bump_versions
+from main.wishlist import WishlistCache, wishlist_cache
+from payment.paystack import sign
+
+BUDGETS_FILE = Path(__file__).with_name('query_budgets.json')
+
+PAYSTACK_SECRET_KEY = 'sk_test_query_budgets'
+
+
+def registered_routes():
+    """{name: URLPattern} of every named route of main.urls and payment.urls, format suffixes aside."""
+    routes = {}
+
+    def walk(patterns):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                walk(pattern.url_patterns)
+            elif pattern.name and 'format' not in pattern.pattern.regex.groupindex:
+                routes.setdefault(pattern.name, pattern)
+
+    walk(main.urls.urlpatterns)
+    walk(payment.urls.urlpatterns)
+    return routes
+
+
+class QueryMeter:
+    """Database execute wrapper that counts the queries and their time."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
+
+
+def create_store(name='Store', user=None):
+    return Store.objects.create(user=user or User.objects.create_user(f'owner of {name}'), name=name,
+                                description='Gadgets', contact_info='0800000000', address='Lagos')
+
+
+def create_product(store, name='Kettle', **fields):
+    fields = {'description': 'A product', 'specification': 'Specs', 'unit_price': Decimal(10), 'inventory': 10,
+              **fields}
+    return Product.objects.create(store=store, name=name, **fields)
+
+
+def load_budgets():
+    with open(BUDGETS_FILE) as f:
+        return json.load(f)
+
+
+@override_settings(PAYSTACK_SECRET_KEY=PAYSTACK_SECRET_KEY)
+class QueryBudgetTests(TestCase):
+    """
+    Calls every route of main.urls and payment.urls against a seeded store
+    and holds each request to the query count budget of query_budgets.json.
+    Budgets are keyed "<METHOD> <route name>".
+
+    "queries" is only ever lowered. A route that has to make more queries
+    gets "raised_to" and a "reason" next to it, so every increase is argued
+    for in review, and the raise is dropped once the route is back within
+    "queries".
+
+    SQL time depends on the machine, so the time_ms budgets are only
+    enforced with QUERY_BUDGET_TIMES=1. QUERY_BUDGET_REPORT=1 prints every
+    request, worst first:
+
+        QUERY_BUDGET_REPORT=1 python manage.py test main.tests.QueryBudgetTests
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', 'owner@example.com', 'password', is_staff=True)
+        customers = [User.objects.create_user(f'customer{i}') for i in range(5)]
+        stores = [
+            Store.objects.create(user=cls.user, name=f'Store {i}', description='Gadgets', contact_info='0800000000',
+                                 address='Lagos', logo='https://cdn.example.com/logo.png')
+            for i in range(3)
+        ]
+        cls.store = stores[0]
+
+        # Three levels, like the catalog: category > subcategory > sub_subcategory.
+        cls.category = None
+        leaves = []
+        for i in range(3):
+            root = Category.objects.create(name=f'Category {i}', aliexpress_id=f'{i}')
+            cls.category = cls.category or root
+            CategoryImage.objects.create(category=root, image='https://cdn.example.com/category.jpg')
+            for j in range(2):
+                sub = Category.objects.create(name=f'Category {i}.{j}', parent=root)
+                leaf = Category.objects.create(name=f'Category {i}.{j}.0', parent=sub)
+                leaves.append((root, sub, leaf))
+        cls.subcategory = leaves[0][1]
+
+        products = []
+        for i in range(30):
+            root, sub, leaf = leaves[i % len(leaves)]
+            products.append(Product.objects.create(
+                store=stores[i % len(stores)], category=root, subcategory=sub, sub_subcategory=leaf,
+                name=f'Product {i}', description='A product', specification='Specs', unit_price=Decimal(10 + i),
+                inventory=100, is_dropshipping=i % 2 == 0, base_price=Decimal(8 + i), aliexpress_id=f'AE{i}',
+            ))
+        cls.product = products[0]
+        for product in products:
+            ProductImage.objects.bulk_create(
+                [ProductImage(product=product, image=f'https://cdn.example.com/{product.pk}-{n}.jpg') for n in range(2)]
+            )
+        for i, customer in enumerate(customers):
+            for product in products[:10]:
+                ProductRating.objects.create(product=product, user=customer, rating=1 + (i + product.pk) % 5)
+                ProductReview.objects.create(product=product, author=customer, review='Good')
+            for store in stores:
+                StoreRating.objects.create(store=store, user=customer, rating=1 + i % 5)
+                StoreReview.objects.create(store=store, user=customer, review='Fast delivery')
+        HeroImage.objects.bulk_create([HeroImage(title=f'Hero {i}', image='https://cdn.example.com/hero.jpg') for i in range(3)])
+
+        # Order history of the owner, plus orders of other customers on the stores.
+        for i, buyer in enumerate([cls.user] * 5 + customers):
+            store = stores[i % len(stores)]
+            cart = Cart.objects.create(user=buyer, store=store, status=Cart.STATUS_INACTIVE)
+            items = products[i % 10:i % 10 + 3]
+            order = Order.objects.create(
+                cart=cart, user=buyer, store=store, total_price=sum(item.unit_price for item in items),
+                shipping_address='Lagos', contact_info='0800000000',
+            )
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=item, quantity=1, price_at_purchase=item.unit_price) for item in items
+            ])
+            Payment.objects.create(
+                order=order, payment_reference=f'ref-{i}', amount=order.total_price,
+                status=Payment.STATUS_SUCCESSFUL if i % 2 else Payment.STATUS_PENDING, is_verified=bool(i % 2),
+            )
+        cls.order = Order.objects.filter(user=cls.user, store=cls.store).first()
+        cls.payment = Payment.objects.filter(order__user=cls.user).first()
+        cls.pending_payment = Payment.objects.filter(is_verified=False).select_related('order').first()
+        cls.verified_payment = Payment.objects.filter(is_verified=True).first()
+
+        cls.cart = Cart.objects.create(user=cls.user, store=cls.store)
+        CartItem.objects.bulk_create([CartItem(cart=cls.cart, product=product, quantity=2) for product in products[:5]])
+        cls.cart_item = CartItem.objects.filter(cart=cls.cart).first()
+        cls.wishlist = WishList.objects.create(user=cls.user, product=products[1])
+        for product in products[2:6]:
+            WishList.objects.create(user=cls.user, product=product)
+        # Customers write to a store of the owner and to the owner directly.
+        cls.customer = customers[0]
+        cls.conversation = get_conversation(cls.customer, receiver_store=stores[1])
+        send_message(cls.conversation, cls.customer, 'Is this in stock?')
+        cls.message = send_message(cls.conversation, cls.user, 'Yes, ships tomorrow.')
+        for customer in customers:
+            for content in ['Hello', 'Thanks!']:
+                send_message(get_conversation(customer, receiver_user=cls.user), customer, content)
+
+        cls.product_rating = ProductRating.objects.filter(product=cls.product).first()
+        cls.product_review = ProductReview.objects.filter(product=cls.product).first()
+        cls.store_rating = StoreRating.objects.filter(store=cls.store).first()
+        cls.store_review = StoreReview.objects.filter(store=cls.store).first()
+        cls.product_image = ProductImage.objects.filter(product=cls.product).first()
+        cls.category_image = CategoryImage.objects.filter(category=cls.category).first()
+        cls.hero_image = HeroImage.objects.first()
+
+    def route_kwargs(self, name, pattern):
+        """The URL kwargs of a route: its own object as pk, the parents as <parent>_pk."""
+        objects = {
+            'categories': self.category, 'products': self.product, 'stores': self.store,
+            'messages': self.message, 'wishlists': self.wishlist, 'carts': self.cart,
+            'cart-items': self.cart_item, 'orders': self.order, 'hero-images': self.hero_image,
+            'payments': self.payment, 'product-images': self.product_image, 'product-reviews': self.product_review,
+            'product-ratings': self.product_rating, 'store-reviews': self.store_review,
+            'store-ratings': self.store_rating, 'store-orders': self.order, 'category-images': self.category_image,
+            'conversations': self.conversation,
+        }
+        parents = {'product_pk': self.product, 'store_pk': self.store, 'category_pk': self.category}
+        kwargs = {}
+        for group in pattern.pattern.regex.groupindex:
+            kwargs[group] = parents[group].pk if group in parents else objects[name.rsplit('-', 1)[0]].pk
+        return kwargs
+
+    def route_requests(self, name):
+        """(method, data) of the requests made to a route, a GET unless it takes something else."""
+        webhook = json.dumps({
+            'event': 'charge.success',
+            'data': {'reference': self.pending_payment.payment_reference, 'status': 'success',
+                     'amount': int(self.pending_payment.amount * 100), 'channel': 'card'},
+        }).encode('utf-8')
+        return {
+            'ajax_load_subcategories': [('get', {'category_id': self.category.pk})],
+            'ajax_load_sub_subcategories': [('get', {'subcategory_id': self.subcategory.pk})],
+            'send_complaint': [('post', {'email': 'customer@example.com', 'complaint': 'Where is my order?'})],
+            'reprice_products': [('post', {'markup_percentage': 40, 'category': self.category.pk, 'dry_run': True})],
+            'cart-items-list': [('get', None), ('post', {'product_id': self.product.pk, 'quantity': 1})],
+            'cart-items-bulk': [('post', {'operations': [
+                {'op': 'add', 'product_id': self.product.pk, 'quantity': 1},
+                {'op': 'set', 'product_id': self.wishlist.product_id, 'quantity': 3},
+                {'op': 'remove', 'product_id': self.cart_item.product_id},
+            ]})],
+            'orders-list': [('get', None), ('post', {'shipping_address': 'Lagos', 'contact_info': '0800000000'})],
+            'messages-list': [('get', None), ('post', {'receiver_user': self.customer.pk, 'content': 'Hi'})],
+            'conversations-messages': [('get', None), ('post', {'content': 'Any news?'})],
+            'conversations-read': [('post', {'conversations': [self.conversation.pk]})],
+            'wishlists-list': [('get', None), ('post', {'product': self.wishlist.product_id})],
+            'wishlists-remove': [('post', {'product': self.wishlist.product_id})],
+            'wishlists-membership': [('get', {'products': ','.join(str(pk) for pk in range(1, 41))})],
+            # A stream that closes right away, the budget covers opening it.
+            'event_stream': [('get', {'timeout': 0})],
+            'verify-paystack-payment': [('post', {'reference': self.verified_payment.payment_reference})],
+            'paystack-webhook': [('webhook', webhook)],
+        }.get(name, [('get', None)])
+
+    def measure(self, client, method, url, data):
+        """Makes one request in a transaction that is rolled back, returns (response, queries, SQL ms)."""
+        # Measured cold, so the result doesn't depend on which route ran first.
+        invalidate_category_tree()
+        wishlist_cache.clear()
+        homepage_snapshot.clear()
+        meter = QueryMeter()
+        with transaction.atomic(), connection.execute_wrapper(meter):
+            if method == 'get':
+                response = client.get(url, data)
+            elif method == 'webhook':
+                response = client.post(url, data, content_type='application/json',
+                                       HTTP_X_PAYSTACK_SIGNATURE=sign(data, PAYSTACK_SECRET_KEY))
+            else:
+                response = client.post(url, data, format='json')
+            transaction.set_rollback(True)
+        return response, meter.count, meter.seconds * 1000
+
+    def test_every_route_has_a_budget(self):
+        budgets = load_budgets()
+        expected = {
+            f'{"POST" if method == "webhook" else method.upper()} {name}'
+            for name in registered_routes() for method, _ in self.route_requests(name)
+        }
+        self.assertEqual(sorted(expected - budgets.keys()), [], f'Routes without a budget in {BUDGETS_FILE.name}')
+        self.assertEqual(sorted(budgets.keys() - expected), [], f'Budgets of routes that no longer exist')
+
+    def test_raised_budgets_are_justified(self):
+        for key, budget in load_budgets().items():
+            if budget.keys() & {'raised_to', 'reason'}:
+                with self.subTest(key):
+                    self.assertGreater(budget.get('raised_to', 0), budget['queries'],
+                                       f'{key}: raised_to must be above queries')
+                    self.assertTrue(str(budget.get('reason', '')).strip(), f'{key}: a raised budget needs a reason')
+
+    def test_query_budgets(self):
+        budgets = load_budgets()
+        check_times = bool(os.environ.get('QUERY_BUDGET_TIMES'))
+        client = APIClient()
+        client.force_authenticate(self.user)
+        # For the plain Django views, the event stream.
+        client.force_login(self.user)
+
+        results = []
+        for name, pattern in sorted(registered_routes().items()):
+            url = reverse(name, kwargs=self.route_kwargs(name, pattern))
+            for method, data in self.route_requests(name):
+                key = f'{"POST" if method == "webhook" else method.upper()} {name}'
+                response, query_count, sql_time = self.measure(client, method, url, data)
+                results.append((key, query_count, sql_time, budgets.get(key)))
+                with self.subTest(key):
+                    self.assertLess(response.status_code, 400, f'{key} ({url}) answered {response.status_code}')
+                    if key not in budgets:
+                        continue
+                    budget = budgets[key]
+                    self.assertLessEqual(query_count, budget.get('raised_to', budget['queries']),
+                                         f'{key} ({url}) is over its query budget')
+                    if 'raised_to' in budget:
+                        self.assertGreater(query_count, budget['queries'],
+                                           f'{key} ({url}) is back within its budget, drop raised_to')
+                    if check_times and 'time_ms' in budgets[key]:
+                        self.assertLessEqual(sql_time, budgets[key]['time_ms'],
+                                             f'{key} ({url}) is over its SQL time budget')
+
+        if os.environ.get('QUERY_BUDGET_REPORT'):
+            self.report(results)
+
+    def report(self, results):
+        out = sys.stderr
+        out.write(f'\n{"route":<45} {"queries":>8} {"budget":>7} {"SQL ms":>8} {"budget":>7}\n')
+        for key, query_count, sql_time, budget in sorted(results, key=lambda result: (-result[1], -result[2])):
+            budget = budget or {}
+            queries = budget.get('raised_to', budget.get('queries', '-'))
+            # Budgets to lower in place.
+            note = ' below budget' if isinstance(queries, int) and query_count < budget['queries'] else ''
+            out.write(f'{key:<45} {query_count:>8} {queries:>7} '
+                      f'{sql_time:>8.1f} {budget.get("time_ms", "-"):>7}{note}\n')
+
+
+class EventStreamTests(TestCase):
+    """main.events over the in-process LocalBackend, as configured for tests."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner')
+        cls.customer = User.objects.create_user('customer')
+        cls.stranger = User.objects.create_user('stranger')
+        cls.store = Store.objects.create(user=cls.owner, name='Store', description='Gadgets',
+                                         contact_info='0800000000', address='Lagos')
+        cart = Cart.objects.create(user=cls.customer, store=cls.store, status=Cart.STATUS_INACTIVE)
+        cls.order = Order.objects.create(cart=cart, user=cls.customer, store=cls.store, total_price=Decimal(10),
+                                         shipping_address='Lagos', contact_info='0800000000')
+
+    def write(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            send_message(get_conversation(self.customer, receiver_store=self.store), self.customer, 'In stock?')
+            order = Order.objects.get(pk=self.order.pk)
+            order.status = Order.STATUS_SHIPPED
+            order.save(update_fields=['status'])
+
+    async def test_events_reach_the_affected_users(self):
+        subscriptions = {
+            'customer': event_hub.subscribe([f'user:{self.customer.pk}']),
+            'owner': event_hub.subscribe([f'user:{self.owner.pk}', f'store:{self.store.pk}']),
+            'stranger': event_hub.subscribe([f'user:{self.stranger.pk}']),
+        }
+        try:
+            await sync_to_async(self.write)()
+            for name in ['customer', 'owner']:
+                events = [await subscriptions[name].get(1), await subscriptions[name].get(1)]
+                self.assertEqual([event['event'] for event in events], ['message', 'order_status'], name)
+                self.assertEqual(events[1]['data']['status'], Order.STATUS_SHIPPED)
+                self.assertEqual(events[1]['data']['previous_status'], Order.STATUS_PENDING)
+            self.assertIsNone(await subscriptions['stranger'].get(0.01))
+        finally:
+            for subscription in subscriptions.values():
+                event_hub.unsubscribe(subscription)
+
+    async def test_stream(self):
+        response = await self.async_client.get(reverse('event_stream'))
+        self.assertEqual(response.status_code, 401)
+
+        token = AccessToken.for_user(self.customer)
+        response = await self.async_client.get(reverse('event_stream'), {'token': str(token), 'timeout': 1})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = aiter(response.streaming_content)
+        self.assertEqual(await anext(chunks), b'retry: 3000\n\n')
+        event_hub.publish([f'user:{self.customer.pk}'], 'order_status', {'id': str(self.order.pk)})
+        chunk = await anext(chunks)
+        self.assertIn(b'event: order_status\n', chunk)
+        self.assertIn(f'data: {{"id": "{self.order.pk}"}}'.encode(), chunk)
+        # Then only keep-alives until the timeout ends the stream and its subscription.
+        self.assertEqual({chunk async for chunk in chunks} - {b': keep-alive\n\n'}, set())
+        self.assertEqual(event_hub.subscriber_count(), 0)
+
+
+class ProductRatingTotalsTests(TestCase):
+    """The rating count, sum and average stored on Product (see Product.update_rating_totals)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user('owner')
+        cls.customers = [User.objects.create_user(f'customer{i}') for i in range(2)]
+        store = Store.objects.create(user=owner, name='Store', description='Gadgets',
+                                     contact_info='0800000000', address='Lagos')
+        cls.product = Product.objects.create(store=store, name='Kettle', description='A kettle', specification='1L',
+                                             unit_price=Decimal(10), inventory=10)
+
+    def assertTotals(self, count, total):
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual((product.rating_count, product.rating_sum), (count, total))
+        self.assertEqual(product.average_rating, total / count if count else 0)
+
+    def rate(self, customer, method, rating=None):
+        client = APIClient()
+        client.force_authenticate(customer)
+        if method == 'post':
+            return client.post(reverse('product-ratings-list', kwargs={'product_pk': self.product.pk}),
+                               {'rating': rating}, format='json')
+        url = reverse('product-ratings-detail', kwargs={
+            'product_pk': self.product.pk,
+            'pk': ProductRating.objects.get(product=self.product, user=customer).pk,
+        })
+        if method == 'patch':
+            return client.patch(url, {'rating': rating}, format='json')
+        return client.delete(url)
+
+    def test_writes_move_the_totals(self):
+        self.assertEqual(self.rate(self.customers[0], 'post', 4).status_code, 201)
+        self.assertEqual(self.rate(self.customers[1], 'post', 1).status_code, 201)
+        self.assertTotals(2, 5)
+        self.assertEqual(self.rate(self.customers[0], 'patch', 2).status_code, 200)
+        self.assertTotals(2, 3)
+        self.assertEqual(self.rate(self.customers[1], 'delete').status_code, 204)
+        self.assertTotals(1, 2)
+        self.assertEqual(self.rate(self.customers[0], 'delete').status_code, 204)
+        self.assertTotals(0, 0)
+
+    def test_rebuild_command(self):
+        for customer, rating in zip(self.customers, [5, 2]):
+            ProductRating.objects.create(product=self.product, user=customer, rating=rating)
+        # Totals of a product that lost its ratings are reset as well.
+        other = Product.objects.create(store=self.product.store, name='Toaster', description='A toaster',
+                                       specification='2 slots', unit_price=Decimal(20), inventory=10,
+                                       rating_count=3, rating_sum=12, average_rating=4)
+        call_command('rebuild_product_ratings', stdout=StringIO())
+        self.assertTotals(2, 7)
+        other.refresh_from_db()
+        self.assertEqual((other.rating_count, other.rating_sum, other.average_rating), (0, 0, 0))
+
+
+class UploadTests(TestCase):
+    """The upload views streaming to a FakeObjectStorage started for every test."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.store = Store.objects.create(user=User.objects.create_user('owner'), name='Store', description='Gadgets',
+                                         contact_info='0800000000', address='Lagos')
+        cls.product = Product.objects.create(store=cls.store, name='Kettle', description='A kettle',
+                                             specification='1L', unit_price=Decimal(10), inventory=10)
+
+    def setUp(self):
+        self.storage = self.enterContext(FakeObjectStorage())
+        self.enterContext(override_settings(SUPABASE_URL=self.storage.url, SUPABASE_KEY='test-key',
+                                            STORAGE_PUBLIC_URL=f'{self.storage.url}/storage/v1/object/public/'))
+        # The views share one client per process, built from the settings on first use.
+        self.enterContext(mock.patch('main.storage._storage', None))
+
+    def upload_product_images(self, *contents):
+        files = [SimpleUploadedFile('photo.jpg', content, content_type='image/jpeg') for content in contents]
+        return self.client.post(reverse('upload_product_image'), {'product_id': self.product.pk, 'images': files})
+
+    def test_uploads_are_streamed_under_unique_keys(self):
+        contents = [os.urandom(300 * 1024), os.urandom(1024)]
+        response = self.upload_product_images(*contents)
+        self.assertEqual(response.status_code, 200)
+        urls = response.json()['images']
+        self.assertEqual(sorted(ProductImage.objects.filter(product=self.product).values_list('image', flat=True)),
+                         sorted(urls))
+
+        # Same file name, distinct objects, each with its own content.
+        self.assertEqual(len(self.storage.objects), 2)
+        for url, content in zip(urls, contents):
+            key = ('product-images', url.rsplit('/', 1)[1])
+            self.assertTrue(key[1].endswith('.jpg'))
+            self.assertEqual(self.storage.objects[key], content)
+            self.assertEqual(self.storage.headers[key]['Content-Length'], str(len(content)))
+            self.assertEqual(self.storage.headers[key]['Content-Type'], 'image/jpeg')
+            self.assertEqual(get_storage().get(url), content)
+
+    def test_failed_upload_leaves_no_row(self):
+        self.storage.fail_status = 500
+        with self.assertLogs('main.views', 'ERROR'):
+            response = self.upload_product_images(b'photo')
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(ProductImage.objects.filter(product=self.product).exists())
+        self.assertEqual(self.storage.objects, {})
+
+    def test_variants_are_rendered_from_the_stored_object(self):
+        submitted = []
+        executor = mock.Mock(submit=submitted.append)
+        self.enterContext(mock.patch('main.images._executor', None))
+        self.enterContext(mock.patch('main.images.ThreadPoolExecutor', return_value=executor))
+        # Run inline below, where closing the connection would end the test's transaction.
+        self.enterContext(mock.patch('main.images.close_old_connections'))
+        buffer = BytesIO()
+        PILImage.new('RGB', (400, 300), 'teal').save(buffer, 'PNG')
+
+        with override_settings(IMAGE_QUEUE_SIZE=1), self.assertLogs('main.images', 'WARNING'), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.upload_product_images(buffer.getvalue(), buffer.getvalue())
+        self.assertEqual(response.status_code, 200)
+        # Beyond the queue size, images are left to generate_image_variants.
+        self.assertEqual(len(submitted), 1)
+
+        submitted[0]()
+        images = ProductImage.objects.filter(product=self.product).order_by('pk')
+        self.assertEqual(images[0].variants['widths'], [160, 320])
+        self.assertEqual((images[0].variants['width'], images[0].variants['height']), (400, 300))
+        self.assertIsNone(images[1].variants)
+        self.assertEqual(len(self.storage.objects), 2 + 4)
+
+    def test_hero_images_added_in_the_admin(self):
+        submitted = []
+        self.enterContext(mock.patch('main.images._executor', mock.Mock(submit=submitted.append)))
+        self.enterContext(mock.patch('main.images._pending', mock.Mock()))
+        self.enterContext(mock.patch('main.images.close_old_connections'))
+        buffer = BytesIO()
+        PILImage.new('RGB', (200, 100), 'teal').save(buffer, 'PNG')
+        url = get_storage().put('hero_image', 'banner.png', buffer.getvalue(), 'image/png')
+
+        self.client.force_login(User.objects.create_superuser('admin'))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('admin:main_heroimage_add'),
+                                        {'title': 'Sale', 'image': url, 'active': 'on', 'ordering': 0})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(submitted), 1)
+        submitted[0]()
+        hero = HeroImage.objects.get(title='Sale')
+        self.assertEqual((hero.variants['widths'], hero.variants['base']),
+                         ([160], get_storage().url('hero_image', image_stem(url))))
+
+        # Saved again with the same image, nothing to render.
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('admin:main_heroimage_change', args=[hero.pk]),
+                             {'title': 'Summer sale', 'image': url, 'active': 'on', 'ordering': 0})
+        self.assertEqual(len(submitted), 1)
+
+    def test_image_stems_of_images_sharing_a_name(self):
+        urls = ['https://cdn.example.com/a/photo.jpg', 'https://cdn.example.com/b/photo.jpg',
+                'https://img.example.org/a/photo.jpg', 'https://cdn.example.com/a/photo.jpg?w=100']
+        stems = [image_stem(url) for url in urls]
+        self.assertEqual(len(set(stems)), 4)
+        self.assertTrue(all(stem.startswith('photo-') for stem in stems))
+        self.assertEqual(image_stem(urls[0]), stems[0])
+
+    def test_store_logo(self):
+        logo = SimpleUploadedFile('logo.png', b'logo', content_type='image/png')
+        response = self.client.post(reverse('upload_store_logo'), {'store_id': self.store.pk, 'image': logo})
+        self.assertEqual(response.status_code, 200)
+        self.store.refresh_from_db()
+        self.assertEqual(self.store.logo, response.json()['logo'])
+        self.assertEqual(get_storage().get(self.store.logo), b'logo')
+
+
+class RepricingTests(TestCase):
+    """main.pricing.reprice against Product.calculate_unit_price."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.store = Store.objects.create(user=User.objects.create_user('owner'), name='Store', description='Gadgets',
+                                         contact_info='0800000000', address='Lagos')
+        # Base prices whose marked up price lands on or next to half a cent.
+        base_prices = ['0.01', '0.05', '0.10', '1.01', '1.15', '2.35', '4.99', '10.05', '19.99', '33.33',
+                       '99.95', '100.10', '1234.55', '99999.99', '5513320176.58']
+        cls.products = [
+            Product.objects.create(store=cls.store, name=f'Product {i}', description='A product', specification='Specs',
+                                   unit_price=Decimal(1), inventory=10, is_dropshipping=True,
+                                   base_price=Decimal(base_price), markup_percentage=30)
+            for i, base_price in enumerate(base_prices)
+        ]
+        # Prices out of date with their markup, as after a change of base prices.
+        Product.objects.filter(is_dropshipping=True).update(unit_price=Decimal(1))
+        # Neither touched nor audited.
+        cls.own_product = Product.objects.create(store=cls.store, name='Own', description='Ours', specification='-',
+                                                 unit_price=Decimal(5), inventory=10)
+
+    def assertPricesMatch(self, markup):
+        for product in Product.objects.filter(is_dropshipping=True):
+            self.assertEqual(product.markup_percentage, markup)
+            self.assertEqual(product.unit_price, Product.calculate_unit_price(product.base_price, markup),
+                             (product.base_price, markup))
+
+    def test_prices_match_calculate_unit_price(self):
+        for markup in [30, 12.5, 7.45, 33.33, 0.5, 22.31, 50]:
+            with self.subTest(markup=markup):
+                diff = reprice(markup)
+                self.assertEqual(diff['count'], len(self.products))
+                self.assertPricesMatch(markup)
+        self.own_product.refresh_from_db()
+        self.assertEqual(self.own_product.unit_price, Decimal(5))
+
+    def test_markup_is_rounded_to_two_places(self):
+        reprice(12.345)
+        self.assertPricesMatch(12.35)
+
+    def test_audit_rows(self):
+        old_prices = {product.pk: Decimal(1) for product in self.products}
+        diff = reprice(12.5)
+        repricing = Repricing.objects.get(pk=diff['repricing'])
+        self.assertEqual(repricing.product_count, len(self.products))
+        changes = {change.product_id: change for change in PriceChange.objects.filter(repricing=repricing)}
+        self.assertEqual(changes.keys(), old_prices.keys())
+        for product in Product.objects.filter(pk__in=old_prices):
+            change = changes[product.pk]
+            self.assertEqual((change.old_unit_price, change.old_markup_percentage), (old_prices[product.pk], 30))
+            self.assertEqual(change.new_unit_price, product.unit_price)
+        self.assertEqual(diff['old_total'], sum(old_prices.values()))
+        self.assertEqual(diff['new_total'], sum(change.new_unit_price for change in changes.values()))
+
+        # Applying the same rule again changes and audits nothing.
+        self.assertEqual(reprice(12.5)['count'], 0)
+        self.assertEqual(PriceChange.objects.count(), len(self.products))
+
+    def test_dry_run_writes_nothing(self):
+        diff = reprice(12.5, dry_run=True)
+        self.assertIsNone(diff['repricing'])
+        self.assertEqual(diff['count'], len(self.products))
+        self.assertEqual([change['new_unit_price'] for change in diff['changes']], [
+            Product.calculate_unit_price(product.base_price, 12.5) for product in self.products
+        ])
+        self.assertFalse(Repricing.objects.exists())
+        self.assertFalse(PriceChange.objects.exists())
+        self.assertEqual(set(Product.objects.filter(is_dropshipping=True).values_list('unit_price', flat=True)),
+                         {Decimal(1)})
+
+
+class SalesRollupTests(TestCase):
+    """The daily rollups of main.sales, kept by the Order signals."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer')
+        cls.stores = [
+            Store.objects.create(user=User.objects.create_user(f'owner{i}'), name=f'Store {i}', description='Gadgets',
+                                 contact_info='0800000000', address='Lagos')
+            for i in range(2)
+        ]
+        cls.product = Product.objects.create(store=cls.stores[0], name='Kettle', description='A kettle',
+                                             specification='1L', unit_price=Decimal(10), inventory=100)
+
+    def order(self, store, quantity):
+        cart = Cart.objects.create(user=self.customer, store=store, status=Cart.STATUS_INACTIVE)
+        order = Order.objects.create(cart=cart, user=self.customer, store=store, total_price=Decimal(10) * quantity,
+                                     shipping_address='Lagos', contact_info='0800000000')
+        OrderItem.objects.create(order=order, product=self.product, quantity=quantity, price_at_purchase=Decimal(10))
+        order.status = Order.STATUS_PROCESSING
+        order.save(update_fields=['status'])
+        return order
+
+    def test_product_sold_by_two_stores_on_one_day(self):
+        # The product changed hands between the two orders.
+        self.order(self.stores[0], 2)
+        self.order(self.stores[1], 3)
+        row = ProductDailySales.objects.get(product=self.product)
+        self.assertEqual((row.store_id, row.order_count, row.units_sold), (self.stores[0].pk, 2, 5))
+        self.assertEqual(Decimal(str(row.revenue)), Decimal('50.00'))
+        self.assertEqual(sorted(StoreDailySales.objects.values_list('store_id', 'units_sold')),
+                         [(self.stores[0].pk, 2), (self.stores[1].pk, 3)])
+
+        # A rebuild from the orders gives the same rows.
+        day = row.date
+        rebuild_sales(day, day + timedelta(days=1))
+        rebuilt = ProductDailySales.objects.get(product=self.product)
+        self.assertEqual((rebuilt.order_count, rebuilt.units_sold), (2, 5))
+
+
+class HomepageTests(TestCase):
+    """The snapshot of main.homepage behind GET api/homepage/."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.store = Store.objects.create(user=User.objects.create_user('owner'), name='Store', description='Gadgets',
+                                         contact_info='0800000000', address='Lagos')
+        Product.objects.create(store=cls.store, name='Kettle', description='A kettle', specification='1L',
+                               unit_price=Decimal(10), inventory=10)
+
+    def setUp(self):
+        homepage_snapshot.clear()
+        self.addCleanup(homepage_snapshot.clear)
+        self.enterContext(mock.patch.object(homepage_snapshot, 'delay', 0))
+        # Rebuilds are run inline below, where closing the connection would end the test's transaction.
+        self.enterContext(mock.patch('main.homepage.close_old_connections'))
+        self.rebuild = self.enterContext(mock.patch.object(homepage_snapshot, 'rebuild'))
+
+    def get(self, **headers):
+        return self.client.get(reverse('homepage'), **headers)
+
+    def newest(self, response):
+        return [product['name'] for product in response.json()['newest_products']]
+
+    def test_etag_names_the_snapshot_served(self):
+        first = self.get()
+        self.assertEqual(self.newest(first), ['Kettle'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(store=self.store, name='Toaster', description='A toaster',
+                                   specification='2 slots', unit_price=Decimal(20), inventory=10)
+        self.assertTrue(self.rebuild.called)
+
+        # Until the rebuild is done, the old snapshot is served under its own ETag.
+        stale = self.get()
+        self.assertEqual(self.newest(stale), ['Kettle'])
+        self.assertEqual(stale['ETag'], first['ETag'])
+
+        homepage_snapshot._rebuild()
+        fresh = self.get(HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(fresh.status_code, 200)
+        self.assertEqual(self.newest(fresh), ['Toaster', 'Kettle'])
+        self.assertNotEqual(fresh['ETag'], first['ETag'])
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=fresh['ETag']).status_code, 304)
+
+    def test_writes_outside_the_request_path_are_picked_up(self):
+        # As another process or a management command would write: the stamps
+        # move, the cache counter of this process doesn't.
+        first = self.get()
+        self.assertEqual(first.json()['hero_images'], [])
+        Product.objects.update(name='Teapot')
+        HeroImage.objects.create(title='Sale', image='https://cdn.example.com/sale.jpg')
+        bump_versions(['products', 'hero'])
+
+        # Served as is until the snapshot is due for a check.
+        self.assertEqual(self.newest(self.get()), ['Kettle'])
+        self.rebuild.assert_not_called()
+
+        with mock.patch.object(homepage_snapshot, 'max_age', 0):
+            self.assertEqual(self.newest(self.get()), ['Kettle'])
+            self.rebuild.assert_called_once()
+            homepage_snapshot._rebuild()
+            fresh = self.get(HTTP_IF_NONE_MATCH=first['ETag'])
+            # Checked again, nothing changed since the rebuild.
+            self.rebuild.assert_called_once()
+        self.assertEqual(fresh.status_code, 200)
+        self.assertEqual(self.newest(fresh), ['Teapot'])
+        self.assertEqual([image['title'] for image in fresh.json()['hero_images']], ['Sale'])
+        self.assertNotEqual(fresh['ETag'], first['ETag'])
+
+    def test_an_unchanged_snapshot_is_checked_with_one_query(self):
+        self.get()
+        with mock.patch.object(homepage_snapshot, 'max_age', 0), self.assertNumQueries(1):
+            self.get()
+        self.rebuild.assert_not_called()
+
+
+class SparseFieldsetTests(TestCase):
+    """?fields= and ?expand= of SparseFieldsetMixin, on the product list and detail."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customers = [User.objects.create_user(f'customer{i}') for i in range(3)]
+        cls.stores = [create_store(f'Store {i}') for i in range(3)]
+        cls.products = [create_product(cls.stores[i % 3], f'Product {i}') for i in range(6)]
+        for product in cls.products:
+            for customer in cls.customers:
+                ProductRating.objects.create(product=product, user=customer, rating=4)
+                ProductReview.objects.create(product=product, author=customer, review='Good')
+
+    def setUp(self):
+        response_cache.clear()
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_fields_trim_the_representation(self):
+        cards = self.get(reverse('products-list'), fields='id,name')['results']
+        self.assertEqual(len(cards), 6)
+        self.assertEqual([set(card) for card in cards], [{'id', 'name'}] * 6)
+        product = self.get(reverse('products-detail', args=[self.products[0].pk]), fields='id,unit_price')
+        self.assertEqual(set(product), {'id', 'unit_price'})
+
+    def test_unknown_fields_are_ignored(self):
+        cards = self.get(reverse('products-list'), fields='id,nope,name.nope', expand='nope')['results']
+        self.assertEqual(set(cards[0]), {'id', 'name'})
+        # Nothing but unknown names leaves nothing to render.
+        self.assertEqual(set(self.get(reverse('products-list'), fields='nope')['results'][0]), set())
+
+    def test_expand_embeds_the_relation(self):
+        card = self.get(reverse('products-list'), fields='id,store,ratings', expand='store,ratings')['results'][0]
+        product = Product.objects.get(pk=card['id'])
+        self.assertEqual(card['store']['name'], product.store.name)
+        self.assertEqual(len(card['ratings']), 3)
+        # Not expanded, the store is its primary key.
+        self.assertEqual(self.get(reverse('products-list'), fields='store')['results'][0]['store'], product.store_id)
+
+    def test_nested_fields(self):
+        url = reverse('products-list')
+        card = self.get(url, fields='id,store.name,ratings.rating', expand='store,ratings')['results'][0]
+        self.assertEqual(set(card), {'id', 'store', 'ratings'})
+        self.assertEqual(set(card['store']), {'name'})
+        self.assertEqual([set(rating) for rating in card['ratings']], [{'rating'}] * 3)
+        # A nested field names its parent, which is rendered whole without one.
+        card = self.get(url, fields='id,store', expand='store')['results'][0]
+        self.assertIn('contact_info', card['store'])
+
+        product = self.get(reverse('products-detail', args=[self.products[0].pk]), fields='name,store.name')
+        self.assertEqual(product, {'name': 'Product 0', 'store': {'name': 'Store 0'}})
+
+    def test_expand_adds_no_queries_per_product(self):
+        params = {'expand': 'store,ratings,reviews'}
+
+        def count_queries(page_size):
+            response_cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(len(self.get(reverse('products-list'), page_size=page_size, **params)['results']),
+                                 page_size)
+            return len(queries)
+
+        self.assertEqual(count_queries(2), count_queries(6))
+
+
+class CategoryTreeTests(TestCase):
+    """The process-wide tree of main.category_tree."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.root = Category.objects.create(name='Kitchen')
+        cls.child = Category.objects.create(name='Kettles', parent=cls.root)
+
+    def setUp(self):
+        invalidate_category_tree()
+        self.addCleanup(invalidate_category_tree)
+
+    def names(self):
+        tree = get_category_tree()
+        return [tree.get(self.root.pk)['name']] + [child['name'] for child in tree.children(self.root.pk)]
+
+    def test_invalidation_rebuilds_the_tree(self):
+        self.assertEqual(self.names(), ['Kitchen', 'Kettles'])
+        with self.assertNumQueries(0):
+            self.names()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Toasters', parent=self.root)
+            self.child.name = 'Jugs'
+            self.child.save()
+        self.assertEqual(self.names(), ['Kitchen', 'Jugs', 'Toasters'])
+
+    def test_writes_of_other_processes_are_seen_after_max_age(self):
+        self.assertEqual(self.names(), ['Kitchen', 'Kettles'])
+        # Another process renames the category: it bumps the version stamp,
+        # the cache counter of this process stays as it is.
+        Category.objects.filter(pk=self.child.pk).update(name='Jugs')
+        bump_versions(['categories'])
+        self.assertEqual(self.names(), ['Kitchen', 'Kettles'])
+
+        with mock.patch('main.category_tree.MAX_AGE', 0):
+            self.assertEqual(self.names(), ['Kitchen', 'Jugs'])
+            # Checked again, unchanged: one query for the stamp, the tree is kept.
+            with self.assertNumQueries(1):
+                self.assertEqual(self.names(), ['Kitchen', 'Jugs'])
+
+
+class ProductSearchTests(TestCase):
+    """main.search: the search documents kept by the signals, FTS5 on SQLite and tsvector on PostgreSQL."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.store = create_store()
+        cls.category = Category.objects.create(name='Kitchen')
+
+    def setUp(self):
+        response_cache.clear()
+
+    def create(self, name, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            return create_product(self.store, name, **fields)
+
+    def search(self, query):
+        return [product.name for product in search_products(Product.objects.all(), query)]
+
+    def test_writes_reindex_the_product(self):
+        product = self.create('Kettle', description='Stainless steel')
+        self.assertEqual(self.search('stainless'), ['Kettle'])
+        with self.captureOnCommitCallbacks(execute=True):
+            product.description = 'Glass body'
+            product.save()
+        self.assertEqual(self.search('stainless'), [])
+        self.assertEqual(self.search('glass kettle'), ['Kettle'])
+
+    def test_category_rename_reindexes_its_products(self):
+        self.create('Kettle', category=self.category)
+        self.create('Lamp')
+        self.assertEqual(self.search('kitchen'), ['Kettle'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = 'Cookware'
+            self.category.save()
+        self.assertEqual(self.search('kitchen'), [])
+        self.assertEqual(self.search('cookware'), ['Kettle'])
+
+    def test_results_are_ranked(self):
+        # A match in the name outranks one in the categories, which outranks one in the description.
+        self.create('Toaster', description='Goes well with a kettle')
+        self.create('Kettle')
+        self.create('Jug', category=Category.objects.create(name='Kettle accessories'))
+        self.create('Lamp')
+        self.assertEqual(self.search('kettle'), ['Kettle', 'Jug', 'Toaster'])
+
+    def test_stemming(self):
+        self.create('Kettle', description='Boils water in a minute')
+        self.assertEqual(self.search('kettles'), ['Kettle'])
+        self.assertEqual(self.search('boiling'), ['Kettle'])
+
+    def test_queries_without_terms(self):
+        self.create('Kettle')
+        for query in ['', '   ', '"', "'", '*', '-', '()', '"*:-()&|!^', 'AND OR NOT', 'NEAR(']:
+            response = self.client.get(reverse('products-list'), {'search': query})
+            self.assertEqual(response.status_code, 200, query)
+        # Operators are searched as words, without terms everything matches.
+        self.assertEqual(self.search('AND OR NOT'), [])
+        self.assertEqual(self.search('"*:-()&|!^'), ['Kettle'])
+
+
+class KeysetPaginationTests(TestCase):
+    """main.pagination.KeysetPagination, on sort keys full of ties."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer')
+        cls.store = create_store()
+        # Three distinct dates and prices for seven products, the primary key breaks the ties.
+        cls.products = [create_product(cls.store, f'Product {i}', unit_price=Decimal(10 + i % 2)) for i in range(7)]
+        moment = timezone.now()
+        for i, product in enumerate(cls.products):
+            Product.objects.filter(pk=product.pk).update(date_created=moment - timedelta(days=i % 3))
+        for _ in range(7):
+            cart = Cart.objects.create(user=cls.customer, store=cls.store, status=Cart.STATUS_INACTIVE)
+            Order.objects.create(cart=cart, user=cls.customer, store=cls.store, total_price=Decimal(10),
+                                 shipping_address='Lagos', contact_info='0800000000')
+        Order.objects.update(created_at=moment)
+
+    def setUp(self):
+        # Authenticated, so pages never come from the response cache.
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def walk(self, url, **params):
+        """The ids of every page, following the next links, then those of the previous links back."""
+        pages = [self.get(url, page_size=3, **params)]
+        while pages[-1]['next']:
+            pages.append(self.get(pages[-1]['next']))
+        self.assertIsNone(pages[0]['previous'])
+
+        back = [pages[-1]]
+        while back[-1]['previous']:
+            back.append(self.get(back[-1]['previous']))
+        self.assertEqual([[row['id'] for row in page['results']] for page in reversed(back)],
+                         [[row['id'] for row in page['results']] for page in pages])
+        return [row['id'] for page in pages for row in page['results']]
+
+    def test_products(self):
+        expected = [product.pk for product in Product.objects.order_by('-date_created', '-pk')]
+        self.assertEqual(self.walk(reverse('products-list')), expected)
+        expected = [product.pk for product in Product.objects.order_by('unit_price', 'pk')]
+        self.assertEqual(self.walk(reverse('products-list'), ordering='unit_price'), expected)
+        expected = [product.pk for product in Product.objects.order_by('-unit_price', '-pk')]
+        self.assertEqual(self.walk(reverse('products-list'), ordering='-unit_price'), expected)
+
+    def test_orders(self):
+        expected = [str(pk) for pk in Order.objects.order_by('-created_at', '-pk').values_list('pk', flat=True)]
+        self.assertEqual(self.walk(reverse('orders-list')), expected)
+
+    def test_rows_inserted_between_pages(self):
+        expected = [product.pk for product in Product.objects.order_by('unit_price', 'pk')]
+        page = self.get(reverse('products-list'), page_size=3, ordering='unit_price')
+        seen = [row['id'] for row in page['results']]
+        # One sorts before the page already read, one among the pages to come.
+        create_product(self.store, 'Cheap', unit_price=Decimal(1))
+        late = create_product(self.store, 'Tied', unit_price=Decimal(10))
+        while page['next']:
+            page = self.get(page['next'])
+            seen += [row['id'] for row in page['results']]
+        self.assertEqual(seen, expected[:4] + [late.pk] + expected[4:])
+
+    def test_invalid_cursors(self):
+        url = reverse('products-list')
+        ordering = ['-date_created', '-pk']
+
+        def encode(cursor):
+            return urlsafe_b64encode(json.dumps(cursor).encode('utf-8')).decode('ascii')
+
+        cursors = [
+            'garbage', '%%%', encode('a string'), encode([1, 2]), encode({'p': [1, 2]}),
+            urlsafe_b64encode(b'\xff\xfe').decode('ascii'),
+            encode({'p': ['2026-01-01T00:00:00Z', 1], 'r': 0, 'o': ['unit_price', 'pk']}),
+            encode({'p': ['2026-01-01T00:00:00Z'], 'r': 0, 'o': ordering}),
+            encode({'p': ['2026-01-01T00:00:00Z', 1], 'r': 0, 'o': 5}),
+            encode({'p': 'position', 'r': 0, 'o': ordering}),
+            encode({'p': ['not a date', 1], 'r': 0, 'o': ordering}),
+            encode({'p': ['2026-01-01T00:00:00Z', 'not a number'], 'r': 0, 'o': ordering}),
+            encode({'p': ['2026-01-01T00:00:00Z', 10 ** 30], 'r': 0, 'o': ordering}),
+            encode({'p': ['2026-01-01T00:00:00Z', None], 'r': 0, 'o': ordering}),
+            encode({'p': [{'a': 1}, [1]], 'r': 1, 'o': ordering}),
+        ]
+        for cursor in cursors:
+            self.assertEqual(self.client.get(url, {'cursor': cursor}).status_code, 404, cursor)
+        cursor = encode({'p': ['1', 'not a price'], 'r': 0, 'o': ['unit_price', 'pk']})
+        self.assertEqual(self.client.get(url, {'cursor': cursor, 'ordering': 'unit_price'}).status_code, 404)
+        cursor = encode({'p': [1, 'x'], 'r': 0, 'o': ['-search_rank', '-pk']})
+        self.assertEqual(self.client.get(url, {'cursor': cursor, 'search': 'product'}).status_code, 404)
+
+
+class ConditionalGetTests(TestCase):
+    """ETag and Last-Modified of ConditionalGetMixin, on the product list and detail."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.store = create_store()
+        cls.products = [create_product(cls.store, name) for name in ['Kettle', 'Toaster']]
+        # The stamps the signals would have bumped on commit.
+        bump_versions(['products', 'categories', *(f'product:{product.pk}' for product in cls.products)])
+
+    def setUp(self):
+        response_cache.clear()
+
+    def update(self, product, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            for name, value in fields.items():
+                setattr(product, name, value)
+            product.save()
+
+    def assertRevalidates(self, url, queries, **params):
+        """The ETag of url, after checking a request naming it gets a 304 in queries queries."""
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        with self.assertNumQueries(queries):
+            not_modified = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], etag)
+        self.assertEqual(self.client.get(url, params, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code,
+                         304)
+        return etag
+
+    def test_list(self):
+        url = reverse('products-list')
+        # Just the version stamps.
+        etag = self.assertRevalidates(url, 1)
+        self.assertNotEqual(self.assertRevalidates(url, 1, ordering='unit_price'), etag)
+
+        self.update(self.products[1], unit_price=Decimal(12))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.assertRevalidates(url, 1), response['ETag'])
+
+    def test_detail(self):
+        url = reverse('products-detail', args=[self.products[0].pk])
+        # The store of the product, then its version stamps.
+        etag = self.assertRevalidates(url, 2, fields='name')
+
+        # Other products are not part of it without the store, which lists its orders.
+        self.update(self.products[1], name='Grill')
+        self.assertEqual(self.assertRevalidates(url, 2, fields='name'), etag)
+
+        self.update(self.products[0], name='Jug')
+        response = self.client.get(url, {'fields': 'name'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'name': 'Jug'})
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_missing_product(self):
+        response = self.client.get(reverse('products-detail', args=[0]), HTTP_IF_NONE_MATCH='"x"')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class ResponseCacheTests(TestCase):
+    """main.response_cache, behind the anonymous product list."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.store = create_store()
+        cls.product = create_product(cls.store)
+
+    def setUp(self):
+        response_cache.clear()
+
+    def get(self):
+        response = self.client.get(reverse('products-list'))
+        self.assertEqual(response.status_code, 200)
+        return [product['name'] for product in response.json()['results']]
+
+    def counted(self, request):
+        """The result of request() and how the counters of response_cache moved."""
+        before = dict(response_cache.counters)
+        result = request()
+        return result, {name: count - before[name] for name, count in response_cache.counters.items() if count != before[name]}
+
+    def test_hit_and_miss(self):
+        self.assertEqual(self.counted(self.get), (['Kettle'], {'misses': 1, 'stores': 1}))
+        # The version stamps of the ETag are all that is left to read.
+        with self.assertNumQueries(1):
+            self.assertEqual(self.counted(self.get), (['Kettle'], {'local_hits': 1}))
+
+    def test_writes_invalidate_their_namespaces(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.store.name = 'Shop'
+            self.store.save()
+        # Cards don't show the store.
+        self.assertEqual(self.counted(self.get), (['Kettle'], {'local_hits': 1}))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Jug'
+            self.product.save()
+        self.assertEqual(self.counted(self.get), (['Jug'], {'misses': 1, 'stores': 1}))
+
+    def test_authenticated_requests_bypass_the_cache(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('customer'))
+        self.assertEqual(self.counted(self.get), (['Kettle'], {}))
+        self.assertEqual(self.counted(self.get), (['Kettle'], {}))
+
+    def test_eviction(self):
+        cache = LRUCache(max_entries=2, max_bytes=100, timeout=60)
+        cache.set('a', 1, 10)
+        cache.set('b', 2, 10)
+        cache.get('a')
+        cache.set('c', 3, 10)
+        # b was the least recently used.
+        self.assertEqual([cache.get(key) for key in 'abc'], [1, None, 3])
+        self.assertEqual((len(cache), cache.size, cache.evictions), (2, 20, 1))
+
+        sized = LRUCache(max_entries=10, max_bytes=100, timeout=60)
+        for key, size in [('a', 60), ('b', 30), ('c', 20)]:
+            sized.set(key, key, size)
+        self.assertEqual([sized.get(key) for key in 'abc'], [None, 'b', 'c'])
+        self.assertEqual((sized.size, sized.evictions), (50, 1))
+        # Too big to be cached at all.
+        sized.set('d', 'd', 101)
+        self.assertEqual((sized.get('d'), sized.size), (None, 50))
+
+        expired = LRUCache(max_entries=2, max_bytes=100, timeout=-1)
+        expired.set('a', 1, 10)
+        self.assertIsNone(expired.get('a'))
+        self.assertEqual(len(expired), 0)
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'response-cache-tests'},
+    })
+    def test_processes_sharing_a_backend(self):
+        # Two processes, as far as the response cache can tell.
+        first, second = ResponseCache({'SHARED_CACHE': 'shared'}), ResponseCache({'SHARED_CACHE': 'shared'})
+        self.addCleanup(first.shared.clear)
+        compute = mock.Mock(side_effect=[['Kettle'], ['Jug']])
+        self.assertEqual(first.get_or_set(['products'], 'route', [], compute), ['Kettle'])
+        self.assertEqual(second.get_or_set(['products'], 'route', [], compute), ['Kettle'])
+        self.assertEqual(second.counters['shared_hits'], 1)
+
+        first.invalidate(['products'])
+        self.assertEqual(second.get_or_set(['products'], 'route', [], compute), ['Jug'])
+        self.assertEqual(first.get_or_set(['products'], 'route', [], compute), ['Jug'])
+        self.assertEqual(compute.call_count, 2)
+
+        # Without the shared backend, the other process keeps its entry until it expires.
+        first, second = ResponseCache(), ResponseCache()
+        self.assertEqual(second.get_or_set(['products'], 'route', [], lambda: ['Kettle']), ['Kettle'])
+        first.invalidate(['products'])
+        self.assertEqual(second.get_or_set(['products'], 'route', [], lambda: ['Jug']), ['Kettle'])
+
+
+class ProductFacetTests(TestCase):
+    """GET products/facets/ (main.facets), under the filters and search of the product list."""
+
+    @classmethod
+    def setUpTestData(cls):
+        store = create_store()
+        cls.kitchen = Category.objects.create(name='Kitchen')
+        cls.kettles = Category.objects.create(name='Kettles', parent=cls.kitchen)
+        cls.garden = Category.objects.create(name='Garden')
+        for name, price, category, subcategory in [
+            ('Steel kettle', '5.10', cls.kitchen, cls.kettles),
+            ('Glass kettle', '12.50', cls.kitchen, cls.kettles),
+            ('Toaster', '30.00', cls.kitchen, None),
+            ('Lamp', '30.00', cls.garden, None),
+            ('Mower', '600.99', cls.garden, None),
+        ]:
+            with cls.captureOnCommitCallbacks(execute=True):
+                create_product(store, name, unit_price=Decimal(price), category=category, subcategory=subcategory)
+
+    def setUp(self):
+        response_cache.clear()
+        invalidate_category_tree()
+
+    def facets(self, **params):
+        response = self.client.get(reverse('products-facets'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def counts(self, entries):
+        return {entry['name']: entry['count'] for entry in entries}
+
+    def test_all_products(self):
+        facets = self.facets()
+        self.assertEqual(facets['count'], 5)
+        # Decimal strings with unit_price's two places, whatever the database.
+        self.assertEqual((facets['min_price'], facets['max_price']), ('5.10', '600.99'))
+        self.assertEqual(self.counts(facets['category']), {'Kitchen': 3, 'Garden': 2})
+        self.assertEqual(self.counts(facets['subcategory']), {'Kettles': 2})
+        self.assertEqual(facets['price'], [
+            {'min': 0, 'max': 10, 'count': 1},
+            {'min': 10, 'max': 25, 'count': 1},
+            {'min': 25, 'max': 50, 'count': 2},
+            {'min': 500, 'max': 1000, 'count': 1},
+        ])
+
+    def test_filters(self):
+        facets = self.facets(category__slug=self.kitchen.slug, unit_price__gt='10')
+        self.assertEqual((facets['count'], facets['min_price'], facets['max_price']), (2, '12.50', '30.00'))
+        self.assertEqual(self.counts(facets['category']), {'Kitchen': 2})
+        self.assertEqual(self.counts(facets['subcategory']), {'Kettles': 1})
+        self.assertEqual([entry['count'] for entry in facets['price']], [1, 1])
+
+    def test_search(self):
+        facets = self.facets(search='kettle')
+        self.assertEqual((facets['count'], facets['min_price'], facets['max_price']), (2, '5.10', '12.50'))
+        self.assertEqual(self.counts(facets['category']), {'Kitchen': 2})
+
+        facets = self.facets(search='nothing like it')
+        self.assertEqual((facets['count'], facets['min_price'], facets['max_price']), (0, None, None))
+        self.assertEqual((facets['category'], facets['price']), ([], []))
+
+
+def fill_cart(user, items):
+    """An active cart of user holding {product: quantity}."""
+    cart = Cart.objects.create(user=user, store=next(iter(items)).store)
+    for product, quantity in items.items():
+        CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+    return cart
+
+
+class CheckoutTests(TestCase):
+    """POST orders/ (main.checkout.place_order)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer')
+        store = create_store()
+        cls.kettle = create_product(store, 'Kettle', unit_price=Decimal('10.50'), inventory=5)
+        cls.toaster = create_product(store, 'Toaster', unit_price=Decimal(20), inventory=1)
+
+    def checkout(self):
+        client = APIClient()
+        client.force_authenticate(self.customer)
+        return client.post(reverse('orders-list'), {'shipping_address': 'Lagos', 'contact_info': '0800000000'},
+                           format='json')
+
+    def inventory(self):
+        return dict(Product.objects.filter(pk__in=[self.kettle.pk, self.toaster.pk]).values_list('name', 'inventory'))
+
+    def test_stock_goes_down_by_the_ordered_quantity(self):
+        cart = fill_cart(self.customer, {self.kettle: 2, self.toaster: 1})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.checkout()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.inventory(), {'Kettle': 3, 'Toaster': 0})
+
+        order = Order.objects.get(pk=response.json()['id'])
+        self.assertEqual(order.total_price, Decimal('41.00'))
+        self.assertEqual(sorted(order.order_items.values_list('product__name', 'quantity', 'price_at_purchase')),
+                         [('Kettle', 2, Decimal('10.50')), ('Toaster', 1, Decimal(20))])
+        cart.refresh_from_db()
+        self.assertEqual(cart.status, Cart.STATUS_INACTIVE)
+        if connection.features.has_select_for_update:
+            # The cart, then the items and their products.
+            self.assertEqual(sum('FOR UPDATE' in query['sql'] for query in queries.captured_queries), 2)
+
+    def test_ordering_more_than_the_stock(self):
+        cart = fill_cart(self.customer, {self.kettle: 2, self.toaster: 2})
+        response = self.checkout()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['products'], {str(self.toaster.pk): 'only 1 left in stock'})
+        self.assertEqual(self.inventory(), {'Kettle': 5, 'Toaster': 1})
+        cart.refresh_from_db()
+        self.assertEqual(cart.status, Cart.STATUS_ACTIVE)
+        self.assertEqual(sorted(cart.cart_items.values_list('product__name', 'quantity')),
+                         [('Kettle', 2), ('Toaster', 2)])
+        self.assertFalse(Order.objects.exists())
+
+    def test_empty_cart(self):
+        self.assertEqual(self.checkout().status_code, 400)
+        fill_cart(self.customer, {self.kettle: 1}).cart_items.all().delete()
+        self.assertEqual(self.checkout().json(), {'error': 'Cart is empty. Cannot create order.'})
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentCheckoutTests(TransactionTestCase):
+    """Checkouts of the last item in stock, from two threads and two connections."""
+
+    def test_concurrent_checkouts_cannot_oversell(self):
+        customers = [User.objects.create_user(f'customer{i}') for i in range(2)]
+        product = create_product(create_store(), inventory=1)
+        for customer in customers:
+            fill_cart(customer, {product: 1})
+
+        placed, release = threading.Event(), threading.Event()
+        outcomes = {}
+
+        def checkout(customer, hold):
+            try:
+                # The outer transaction keeps the locks of place_order until released.
+                with transaction.atomic():
+                    outcomes[customer.username] = place_order(customer, 'Lagos', '0800000000')
+                    if hold:
+                        placed.set()
+                        release.wait(5)
+            except CheckoutError as e:
+                outcomes[customer.username] = e
+            finally:
+                connection.close()
+
+        first = threading.Thread(target=checkout, args=(customers[0], True))
+        first.start()
+        self.assertTrue(placed.wait(5))
+        second = threading.Thread(target=checkout, args=(customers[1], False))
+        second.start()
+        # The second checkout waits for the product row the first one holds.
+        second.join(0.5)
+        self.assertTrue(second.is_alive())
+        release.set()
+        first.join(5)
+        second.join(5)
+
+        self.assertIsInstance(outcomes['customer0'], Order)
+        self.assertIsInstance(outcomes['customer1'], CheckoutError)
+        self.assertEqual(outcomes['customer1'].details, {product.pk: 'only 0 left in stock'})
+        product.refresh_from_db()
+        self.assertEqual(product.inventory, 0)
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class CartItemTests(TestCase):
+    """The cart-items/ routes and CartItem.objects.add."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer')
+        store = create_store()
+        cls.kettle = create_product(store, 'Kettle')
+        cls.toaster = create_product(store, 'Toaster')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def add(self, product_id, quantity):
+        return self.client.post(reverse('cart-items-list'), {'product_id': product_id, 'quantity': quantity},
+                                format='json')
+
+    def items(self):
+        return sorted(CartItem.objects.filter(cart__user=self.customer).values_list('product__name', 'quantity'))
+
+    def test_repeated_adds_sum_the_quantity(self):
+        first = self.add(self.kettle.pk, 2)
+        self.assertEqual(first.status_code, 200)
+        second = self.add(self.kettle.pk, 3)
+        self.assertEqual(second.json()['id'], first.json()['id'])
+        self.assertEqual(second.json()['quantity'], 5)
+        self.add(self.toaster.pk, 1)
+        self.assertEqual(self.items(), [('Kettle', 5), ('Toaster', 1)])
+        self.assertEqual(Cart.objects.filter(user=self.customer).count(), 1)
+
+        # Once the cart exists, an add is the one upsert.
+        with self.assertNumQueries(1):
+            CartItem.objects.add(self.customer, self.kettle.pk, 1)
+        self.assertEqual(self.items(), [('Kettle', 6), ('Toaster', 1)])
+
+        cart = Cart.objects.get(user=self.customer)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            CartItem.objects.create(cart=cart, product=self.kettle, quantity=1)
+
+    def test_adds_of_missing_products_or_quantities(self):
+        self.assertEqual(self.add(0, 1).status_code, 404)
+        for quantity in [0, -1, 'two']:
+            self.assertEqual(self.add(self.kettle.pk, quantity).status_code, 400, quantity)
+        self.assertEqual(self.items(), [])
+
+    def test_updates(self):
+        item_id = self.add(self.kettle.pk, 2).json()['id']
+        url = reverse('cart-items-detail', args=[item_id])
+        response = self.client.patch(url, {'quantity': 4}, format='json')
+        self.assertEqual((response.status_code, response.json()['quantity']), (200, 4))
+        self.assertEqual(self.client.patch(url, {'quantity': -1}, format='json').status_code, 400)
+        self.assertEqual(self.items(), [('Kettle', 4)])
+
+        # A quantity of 0 removes the item.
+        self.assertEqual(self.client.patch(url, {'quantity': 0}, format='json').status_code, 204)
+        self.assertEqual(self.items(), [])
+        self.assertEqual(self.client.patch(url, {'quantity': 1}, format='json').status_code, 404)
+
+
+class CartApplyTests(TestCase):
+    """CartItem.objects.apply, folding operations into one write per kind."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer')
+        store = create_store()
+        cls.products = {name: create_product(store, name) for name in ['Kettle', 'Toaster', 'Lamp', 'Jug']}
+        cls.cart = fill_cart(cls.customer, {cls.products['Kettle']: 2, cls.products['Toaster']: 1})
+
+    def apply(self, operations, queries):
+        with self.assertNumQueries(queries):
+            CartItem.objects.apply(self.cart, [(op, self.products[name].pk, quantity)
+                                               for op, name, quantity in operations])
+        return dict(self.cart.cart_items.values_list('product__name', 'quantity'))
+
+    def test_add_then_set(self):
+        # The set wins, whatever was added before it.
+        self.assertEqual(self.apply([('add', 'Kettle', 5), ('set', 'Kettle', 3)], 1), {'Kettle': 3, 'Toaster': 1})
+        # An add after a set adds to it.
+        self.assertEqual(self.apply([('set', 'Lamp', 1), ('add', 'Lamp', 2)], 1),
+                         {'Kettle': 3, 'Toaster': 1, 'Lamp': 3})
+
+    def test_set_then_remove(self):
+        self.assertEqual(self.apply([('set', 'Kettle', 4), ('remove', 'Kettle', 1)], 1), {'Toaster': 1})
+        # Set to 0, the item goes too.
+        self.assertEqual(self.apply([('set', 'Toaster', 0)], 1), {})
+
+    def test_remove_of_a_missing_item(self):
+        self.assertEqual(self.apply([('remove', 'Lamp', 1)], 1), {'Kettle': 2, 'Toaster': 1})
+        # Added back after the remove, the item is set rather than incremented.
+        self.assertEqual(self.apply([('remove', 'Kettle', 1), ('add', 'Kettle', 1)], 1), {'Kettle': 1, 'Toaster': 1})
+
+    def test_mixed_batch(self):
+        operations = [
+            ('add', 'Kettle', 1), ('add', 'Kettle', 2),  # incremented: 2 + 3
+            ('remove', 'Toaster', 1),                    # deleted
+            ('add', 'Lamp', 2), ('set', 'Lamp', 7),      # overwritten
+            ('add', 'Jug', 4),                           # inserted
+        ]
+        # One DELETE, one overwriting upsert and one incrementing upsert.
+        self.assertEqual(self.apply(operations, 3), {'Kettle': 5, 'Lamp': 7, 'Jug': 4})
+        self.assertEqual(CartItem.objects.filter(cart=self.cart).count(), 3)
+
+
+class ImportAliexpressTests(TestCase):
+    """The import_aliexpress management command."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.store = create_store()
+        cls.kitchen = Category.objects.create(name='Kitchen', aliexpress_id='100')
+        cls.kettles = Category.objects.create(name='Kettles', parent=cls.kitchen, aliexpress_id='110')
+        cls.electric = Category.objects.create(name='Electric kettles', parent=cls.kettles, aliexpress_id='111')
+
+    def setUp(self):
+        invalidate_category_tree()
+
+    def run_import(self, rows, feed_format='jsonl'):
+        """stdout and stderr of an import of rows, dicts or raw lines."""
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        path = os.path.join(directory, f'feed.{feed_format}')
+        with open(path, 'w', newline='', encoding='utf-8') as feed:
+            if feed_format == 'csv':
+                feed.write(rows)
+            else:
+                feed.writelines((row if isinstance(row, str) else json.dumps(row)) + '\n' for row in rows)
+        stdout, stderr = StringIO(), StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('import_aliexpress', path, store=self.store.pk, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def product(self, aliexpress_id):
+        return Product.objects.get(aliexpress_id=aliexpress_id)
+
+    def test_reimport_updates_the_products(self):
+        self.run_import([
+            {'aliexpress_id': 'AE1', 'name': 'Kettle', 'base_price': '10.00', 'inventory': 5},
+            {'aliexpress_id': 'AE2', 'name': 'Jug', 'base_price': '4.00', 'markup_percentage': 50},
+        ])
+        kettle = self.product('AE1')
+        self.assertEqual((kettle.unit_price, kettle.inventory, kettle.store_id), (Decimal('13.00'), 5, self.store.pk))
+        Product.objects.filter(pk=kettle.pk).update(is_active=False)
+
+        output, _ = self.run_import([
+            {'aliexpress_id': 'AE1', 'name': 'Steel kettle', 'base_price': '12.00', 'inventory': 3},
+            {'aliexpress_id': 'AE3', 'name': 'Toaster', 'base_price': '20.00'},
+        ])
+        self.assertIn('Imported 2 products', output)
+        self.assertEqual(Product.objects.count(), 3)
+        updated = self.product('AE1')
+        self.assertEqual(updated.pk, kettle.pk)
+        self.assertEqual((updated.name, updated.unit_price, updated.inventory), ('Steel kettle', Decimal('15.60'), 3))
+        # Left as it was.
+        self.assertFalse(updated.is_active)
+        self.assertEqual(self.product('AE2').unit_price, Decimal('6.00'))
+        # And searchable under the new name.
+        self.assertEqual([product.pk for product in search_products(Product.objects.all(), 'steel')], [kettle.pk])
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        valid = {'name': 'Kettle', 'base_price': '10.00'}
+        output, errors = self.run_import([
+            {'aliexpress_id': 'AE1', **valid},
+            'not json',
+            ['a', 'list'],
+            {'aliexpress_id': 'AE2', 'base_price': '1.00'},
+            {'aliexpress_id': 'AE3', **valid, 'markup_percentage': float('nan')},
+            {'aliexpress_id': 'AE4', **valid, 'markup_percentage': float('inf')},
+            {'aliexpress_id': 'AE5', **valid, 'markup_percentage': 'lots'},
+            {'aliexpress_id': 'X' * 101, **valid},
+            {'aliexpress_id': 'AE6', **valid, 'aliexpress_url': 'https://example.com/' + 'x' * 500},
+            {'aliexpress_id': 'AE7', 'name': 'Kettle', 'base_price': '-1'},
+            {'aliexpress_id': 'AE8', 'name': 'Kettle', 'base_price': '9999999999.99'},
+            {'aliexpress_id': 'AE9', 'name': 'Kettle', 'base_price': 'NaN'},
+            {'aliexpress_id': 'AE10', **valid, 'inventory': -1},
+            {'aliexpress_id': 'AE11', **valid},
+        ])
+        self.assertIn('Imported 2 products', output)
+        self.assertIn('12 rows skipped', output)
+        self.assertEqual(sorted(Product.objects.values_list('aliexpress_id', flat=True)), ['AE1', 'AE11'])
+        lines = errors.splitlines()
+        self.assertEqual([line.split(':', 1)[0] for line in lines], [f'Line {n}' for n in range(2, 14)])
+        self.assertIn('markup_percentage must be a finite number', lines[3])
+        self.assertIn('markup_percentage must be a finite number', lines[4])
+        self.assertIn('aliexpress_id is longer than 100 characters', lines[6])
+        self.assertIn('aliexpress_url is longer than 500 characters', lines[7])
+        self.assertIn('must be between 0 and 10000000000', lines[9])
+
+    def test_category_mapping(self):
+        _, errors = self.run_import(
+            'aliexpress_id,name,base_price,category_id\n'
+            'AE1,Kettle,10.00,111\n'
+            'AE2,Jug,10.00,110\n'
+            'AE3,Pan,10.00,100\n'
+            'AE4,Lamp,10.00,999\n'
+            'AE5,Toaster,10.00,\n',
+            feed_format='csv',
+        )
+        self.assertEqual(errors, '')
+        categories = {
+            product.aliexpress_id: (product.category_id, product.subcategory_id, product.sub_subcategory_id)
+            for product in Product.objects.all()
+        }
+        self.assertEqual(categories, {
+            'AE1': (self.kitchen.pk, self.kettles.pk, self.electric.pk),
+            'AE2': (self.kitchen.pk, self.kettles.pk, None),
+            'AE3': (self.kitchen.pk, None, None),
+            'AE4': (None, None, None),
+            'AE5': (None, None, None),
+        })
+
+    def test_markup_option(self):
+        with self.assertRaisesMessage(CommandError, '--markup must be a finite number.'):
+            call_command('import_aliexpress', os.devnull, store=self.store.pk, markup=float('nan'))
+
+
+class BenchmarkDataTests(TestCase):
+    """generate() and flush() of main.benchmark.data, at a tiny scale."""
+
+    MODELS = [User, Store, Category, CategoryImage, HeroImage, Product, ProductImage, ProductRating, ProductReview,
+              StoreRating, StoreReview, Cart, CartItem, Order, OrderItem, Payment, Conversation, ConversationMember,
+              Message, ProductDailySales, StoreDailySales]
+
+    def generate(self, seed=0, users=4, stores=3):
+        return benchmark_data.generate(users=users, stores=stores, categories=2, products=12, seed=seed, batch_size=5)
+
+    def snapshot(self):
+        """The generated rows, by natural keys rather than primary keys."""
+        return {
+            'products': list(Product.objects.order_by('aliexpress_id').values_list(
+                'aliexpress_id', 'name', 'unit_price', 'store__name', 'sub_subcategory__slug', 'rating_sum')),
+            'ratings': sorted(ProductRating.objects.values_list('product__aliexpress_id', 'user__username', 'rating')),
+            'orders': sorted(Order.objects.values_list('id', 'user__username', 'store__name', 'total_price', 'status')),
+            'cart_items': sorted(CartItem.objects.filter(cart__status=Cart.STATUS_ACTIVE)
+                                 .values_list('cart__user__username', 'product__aliexpress_id', 'quantity')),
+            'conversations': sorted(Conversation.objects.values_list('store__name', 'last_message__sender__username')),
+        }
+
+    def counts(self):
+        return {model.__name__: model.objects.count() for model in self.MODELS}
+
+    def test_generate_is_deterministic(self):
+        counts = self.generate()
+        snapshot = self.snapshot()
+        self.assertEqual(counts['Product'], 12)
+        self.assertEqual(len(snapshot['orders']), 4 * benchmark_data.ORDERS_PER_USER)
+        benchmark_data.flush()
+        self.assertEqual(self.generate(), counts)
+        self.assertEqual(self.snapshot(), snapshot)
+        benchmark_data.flush()
+        self.generate(seed=1)
+        self.assertNotEqual(self.snapshot()['products'], snapshot['products'])
+
+    def test_conversations_pair_a_customer_with_a_store_of_someone_else(self):
+        # Every user owns a store, so half of the random picks would be their own.
+        for seed in range(4):
+            self.generate(seed, users=2, stores=2)
+            conversations = Conversation.objects.select_related('store', 'last_message')
+            self.assertEqual(len(conversations), 2)
+            for conversation in conversations:
+                self.assertNotEqual(conversation.last_message.sender_id, conversation.store.user_id)
+                self.assertEqual(
+                    sorted(conversation.members.values_list('user_id', 'unread_count')),
+                    sorted([(conversation.last_message.sender_id, 0), (conversation.store.user_id, 1)]),
+                )
+            self.assertEqual(ConversationMember.objects.count(), 2 * 2)
+            benchmark_data.flush()
+
+    def test_flush_removes_everything(self):
+        before = self.counts()
+        self.generate()
+        self.assertTrue(all(self.counts()[name] > before[name] for name in before))
+        benchmark_data.flush()
+        self.assertEqual(self.counts(), before)
+
+
+class MessagingTests(TestCase):
+    """Unread counts of main.messaging."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner, cls.customer, cls.friend = (User.objects.create_user(name) for name in ['owner', 'customer', 'friend'])
+        cls.store = create_store(user=cls.owner)
+
+    def unread(self, conversation):
+        return dict(conversation.members.values_list('user__username', 'unread_count'))
+
+    def test_messages_count_as_unread_for_the_other_members(self):
+        conversation = get_conversation(self.customer, receiver_store=self.store)
+        self.assertEqual(self.unread(conversation), {'customer': 0, 'owner': 0})
+        send_message(conversation, self.customer, 'Is this in stock?')
+        send_message(conversation, self.customer, 'Hello?')
+        self.assertEqual(self.unread(conversation), {'customer': 0, 'owner': 2})
+        reply = send_message(conversation, self.owner, 'Yes')
+        self.assertEqual(self.unread(conversation), {'customer': 1, 'owner': 2})
+        self.assertEqual((reply.receiver_user, reply.receiver_store), (self.customer, None))
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.last_message, reply)
+
+    def test_mark_read(self):
+        store_thread = get_conversation(self.customer, receiver_store=self.store)
+        direct = get_conversation(self.friend, receiver_user=self.owner)
+        send_message(store_thread, self.customer, 'Is this in stock?')
+        send_message(direct, self.friend, 'Hi')
+        send_message(direct, self.owner, 'Hi to you')
+
+        self.assertEqual(mark_read(self.owner, [store_thread.pk]), 1)
+        self.assertEqual(self.unread(store_thread), {'customer': 0, 'owner': 0})
+        self.assertEqual(self.unread(direct), {'friend': 1, 'owner': 1})
+        self.assertEqual(mark_read(self.owner), 1)
+        self.assertEqual(self.unread(direct), {'friend': 1, 'owner': 0})
+        self.assertEqual(list(Message.objects.filter(is_read=False).values_list('content', flat=True)), ['Hi to you'])
+        self.assertEqual(mark_read(self.owner), 0)
+
+
+class MigrationTestCase(TransactionTestCase):
+    """
+    Migrates main back to migrate_from, has before_migration(apps) write
+    rows with the historical models, then migrates to migrate_to and sets
+    self.apps to the models of that state.
+    """
+    migrate_from = migrate_to = None
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('main', self.migrate_from)])
+        self.before_migration(executor.loader.project_state([('main', self.migrate_from)]).apps)
+
+        executor = MigrationExecutor(connection)
+        executor.migrate([('main', self.migrate_to)])
+        self.apps = executor.loader.project_state([('main', self.migrate_to)]).apps
+        self.addCleanup(call_command, 'migrate', 'main', verbosity=0)
+
+    def before_migration(self, apps):
+        pass
+
+
+class ConversationMigrationTests(MigrationTestCase):
+    """0010_conversations threads the existing messages."""
+    migrate_from = '0009_sales_rollups'
+    migrate_to = '0010_conversations'
+
+    def before_migration(self, apps):
+        User = apps.get_model('auth', 'User')
+        Store = apps.get_model('main', 'Store')
+        Message = apps.get_model('main', 'Message')
+        owner, customer, friend = (User.objects.create(username=name) for name in ['owner', 'customer', 'friend'])
+        store = Store.objects.create(user=owner, name='Store', description='Gadgets', contact_info='0800000000',
+                                     address='Lagos')
+        for sender, receiver, is_read, content in [
+            (customer, store, True, 'Is this in stock?'),
+            (customer, store, False, 'Hello?'),
+            (customer, friend, False, 'Hi'),
+            (friend, customer, True, 'Hi back'),
+            (friend, customer, False, 'Coming tonight?'),
+            (owner, customer, False, 'Yes it is'),
+        ]:
+            receiver = {'receiver_store': receiver} if isinstance(receiver, Store) else {'receiver_user': receiver}
+            Message.objects.create(sender=sender, content=content, is_read=is_read, **receiver)
+        self.users = {user.username: user.pk for user in [owner, customer, friend]}
+        self.store_id = store.pk
+
+    def test_messages_are_threaded(self):
+        Conversation = self.apps.get_model('main', 'Conversation')
+        Message = self.apps.get_model('main', 'Message')
+        owner, customer, friend = self.users['owner'], self.users['customer'], self.users['friend']
+        threads = {
+            conversation.key: (
+                list(conversation.messages.order_by('timestamp', 'pk').values_list('content', flat=True)),
+                dict(conversation.members.values_list('user__username', 'unread_count')),
+                conversation.last_message.content,
+            )
+            for conversation in Conversation.objects.all()
+        }
+        self.assertEqual(threads, {
+            f'store:{self.store_id}:{customer}': (
+                ['Is this in stock?', 'Hello?'], {'customer': 0, 'owner': 1}, 'Hello?'),
+            f'user:{min(customer, friend)}:{max(customer, friend)}': (
+                ['Hi', 'Hi back', 'Coming tonight?'], {'customer': 1, 'friend': 1}, 'Coming tonight?'),
+            f'user:{min(owner, customer)}:{max(owner, customer)}': (
+                ['Yes it is'], {'customer': 1, 'owner': 0}, 'Yes it is'),
+        })
+        self.assertFalse(Message.objects.filter(conversation__isnull=True).exists())
+
+
+class WishlistTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('customer')
+        store = create_store()
+        cls.kettle, cls.toaster, cls.blender = (create_product(store, name) for name in ['Kettle', 'Toaster', 'Blender'])
+
+    def setUp(self):
+        wishlist_cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add(self, product):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('wishlists-list'), {'product': product.pk}, format='json')
+
+    def remove(self, product):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('wishlists-remove'), {'product': product.pk}, format='json')
+
+    def wishlisted(self, products):
+        response = self.client.get(reverse('wishlists-membership'),
+                                   {'products': ','.join(str(product.pk) for product in products)})
+        self.assertEqual(response.status_code, 200)
+        return response.data['wishlisted']
+
+    def listed(self):
+        return [entry['product'] for entry in self.client.get(reverse('wishlists-list')).data['results']]
+
+    def test_add_is_idempotent(self):
+        first = self.add(self.kettle)
+        self.assertEqual(first.status_code, 201)
+        second = self.add(self.kettle)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data['id'], first.data['id'])
+        self.assertEqual(WishList.objects.filter(user=self.user).count(), 1)
+
+    def test_remove_is_idempotent(self):
+        self.add(self.kettle)
+        self.assertEqual(self.remove(self.kettle).status_code, 204)
+        self.assertEqual(self.remove(self.kettle).status_code, 204)
+        self.assertFalse(WishList.objects.filter(user=self.user).exists())
+
+    def test_added_products_are_listed(self):
+        self.assertEqual(self.wishlisted([self.kettle]), [])
+        self.assertEqual(self.listed(), [])
+        self.add(self.kettle)
+        self.assertEqual(self.listed(), [self.kettle.pk])
+        self.assertEqual(self.wishlisted([self.kettle]), [self.kettle.pk])
+
+    def test_membership(self):
+        self.add(self.kettle)
+        self.add(self.blender)
+        products = [self.kettle, self.toaster, self.blender]
+        self.assertEqual(self.wishlisted(products), sorted([self.kettle.pk, self.blender.pk]))
+        # Warm, the set is checked against its version stamp only.
+        with self.assertNumQueries(1):
+            self.wishlisted(products)
+        self.remove(self.kettle)
+        self.assertEqual(self.wishlisted(products), [self.blender.pk])
+        response = self.client.get(reverse('wishlists-membership'), {'products': 'kettle'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_writes_of_other_processes_are_seen(self):
+        # Another process, with a cache of its own.
+        other = WishlistCache()
+        self.assertEqual(other.product_ids(self.user.pk), frozenset())
+        self.add(self.toaster)
+        self.assertEqual(other.product_ids(self.user.pk), {self.toaster.pk})
+        WishList.objects.filter(user=self.user).delete()
+        self.assertEqual(other.product_ids(self.user.pk), {self.toaster.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            wishlist_cache.invalidate(self.user.pk)
+        self.assertEqual(other.product_ids(self.user.pk), frozenset())
+
+
+class WishlistMigrationTests(MigrationTestCase):
+    """0011_unique_wishlist_entries drops duplicate entries before adding the constraint."""
+    migrate_from = '0010_conversations'
+    migrate_to = '0011_unique_wishlist_entries'
+
+    def before_migration(self, apps):
+        User = apps.get_model('auth', 'User')
+        Store = apps.get_model('main', 'Store')
+        Product = apps.get_model('main', 'Product')
+        WishList = apps.get_model('main', 'WishList')
+        customer, other = User.objects.create(username='customer'), User.objects.create(username='other')
+        store = Store.objects.create(user=other, name='Store', description='Gadgets', contact_info='0800000000',
+                                     address='Lagos')
+        kettle, toaster = (
+            Product.objects.create(store=store, name=name, description='A product',
+                                   specification='Specs', unit_price=Decimal(10), inventory=10)
+            for name in ['Kettle', 'Toaster']
+        )
+        entries = [(customer, kettle), (customer, toaster), (other, kettle), (customer, kettle), (customer, kettle)]
+        ids = [WishList.objects.create(user=user, product=product).pk for user, product in entries]
+        # The oldest entry of each pair is kept.
+        self.kept = ids[:3]
+
+    def test_duplicates_are_removed(self):
+        WishList = self.apps.get_model('main', 'WishList')
+        self.assertEqual(sorted(WishList.objects.values_list('pk', flat=True)), sorted(self.kept))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            WishList.objects.create(user_id=WishList.objects.get(pk=self.kept[0]).user_id,
+                                    product_id=WishList.objects.get(pk=self.kept[0]).product_id)
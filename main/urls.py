@@ -4,7 +4,7 @@ from .views import (CategoryViewSet,
                     load_subcategories, load_sub_subcategories,
                     ProductViewSet, ProductImageViewSet, ProductReviewViewSet,
                     ProductRatingViewSet, StoreViewSet, StoreReviewViewSet,
-                    StoreRatingViewSet, MessageViewSet, WishListViewSet,
+                    StoreRatingViewSet, MessageViewSet, ConversationViewSet, WishListViewSet,
                     CartViewSet, CartItemViewSet, OrderViewSet, StoreOrdersViewSet,
                     HeroImageViewSet, CategoryImageViewSet, PaymentViewSet)
 from . import views
@@ -15,6 +15,7 @@ router.register('categories', viewset=CategoryViewSet, basename='categories')
 router.register('products', viewset=ProductViewSet, basename='products')
 router.register('stores', viewset=StoreViewSet, basename='stores')
 router.register('messages', viewset=MessageViewSet, basename='messages')
+router.register('conversations', viewset=ConversationViewSet, basename='conversations')
 router.register('wishlists', viewset=WishListViewSet, basename='wishlists')
 router.register('carts', viewset=CartViewSet, basename='carts')
 router.register('cart-items', viewset=CartItemViewSet, basename='cart-items')
@@ -43,6 +44,10 @@ urlpatterns = [
     path('ajax/load-subcategories/', views.load_subcategories, name='ajax_load_subcategories'),
     path('ajax/load-sub-subcategories/', views.load_sub_subcategories, name='ajax_load_sub_subcategories'),
     path('api/send_complaint/', views.send_complaint, name='send_complaint'),
+    path('api/response-cache/stats/', views.response_cache_stats, name='response_cache_stats'),
+    path('api/repricing/', views.reprice_products, name='reprice_products'),
+    path('api/events/', views.event_stream, name='event_stream'),
+    path('api/homepage/', views.HomepageView.as_view(), name='homepage'),
     path('', include(router.urls)),
     path('', include(product_router.urls)),
     path('', include(store_router.urls)),
@@ -0,0 +1,78 @@
+import hashlib
+from functools import partial
+
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .models import ResourceVersion
+
+
+def bump_versions(keys, batch_size=1000):
+    """Increments the version stamp of every key, creating missing ones."""
+    keys = sorted(set(keys))
+    now = timezone.now()
+    for start in range(0, len(keys), batch_size):
+        batch = keys[start:start + batch_size]
+        ResourceVersion.objects.bulk_create(
+            [ResourceVersion(key=key) for key in batch], ignore_conflicts=True
+        )
+        ResourceVersion.objects.filter(key__in=batch).update(version=F('version') + 1, updated_at=now)
+
+
+def get_versions(keys):
+    return {
+        row['key']: row for row in ResourceVersion.objects.filter(key__in=keys).values('key', 'version', 'updated_at')
+    }
+
+
+class ConditionalGetMixin:
+    """
+    Strong ETag and Last-Modified headers for list and retrieve.
+
+    get_version_keys() names the stamps the payload depends on. A matching
+    If-None-Match (or If-Modified-Since) is answered with 304 straight from
+    those stamps, before the main queries or the serializer run. Returning
+    None from get_version_keys() skips the conditional handling. Views that
+    serve a precomputed payload override get_version_stamps() to return the
+    stamps that payload was built from.
+    """
+
+    def get_version_keys(self):
+        return None
+
+    def get_version_stamps(self, keys):
+        return get_versions(keys)
+
+    def conditional_response(self, build_response):
+        keys = self.get_version_keys()
+        if keys is None:
+            return build_response()
+
+        versions = self.get_version_stamps(keys)
+        request = self.request
+        stamp = '|'.join(f"{key}:{versions[key]['version'] if key in versions else 0}" for key in sorted(keys))
+        tag_source = f'{request.accepted_renderer.format}|{request.get_full_path()}|{stamp}'
+        etag = '"{}"'.format(hashlib.sha1(tag_source.encode('utf-8')).hexdigest())
+
+        updated = [row['updated_at'] for row in versions.values()]
+        last_modified = int(max(updated).timestamp()) if updated else None
+
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            not_modified['ETag'] = etag
+            return not_modified
+
+        response = build_response()
+        if response.status_code == 200:
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(partial(super().list, request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(partial(super().retrieve, request, *args, **kwargs))
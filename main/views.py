@@ -1,88 +1,203 @@
-import os
-from django.http import JsonResponse
+import logging
+from functools import partial
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, StreamingHttpResponse
 
 from django.views.decorators.csrf import csrf_exempt
-from .utils import upload_to_supabase
-from django.db.models import Q
+from .category_tree import get_category_tree, invalidate_category_tree
+from .checkout import CheckoutError, place_order
+from .events import event_hub
+from .facets import product_facets
+from .homepage import VERSION_KEYS as HOMEPAGE_KEYS, homepage_snapshot
+from .images import schedule_variants
+from .messaging import get_conversation, mark_read, send_message
+from .pricing import reprice
+from .response_cache import CachedResponseMixin, response_cache
+from .sales import sales_series
+from .search import search_products
+from .versioning import ConditionalGetMixin
+from .wishlist import wishlist_cache
+from .signals import resources_changed
+from .storage import StorageError, get_storage
+from django.db import transaction
+from django.db.models import Prefetch, Q
 from django.http import JsonResponse
-from .utils import get_default_store
 from rest_framework import status
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import AuthenticationFailed, NotFound, PermissionDenied
 from rest_framework.generics import get_object_or_404
-from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.viewsets import ReadOnlyModelViewSet, ModelViewSet
-from .filters import ProductFilter, StoreFilter
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from .filters import ProductFilter, ProductSearchFilter, StoreFilter
 from .models import (Category, Product, ProductImage, ProductReview, ProductRating, Message, WishList, Payment,
-                     Store, StoreReview, StoreRating, Cart, CartItem, Order, OrderItem, HeroImage, CategoryImage)
-from .serializers import (CategorySerializer, ProductSerializer,
+                     Store, StoreReview, StoreRating, Cart, CartItem, Order, OrderItem, HeroImage, CategoryImage,
+                     ConversationMember)
+from .serializers import (CategorySerializer, ProductSerializer, ProductCardSerializer,
                           ProductImageSerializer, ProductReviewSerializer,
                           ProductRatingSerializer, StoreSerializer,
                           StoreReviewSerializer, StoreRatingSerializer,
-                          MessageSerializer, WishListSerializer,
-                          PaymentSerializer, CartSerializer, CartItemSerializer,
+                          MessageSerializer, WishListSerializer, WishlistProductSerializer,
+                          WishlistMembershipSerializer,
+                          PaymentSerializer, CartSerializer, CartItemSerializer, CartBulkSerializer, RepricingSerializer,
+                          SalesRangeSerializer, ConversationSerializer, MarkReadSerializer,
                           OrderSerializer, OrderItemSerializer, HeroImageSerializer, CategoryImageSerializer)
 
-from rest_framework.decorators import api_view
+from rest_framework.decorators import action, api_view, permission_classes
 from django.core.mail import send_mail
 from django.conf import settings
 
+logger = logging.getLogger(__name__)
 
 
 
-def load_subcategories(request):
-    category_id = request.GET.get('category_id')
-    subcategories = Category.objects.filter(
-        parent_id=category_id,
-        is_active=True
-    ).values('id', 'name', 'slug')  # Add slug if needed for URLs
+def _active_children(parent_id):
+    try:
+        parent_id = int(parent_id)
+    except (TypeError, ValueError):
+        return []
+    return [
+        {'id': child['id'], 'name': child['name'], 'slug': child['slug']}
+        for child in get_category_tree().children(parent_id)
+    ]
+
 
+def load_subcategories(request):
     return JsonResponse({
-        'subcategories': list(subcategories)
+        'subcategories': _active_children(request.GET.get('category_id'))
     })
 
 
 def load_sub_subcategories(request):
-    subcategory_id = request.GET.get('subcategory_id')
-    sub_subcategories = Category.objects.filter(
-        parent_id=subcategory_id,
-        is_active=True
-    ).values('id', 'name', 'slug')  # Add slug if needed
-
     return JsonResponse({
-        'sub_subcategories': list(sub_subcategories)
+        'sub_subcategories': _active_children(request.GET.get('subcategory_id'))
     })
 
-class CategoryViewSet(ReadOnlyModelViewSet):
+class CategoryViewSet(ConditionalGetMixin, CachedResponseMixin, ReadOnlyModelViewSet):
     queryset = Category.objects.filter(parent__isnull=True)
     serializer_class = CategorySerializer
     permission_classes = [AllowAny]
-
-
-class HeroImageViewSet(ReadOnlyModelViewSet):
+    cache_namespaces = ['categories']
+
+    def get_version_keys(self):
+        return ['categories']
+
+    # Both actions are served from the in-memory category tree, which renders
+    # the same payload as CategorySerializer without a query per node.
+    def list(self, request, *args, **kwargs):
+        def build_response():
+            tree = get_category_tree()
+            return Response([tree.serialize(pk) for pk in tree.roots()])
+        return self.conditional_response(partial(self.cached_response, build_response))
+
+    def retrieve(self, request, *args, **kwargs):
+        def build_response():
+            tree = get_category_tree()
+            try:
+                node = tree.get(int(kwargs['pk']))
+            except ValueError:
+                node = None
+            if node is None or node['parent'] is not None:
+                raise NotFound()
+            return Response(tree.serialize(node['id']))
+        return self.conditional_response(partial(self.cached_response, build_response))
+
+
+class HeroImageViewSet(ConditionalGetMixin, CachedResponseMixin, ReadOnlyModelViewSet):
     queryset = HeroImage.objects.filter(active=True).order_by('ordering')
     serializer_class = HeroImageSerializer
     permission_classes = [AllowAny]
+    cache_namespaces = ['hero']
+
+    def get_version_keys(self):
+        return ['hero']
+
+
+class HomepageView(ConditionalGetMixin, APIView):
+    """
+    Everything the landing page shows in one response: hero images,
+    top-level categories and featured and newest product cards, served from
+    the precomputed snapshot of main.homepage.
+    """
+    permission_classes = [AllowAny]
+
+    def get_version_keys(self):
+        return HOMEPAGE_KEYS
 
+    def get_version_stamps(self, keys):
+        # Those of the snapshot served, which lag behind the live ones while it is rebuilt.
+        return self.snapshot.versions
 
+    def get(self, request, *args, **kwargs):
+        self.snapshot = homepage_snapshot.get()
+        return self.conditional_response(lambda: Response(self.snapshot.payload))
 
 
-class ProductViewSet(ReadOnlyModelViewSet):
-    queryset = Product.objects.filter(is_active=True).prefetch_related('product_images').all()
+class ProductViewSet(ConditionalGetMixin, CachedResponseMixin, ReadOnlyModelViewSet):
+    queryset = Product.objects.filter(is_active=True)
     serializer_class = ProductSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, OrderingFilter]
     filterset_class = ProductFilter
-    search_fields = ['name', 'category__name', 'subcategory__name', 'sub_subcategory__name']
     ordering_fields = ['unit_price', 'date_created']
     permission_classes = [AllowAny]
 
+    def get_serializer_class(self):
+        # List pages get the card representation, the full one is only for detail.
+        if self.action == 'list':
+            return ProductCardSerializer
+        return ProductSerializer
+
+    def get_queryset(self):
+        # Newest first unless ?ordering= or a search ranking says otherwise.
+        queryset = self.queryset.order_by('-date_created')
+        return self.get_serializer_class().setup_queryset(queryset, self.request)
+
+    def renders_store(self):
+        fields, expand = self.get_serializer_class().get_requested_fields(self.request)
+        if self.action == 'list':
+            # Cards only embed the store when it is expanded.
+            return 'store' in expand
+        return not fields or 'store' in fields
+
+    def get_cache_namespaces(self):
+        return ['products', 'categories'] + (['stores'] if self.renders_store() else [])
 
-class ProductImageViewSet(ReadOnlyModelViewSet):
+    def get_version_keys(self):
+        if self.action == 'list':
+            return self.get_cache_namespaces()
+
+        try:
+            store_ids = list(self.queryset.filter(pk=self.kwargs['pk']).values_list('store_id', flat=True))
+        except ValueError:
+            return None
+        if not store_ids:
+            return None
+        keys = [f"product:{self.kwargs['pk']}", 'categories']
+        if self.renders_store():
+            # The nested store lists its orders, and those embed other products.
+            keys += [f'store:{store_ids[0]}', 'products']
+        return keys
+
+    @action(detail=False)
+    def facets(self, request):
+        # Same filters as the list, but search only restricts: counts need no ranking.
+        queryset = DjangoFilterBackend().filter_queryset(request, self.queryset, self)
+        queryset = search_products(queryset, request.query_params.get('search', ''), ranked=False)
+        data = response_cache.get_or_set(
+            ['products', 'categories'], ['products', 'facets'], request.query_params.lists(),
+            lambda: product_facets(queryset),
+        )
+        return Response(data)
+
+
+class ProductImageViewSet(CachedResponseMixin, ReadOnlyModelViewSet):
     queryset = ProductImage.objects.all()
     serializer_class = ProductImageSerializer
     permission_classes = [AllowAny]
+    cache_namespaces = ['products']
 
 
     def get_queryset(self):
@@ -98,7 +213,9 @@ class ProductReviewViewSet(ModelViewSet):
     permission_classes = [IsAuthenticatedOrReadOnly]
 
     def get_queryset(self):
-        return ProductReview.objects.filter(product_id=self.kwargs['product_pk'])
+        return ProductReview.objects.filter(product_id=self.kwargs['product_pk']).select_related('author').order_by(
+            '-date_created'
+        )
 
     def get_serializer_context(self):
         return {'product_pk': self.kwargs['product_pk']}
@@ -130,26 +247,80 @@ class ProductRatingViewSet(ModelViewSet):
     permission_classes = [IsAuthenticatedOrReadOnly]
 
     def get_queryset(self):
-        return ProductRating.objects.filter(product_id=self.kwargs['product_pk'])
+        return ProductRating.objects.filter(product_id=self.kwargs['product_pk']).select_related('user').order_by(
+            '-date_created'
+        )
 
 
     def get_serializer_context(self):
         return {'product_pk': self.kwargs['product_pk']}
 
+    # Every write also moves the denormalized rating totals on the product,
+    # inside the same transaction so they can never drift from the ratings.
     def perform_create(self, serializer):
         user = self.request.user
 
-        serializer.save()
-
+        with transaction.atomic():
+            rating = serializer.save(user=user)
+            Product.update_rating_totals(rating.product_id, 1, rating.rating)
 
+    # The rating row is read again under a lock, so concurrent edits of one
+    # rating apply their deltas one after the other.
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            old_rating = ProductRating.objects.select_for_update().values_list('rating', flat=True).get(
+                pk=serializer.instance.pk
+            )
+            rating = serializer.save()
+            Product.update_rating_totals(rating.product_id, 0, rating.rating - old_rating)
 
-class StoreViewSet(ReadOnlyModelViewSet):
-    queryset = Store.objects.prefetch_related('store_reviews').all()
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            old_rating = ProductRating.objects.select_for_update().filter(pk=instance.pk).values_list(
+                'rating', flat=True
+            ).first()
+            # Already deleted by a concurrent request, which took it out of the totals.
+            if old_rating is None:
+                return
+            Product.update_rating_totals(instance.product_id, -1, -old_rating)
+            instance.delete()
+
+
+
+class StoreViewSet(ConditionalGetMixin, CachedResponseMixin, ReadOnlyModelViewSet):
+    queryset = Store.objects.prefetch_related(
+        'store_reviews',
+        Prefetch('orders', queryset=OrderSerializer.setup_queryset(Order.objects.order_by('-created_at'))),
+    )
     serializer_class = StoreSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter]
     search_fields = ['name']
     filterset_class = StoreFilter
     permission_classes = [AllowAny]
+    cache_namespaces = ['stores', 'products', 'categories']
+
+    def get_version_keys(self):
+        # Stores embed their orders, whose items embed products and category names.
+        if self.action == 'list':
+            return ['stores', 'products', 'categories']
+        return [f"store:{self.kwargs['pk']}", 'products', 'categories']
+
+    @action(detail=True, permission_classes=[IsAuthenticated])
+    def sales(self, request, pk=None):
+        # Daily revenue, orders and units sold of the store, from the rollups in main.sales.
+        store = get_object_or_404(Store.objects.only('pk', 'user_id'), pk=pk)
+        if store.user_id != request.user.pk and not request.user.is_staff:
+            raise PermissionDenied("Only the store owner can see its sales.")
+        serializer = SalesRangeSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+        return Response({
+            'store': store.pk,
+            'product': params.get('product'),
+            'start': params['start'],
+            'end': params['end'],
+            **sales_series(store, params['start'], params['end'], params.get('product')),
+        })
 
 
 class StoreReviewViewSet(ModelViewSet):
@@ -158,7 +329,7 @@ class StoreReviewViewSet(ModelViewSet):
     permission_classes = [IsAuthenticatedOrReadOnly]
 
     def get_queryset(self):
-        return StoreReview.objects.filter(store_id=self.kwargs['store_pk'])
+        return StoreReview.objects.filter(store_id=self.kwargs['store_pk']).order_by('-date_created')
 
     def get_serializer_context(self):
         return  {'store_pk': self.kwargs['store_pk']}
@@ -190,7 +361,7 @@ class StoreOrdersViewSet(ModelViewSet):
     def get_queryset(self):
         store_pk = self.kwargs.get('store_pk')
         store = get_object_or_404(Store, pk=store_pk)
-        return Order.objects.filter(Store=store)
+        return OrderSerializer.setup_queryset(Order.objects.filter(store=store).order_by('-created_at'))
 
 
 
@@ -201,23 +372,56 @@ class MessageViewSet(ModelViewSet):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        user = self.request.user
-        # If the user is a store owner (assumed to have a related 'store' attribute)
-        if hasattr(user, "store"):
-            # For store owners, show messages they sent or messages sent to their store,
-            # as well as messages where they are the customer recipient (if any).
-            return Message.objects.filter(
-                Q(sender=user) | Q(receiver_store=user.store) | Q(receiver_user=user)
-            ).order_by('-timestamp')
-        else:
-            # For customers, show messages they sent or replies where they are the receiver.
-            return Message.objects.filter(
-                Q(sender=user) | Q(receiver_user=user)
-            ).order_by('-timestamp')
+        # Every message of the user's conversations, sent or received, store conversations included.
+        return Message.objects.filter(
+            conversation__members__user=self.request.user
+        ).select_related('sender').order_by('-timestamp')
 
     def perform_create(self, serializer):
-        # Let the serializer use the payload provided by the front end.
-        serializer.save(sender=self.request.user)
+        data = serializer.validated_data
+        with transaction.atomic():
+            conversation = get_conversation(self.request.user, data.get('receiver_user'), data.get('receiver_store'))
+            serializer.instance = send_message(conversation, self.request.user, data['content'])
+
+
+class ConversationViewSet(ReadOnlyModelViewSet):
+    """
+    The inbox: the user's conversations, most recently active first, with
+    their last message and unread count. messages/ pages through one
+    conversation and posts to it, read/ marks conversations read.
+    """
+    serializer_class = ConversationSerializer
+    permission_classes = [IsAuthenticated]
+    lookup_field = 'conversation'
+    lookup_url_kwarg = 'pk'
+
+    def get_queryset(self):
+        return ConversationMember.objects.filter(user=self.request.user).select_related(
+            'conversation__store', 'conversation__last_message__sender',
+        ).prefetch_related(
+            Prefetch('conversation__members', queryset=ConversationMember.objects.select_related('user')),
+        ).order_by('-last_message_at')
+
+    @action(detail=True, methods=['get', 'post'])
+    def messages(self, request, pk=None):
+        member = get_object_or_404(
+            ConversationMember.objects.select_related('conversation'), user=request.user, conversation_id=pk
+        )
+        if request.method == 'POST':
+            serializer = MessageSerializer(data=request.data, context={'conversation': member.conversation})
+            serializer.is_valid(raise_exception=True)
+            message = send_message(member.conversation, request.user, serializer.validated_data['content'])
+            return Response(MessageSerializer(message).data, status=status.HTTP_201_CREATED)
+
+        messages = Message.objects.filter(conversation_id=pk).select_related('sender').order_by('-timestamp')
+        page = self.paginate_queryset(messages)
+        return self.get_paginated_response(MessageSerializer(page, many=True).data)
+
+    @action(detail=False, methods=['post'])
+    def read(self, request):
+        serializer = MarkReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response({'marked': mark_read(request.user, serializer.validated_data.get('conversations'))})
 
 
 
@@ -228,8 +432,32 @@ class WishListViewSet(ModelViewSet):
     def get_queryset(self):
         return self.request.user.wishlist_set.all()
 
-    def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+    def create(self, request, *args, **kwargs):
+        # Adding a product that is already in the wishlist returns its entry.
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        wishlist, created = WishList.objects.get_or_create(
+            user=request.user, product=serializer.validated_data['product']
+        )
+        return Response(
+            self.get_serializer(wishlist).data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        )
+
+    @action(detail=False, methods=['post'])
+    def remove(self, request):
+        # Removing a product that isn't in the wishlist is not an error.
+        serializer = WishlistProductSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        WishList.objects.filter(user=request.user, product_id=serializer.validated_data['product']).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=False)
+    def membership(self, request):
+        # Which of ?products= are in the wishlist, for the hearts of a page of product cards.
+        serializer = WishlistMembershipSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        products = serializer.validated_data['products']
+        return Response({'wishlisted': sorted(products & wishlist_cache.product_ids(request.user.pk))})
 
 
 
@@ -256,12 +484,7 @@ class CartViewSet(ModelViewSet):
         return Cart.objects.filter(user=self.request.user, status=Cart.STATUS_ACTIVE)
 
     def create(self, request, *args, **kwargs):
-        default_store = get_default_store()  # Get a default store
-        cart, created = Cart.objects.get_or_create(
-            user=request.user,
-            status=Cart.STATUS_ACTIVE,
-            store=default_store  # Provide the store to satisfy the NOT NULL constraint
-        )
+        cart = Cart.objects.get_active(request.user)
         serializer = self.get_serializer(cart)
         return Response(serializer.data)
 
@@ -272,49 +495,70 @@ class CartItemViewSet(ModelViewSet):
 
     def get_queryset(self):
         # Filter CartItem via the related cart's user and active status.
-        return CartItem.objects.filter(cart__user=self.request.user, cart__status=Cart.STATUS_ACTIVE)
+        return CartItem.objects.filter(
+            cart__user=self.request.user, cart__status=Cart.STATUS_ACTIVE
+        ).select_related(
+            'product__category', 'product__subcategory', 'product__sub_subcategory'
+        ).prefetch_related('product__product_images')
 
     def create(self, request, *args, **kwargs):
-        default_store = get_default_store()  # Get the default store
-
-        # Instead of get_or_create (which can return multiple objects), filter for existing carts.
-        cart_qs = Cart.objects.filter(
-            user=request.user,
-            status=Cart.STATUS_ACTIVE,
-            store=default_store
-        )
-        if cart_qs.exists():
-            # If more than one exists, choose the most recent (ordered by id descending).
-            cart = cart_qs.order_by('-id').first()
-        else:
-            cart = Cart.objects.create(
-                user=request.user,
-                status=Cart.STATUS_ACTIVE,
-                store=default_store
+        try:
+            product_id = int(request.data.get('product_id'))
+            quantity = int(request.data.get('quantity', 1))
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'product_id and quantity must be integers'},
+                status=status.HTTP_400_BAD_REQUEST
             )
 
-        product_id = request.data.get('product_id')
-        quantity = int(request.data.get('quantity', 1))
-
         if quantity <= 0:
             return Response(
                 {'error': 'Quantity must be greater than 0'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        product = get_object_or_404(Product, id=product_id)
+        # Creates the cart on first use and adds to the quantity of an existing item.
+        cart_item_id = CartItem.objects.add(request.user, product_id, quantity)
+        if cart_item_id is None:
+            raise NotFound('No Product matches the given query.')
+        cart_item = self.get_queryset().get(pk=cart_item_id)
 
-        cart_item, created = CartItem.objects.get_or_create(cart=cart, product=product)
+        serializer = self.get_serializer(cart_item)
+        return Response(serializer.data)
 
-        if created:
-            cart_item.quantity = quantity
-        else:
-            cart_item.quantity = (cart_item.quantity or 0) + quantity
+    def update(self, request, *args, **kwargs):
+        response = super().update(request, *args, **kwargs)
+        if self.removed:
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        return response
 
-        cart_item.save()
+    def perform_update(self, serializer):
+        # CartItem.save deletes an item set to a quantity of 0.
+        self.removed = serializer.save().pk is None
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        # Applies many add/set/remove operations at once, e.g. to restore a saved cart.
+        serializer = CartBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        operations = serializer.validated_data['operations']
+
+        product_ids = {operation['product_id'] for operation in operations if operation['op'] != 'remove'}
+        missing = product_ids - set(Product.objects.filter(pk__in=product_ids).values_list('pk', flat=True))
+        if missing:
+            return Response(
+                {'error': 'Some products do not exist.', 'products': sorted(missing)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-        serializer = self.get_serializer(cart_item)
-        return Response(serializer.data)
+        with transaction.atomic():
+            cart = Cart.objects.get_active(request.user)
+            CartItem.objects.apply(
+                cart, [(operation['op'], operation['product_id'], operation['quantity']) for operation in operations]
+            )
+
+        items = self.get_serializer(self.get_queryset().order_by('id'), many=True)
+        return Response({**CartSerializer(cart).data, 'items': items.data})
 
 
 from django.db import transaction
@@ -330,16 +574,9 @@ class OrderViewSet(ModelViewSet):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user)
+        return OrderSerializer.setup_queryset(Order.objects.filter(user=self.request.user).order_by('-created_at'))
 
     def create(self, request, *args, **kwargs):
-        # Find the active cart for the user.
-        active_carts = Cart.objects.filter(user=request.user, status=Cart.STATUS_ACTIVE)
-        if not active_carts.exists():
-            return Response({"error": "No active cart found"}, status=status.HTTP_400_BAD_REQUEST)
-        # If multiple active carts exist, choose the most recent one.
-        cart = active_carts.order_by('-id').first()
-
         # Retrieve shipping details from the request.
         shipping_address = request.data.get("shipping_address")
         contact_info = request.data.get("contact_info")
@@ -349,45 +586,25 @@ class OrderViewSet(ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Calculate the total price from the cart items.
-        total_price = cart.calculate_total_price()
-        if total_price == 0:
-            return Response({"error": "Cart is empty. Cannot create order."},
-                            status=status.HTTP_400_BAD_REQUEST)
-
-        # Create the Order.
-        order = Order.objects.create(
-            cart=cart,
-            shipping_address=shipping_address,
-            contact_info=contact_info,
-            user=request.user,
-            store=cart.store,
-            total_price=total_price
-        )
-
-        # Convert each CartItem into an OrderItem.
-        for cart_item in cart.cart_items.all():
-            OrderItem.objects.create(
-                order=order,
-                product=cart_item.product,
-                quantity=cart_item.quantity,
-                price_at_purchase=cart_item.product.unit_price,
-            )
-
-        # Optionally, mark the cart as inactive now that the order is placed.
-        cart.status = Cart.STATUS_INACTIVE
-        cart.save()
-
-        serializer = OrderSerializer(order)
+        try:
+            order = place_order(request.user, shipping_address, contact_info)
+        except CheckoutError as e:
+            error = {"error": e.message}
+            if e.details:
+                error["products"] = e.details
+            return Response(error, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = OrderSerializer(self.get_queryset().get(pk=order.pk))
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
 
 
-class CategoryImageViewSet(ReadOnlyModelViewSet):
+class CategoryImageViewSet(CachedResponseMixin, ReadOnlyModelViewSet):
     queryset = CategoryImage.objects.all()
     serializer_class = CategoryImageSerializer
     permission_classes = [AllowAny]
+    cache_namespaces = ['categories']
 
     def get_queryset(self):
         return CategoryImage.objects.filter(category_id=self.kwargs['category_pk'])
@@ -396,6 +613,11 @@ class CategoryImageViewSet(ReadOnlyModelViewSet):
         return {'category_pk': self.kwargs['category_pk']}
 
 
+def _uploaded_images(request):
+    # Several files can be sent under "image" (or "images") in one request.
+    return request.FILES.getlist("image") + request.FILES.getlist("images")
+
+
 @csrf_exempt
 def upload_store_logo(request):
     if request.method == "POST" and request.FILES.get("image") and request.POST.get("store_id"):
@@ -406,79 +628,86 @@ def upload_store_logo(request):
             return JsonResponse({"success": False, "error": "Store not found."}, status=404)
 
         image = request.FILES["image"]
-        temp_path = f"/tmp/{image.name}"
-        with open(temp_path, "wb") as f:
-            for chunk in image.chunks():
-                f.write(chunk)
-
-        # Use the mapping key "store_logo"
-        public_url = upload_to_supabase(temp_path, bucket_key="store_logo")
-        os.remove(temp_path)
-
-        if public_url:
-            store.logo = public_url
-            store.save()
-            return JsonResponse({"success": True, "store_id": store.id, "logo": public_url})
-        else:
+        try:
+            public_url = get_storage().upload("store_logo", image)
+        except StorageError as e:
+            logger.error("Store logo upload failed: %s", e)
             return JsonResponse({"success": False, "error": "Upload failed."}, status=500)
+
+        store.logo = public_url
+        store.logo_variants = None
+        store.save(update_fields=["logo", "logo_variants"])
+        schedule_variants(store, "store_logo", url_field="logo", variants_field="logo_variants")
+        return JsonResponse({"success": True, "store_id": store.id, "logo": public_url})
     return JsonResponse({"success": False, "error": "Invalid request."}, status=400)
 
 
+def _upload_images(images, bucket_key, create_rows, **extra):
+    """
+    Uploads images in parallel, then stores the URLs of the successful ones
+    with create_rows(urls), which returns the new rows, and schedules their
+    variants. Returns the JsonResponse for the upload views, extra is added
+    to it on success.
+    """
+    if len(images) > settings.UPLOAD_MAX_FILES:
+        return JsonResponse(
+            {"success": False, "error": f"At most {settings.UPLOAD_MAX_FILES} files per request."}, status=400
+        )
+
+    results = get_storage().upload_many(bucket_key, images)
+    urls = [url for url, error in results if url]
+    errors = [error for url, error in results if error]
+    for error in errors:
+        logger.error("Image upload failed: %s", error)
+    if not urls:
+        return JsonResponse({"success": False, "error": "Upload failed."}, status=500)
+
+    for row in create_rows(urls):
+        schedule_variants(row, bucket_key)
+    data = {"success": not errors, **extra, "image": urls[0], "images": urls}
+    if errors:
+        data["error"] = f"{len(errors)} of {len(images)} uploads failed."
+    return JsonResponse(data)
+
+
 @csrf_exempt
 def upload_category_image(request):
-    if request.method == "POST" and request.FILES.get("image") and request.POST.get("category_id"):
+    images = _uploaded_images(request)
+    if request.method == "POST" and images and request.POST.get("category_id"):
         category_id = request.POST.get("category_id")
         try:
             category = Category.objects.get(id=category_id)
-        except Category.DoesNotExist:
+        except (Category.DoesNotExist, ValueError):
             return JsonResponse({"success": False, "error": "Category not found."}, status=404)
 
-        image = request.FILES["image"]
-        temp_path = f"/tmp/{image.name}"
-        with open(temp_path, "wb") as f:
-            for chunk in image.chunks():
-                f.write(chunk)
-
-        # Use the mapping key "category_image"
-        public_url = upload_to_supabase(temp_path, bucket_key="category_image")
-        os.remove(temp_path)
-
-        if public_url:
-            # Either update the Category model or create a new CategoryImage record
-            category.image = public_url  # or CategoryImage.objects.create(category=category, image=public_url)
-            category.save()
-            return JsonResponse({"success": True, "category_id": category.id, "image": public_url})
-        else:
-            return JsonResponse({"success": False, "error": "Upload failed."}, status=500)
-    return JsonResponse({"success": False, "error": "Invalid request."}, status=400)
+        def create_rows(urls):
+            rows = CategoryImage.objects.bulk_create([CategoryImage(category=category, image=url) for url in urls])
+            # bulk_create sends no post_save, do what the signals would.
+            transaction.on_commit(invalidate_category_tree)
+            resources_changed(['categories'])
+            return rows
 
+        return _upload_images(images, "category_image", create_rows, category_id=category.id)
+    return JsonResponse({"success": False, "error": "Invalid request."}, status=400)
 
 
 @csrf_exempt
 def upload_product_image(request):
-    if request.method == "POST" and request.FILES.get("image") and request.POST.get("product_id"):
+    images = _uploaded_images(request)
+    if request.method == "POST" and images and request.POST.get("product_id"):
         product_id = request.POST.get("product_id")
         try:
             product = Product.objects.get(id=product_id)
-        except Product.DoesNotExist:
+        except (Product.DoesNotExist, ValueError):
             return JsonResponse({"success": False, "error": "Product not found."}, status=404)
 
-        image = request.FILES["image"]
-        temp_path = f"/tmp/{image.name}"
-        with open(temp_path, "wb") as f:
-            for chunk in image.chunks():
-                f.write(chunk)
-
-        # Use the mapping key "product_image"
-        public_url = upload_to_supabase(temp_path, bucket_key="product_image")
-        os.remove(temp_path)
-
-        if public_url:
-            product.image = public_url
-            product.save()
-            return JsonResponse({"success": True, "product_id": product.id, "image": public_url})
-        else:
-            return JsonResponse({"success": False, "error": "Upload failed."}, status=500)
+        def create_rows(urls):
+            rows = ProductImage.objects.bulk_create([ProductImage(product=product, image=url) for url in urls])
+            # bulk_create sends no post_save, do what the signals would.
+            resources_changed(['products', f'product:{product.pk}'])
+            return rows
+
+        return _upload_images(images, "product_image", create_rows, product_id=product.id)
     return JsonResponse({"success": False, "error": "Invalid request."}, status=400)
 
 
@@ -512,4 +741,59 @@ def send_complaint(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
-    return Response({'message': 'Your request has been sent successfully.'}, status=status.HTTP_200_OK)
\ No newline at end of file
+    return Response({'message': 'Your request has been sent successfully.'}, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def response_cache_stats(request):
+    return Response(response_cache.stats())
+
+
+async def event_stream(request):
+    """
+    Server-sent events of the user: 'message' for messages of their
+    conversations and 'order_status' for status changes of their orders and
+    of their stores' orders, see main.events. Meant for an ASGI server.
+    Authenticated by a JWT in the Authorization header or in ?token=, as
+    EventSource can't set headers, or else by the session. ?timeout= closes
+    the stream sooner than EVENTS['MAX_DURATION'], clients reconnect.
+    """
+    user = await _stream_user(request)
+    if user is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+    try:
+        duration = min(float(request.GET.get('timeout', event_hub.max_duration)), event_hub.max_duration)
+    except ValueError:
+        return JsonResponse({'detail': 'timeout must be a number of seconds.'}, status=400)
+
+    store_ids = [pk async for pk in Store.objects.filter(user=user).values_list('pk', flat=True)]
+    topics = [f'user:{user.pk}'] + [f'store:{store_id}' for store_id in store_ids]
+    response = StreamingHttpResponse(event_hub.stream(topics, duration), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stops nginx and similar proxies from buffering the stream.
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def _stream_user(request):
+    header = request.headers.get('Authorization', '')
+    raw_token = header[len('Bearer '):] if header.startswith('Bearer ') else request.GET.get('token')
+    if raw_token:
+        authentication = JWTAuthentication()
+        try:
+            token = authentication.get_validated_token(raw_token)
+            return await sync_to_async(authentication.get_user)(token)
+        except AuthenticationFailed:
+            return None
+    user = await request.auser()
+    return user if user.is_authenticated else None
+
+
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def reprice_products(request):
+    # Applies a markup rule to many dropshipped products at once, or previews it with dry_run.
+    serializer = RepricingSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    return Response(reprice(**serializer.validated_data, user=request.user))
@@ -0,0 +1,89 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Value
+
+from .models import ResourceVersion, WishList
+from .response_cache import LRUCache
+from .versioning import bump_versions
+
+DEFAULTS = {
+    'MAX_ENTRIES': 10000,
+    'MAX_BYTES': 16 * 1024 * 1024,
+    'TIMEOUT': 300,
+    # Alias of a CACHES entry shared by all processes, None for in-process only.
+    'SHARED_CACHE': None,
+}
+
+
+class WishlistCache:
+    """
+    The set of product ids in each user's wishlist, so membership checks of
+    product cards cost no query once warm. Sets are dropped after every
+    wishlist write commits. Without a shared backend they are kept per
+    process, under the 'wishlist:<user id>' version stamp (see
+    main.versioning) they were loaded with: every read checks the stamp, one
+    primary key lookup, so a write in another process is seen at once.
+    """
+
+    def __init__(self, options=None):
+        options = {**DEFAULTS, **(options or {})}
+        self.timeout = options['TIMEOUT']
+        self.local = LRUCache(options['MAX_ENTRIES'], options['MAX_BYTES'], options['TIMEOUT'])
+        self.shared_alias = options['SHARED_CACHE']
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias] if self.shared_alias else None
+
+    def product_ids(self, user_id):
+        key = f'wishlist:{user_id}'
+        cache = self.shared
+        if cache is None:
+            return self._local_product_ids(key, user_id)
+        ids = cache.get(key)
+        if ids is None:
+            ids = frozenset(WishList.objects.filter(user_id=user_id).values_list('product_id', flat=True))
+            cache.set(key, ids, self.timeout)
+        return ids
+
+    def _local_product_ids(self, key, user_id):
+        cached = self.local.get(key)
+        if cached is not None:
+            version = ResourceVersion.objects.filter(key=key).values_list('version', flat=True).first() or 0
+            if cached[0] == version:
+                return cached[1]
+
+        # The stamp and the rows in one query, so the set is never stored
+        # under a newer stamp than the rows it was read from.
+        rows = ResourceVersion.objects.filter(key=key).values_list(Value('version'), 'version').union(
+            WishList.objects.filter(user_id=user_id).values_list(Value('product'), 'product_id'), all=True,
+        )
+        version, ids = 0, set()
+        for kind, value in rows:
+            if kind == 'version':
+                version = value
+            else:
+                ids.add(value)
+        ids = frozenset(ids)
+        # Roughly what a set of small ints costs.
+        self.local.set(key, (version, ids), 64 + 32 * len(ids))
+        return ids
+
+    def invalidate(self, user_id):
+        # After the commit, so a concurrent read can't cache the old rows again.
+        def drop():
+            key = f'wishlist:{user_id}'
+            if self.shared is not None:
+                self.shared.delete(key)
+            else:
+                # The other processes notice the new stamp on their next read.
+                bump_versions([key])
+                self.local.delete(key)
+        transaction.on_commit(drop)
+
+    def clear(self):
+        self.local.clear()
+
+
+wishlist_cache = WishlistCache(getattr(settings, 'WISHLIST_CACHE', None))
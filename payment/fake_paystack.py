@@ -0,0 +1,119 @@
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+from .paystack import sign
+
+
+class FakePaystack:
+    """
+    Local stand-in for the parts of the Paystack API this project uses.
+
+    Serves GET /transaction/verify/<reference> from `transactions`. Unknown
+    references get `default_status` (None answers 400 like Paystack does).
+    `delay` slows every answer down and `fail_status` makes every answer
+    that HTTP error, to exercise timeouts and the circuit breaker.
+
+        with FakePaystack() as paystack:
+            paystack.add_transaction('ref-1', amount=5000)
+            settings.PAYSTACK_BASE_URL = paystack.url
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, delay=0, default_status=None):
+        self.transactions = {}
+        self.delay = delay
+        self.default_status = default_status
+        self.fail_status = None
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def add_transaction(self, reference, amount=None, status='success', channel='card'):
+        self.transactions[reference] = {
+            'reference': reference, 'amount': amount, 'status': status, 'channel': channel,
+        }
+
+    def lookup(self, reference):
+        if reference in self.transactions:
+            return self.transactions[reference]
+        if self.default_status is not None:
+            return {'reference': reference, 'amount': None, 'status': self.default_status, 'channel': 'card'}
+        return None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @staticmethod
+    def webhook(reference, secret_key, amount=None, status='success', event='charge.success'):
+        """Body and headers of a signed Paystack webhook for reference."""
+        body = json.dumps({
+            'event': event,
+            'data': {'reference': reference, 'amount': amount, 'status': status, 'channel': 'card'},
+        }).encode('utf-8')
+        return body, {'HTTP_X_PAYSTACK_SIGNATURE': sign(body, secret_key)}
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                with fake._lock:
+                    fake.request_count += 1
+                if fake.delay:
+                    time.sleep(fake.delay)
+
+                match = re.fullmatch(r'/transaction/verify/([^/?]+)', self.path)
+                if fake.fail_status:
+                    self.reply(fake.fail_status, {'status': False, 'message': 'Fake failure'})
+                elif match is None:
+                    self.reply(404, {'status': False, 'message': 'Not found'})
+                else:
+                    data = fake.lookup(unquote(match.group(1)))
+                    if data is None:
+                        self.reply(400, {'status': False, 'message': 'Transaction reference not found'})
+                    else:
+                        self.reply(200, {'status': True, 'message': 'Verification successful', 'data': data})
+
+            def reply(self, status, payload):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up waiting, which is what delay is for.
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
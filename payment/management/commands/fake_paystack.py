@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from payment.fake_paystack import FakePaystack
+
+
+class Command(BaseCommand):
+    help = 'Runs a local fake Paystack API, point PAYSTACK_BASE_URL at it.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--delay', type=float, default=0, help='Seconds to wait before every answer.')
+        parser.add_argument('--status', default='success',
+                            help='Transaction status returned for every reference, "none" for not found.')
+
+    def handle(self, *args, **options):
+        default_status = None if options['status'] == 'none' else options['status']
+        paystack = FakePaystack(port=options['port'], delay=options['delay'], default_status=default_status)
+        self.stdout.write(f'Fake Paystack listening on {paystack.url}')
+        try:
+            paystack.serve_forever()
+        except KeyboardInterrupt:
+            paystack.stop()
@@ -0,0 +1,90 @@
+import random
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from main.models import Payment
+from payment.paystack import PaystackClient, PaystackError, PaystackUnavailable
+from payment.services import record_transactions
+
+
+class Command(BaseCommand):
+    help = 'Verifies stale pending payments against Paystack and records the results.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=15,
+                            help='Only payments pending for more than this many minutes.')
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent Paystack requests.')
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--retries', type=int, default=3, help='Retries of a timed out or failed request.')
+        parser.add_argument('--backoff', type=float, default=0.5, help='Initial retry delay in seconds.')
+        parser.add_argument('--limit', type=int, default=None, help='Stop after this many payments.')
+
+    def handle(self, *args, **options):
+        self.retries = options['retries']
+        self.backoff = options['backoff']
+        # A client of its own, with a connection per worker.
+        self.client = PaystackClient(
+            settings.PAYSTACK_SECRET_KEY,
+            base_url=settings.PAYSTACK_BASE_URL,
+            connect_timeout=settings.PAYSTACK_CONNECT_TIMEOUT,
+            read_timeout=settings.PAYSTACK_READ_TIMEOUT,
+            pool_size=options['workers'],
+        )
+
+        pending = Payment.objects.filter(
+            status=Payment.STATUS_PENDING,
+            is_verified=False,
+            date_paid__lt=timezone.now() - timedelta(minutes=options['older_than']),
+        ).order_by('pk')
+
+        totals = Counter()
+        started = time.monotonic()
+        last_pk = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            while options['limit'] is None or totals['checked'] < options['limit']:
+                size = options['batch_size']
+                if options['limit'] is not None:
+                    size = min(size, options['limit'] - totals['checked'])
+                batch = list(pending.filter(pk__gt=last_pk).values_list('pk', 'payment_reference')[:size])
+                if not batch:
+                    break
+                last_pk = batch[-1][0]
+
+                references = [reference for _, reference in batch]
+                transactions = {}
+                for reference, result in zip(references, executor.map(self.verify, references)):
+                    if isinstance(result, dict):
+                        transactions[reference] = result
+                    else:
+                        totals[result] += 1
+                totals['checked'] += len(batch)
+                totals.update(record_transactions(transactions))
+
+                elapsed = time.monotonic() - started
+                self.stdout.write(f"{totals['checked']} checked, {totals['checked'] / elapsed:.1f} payments/s")
+
+        elapsed = time.monotonic() - started
+        rate = totals['checked'] / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {totals['checked']} payments in {elapsed:.1f}s ({rate:.1f}/s): "
+            f"{totals[Payment.STATUS_SUCCESSFUL]} successful, {totals[Payment.STATUS_FAILED]} failed, "
+            f"{totals['unavailable']} unreachable, {totals['error']} rejected by Paystack."
+        ))
+
+    def verify(self, reference):
+        """The transaction data, or 'unavailable' / 'error' once retries are exhausted."""
+        for attempt in range(self.retries + 1):
+            try:
+                return self.client.verify_transaction(reference)
+            except PaystackUnavailable:
+                if attempt == self.retries or self.client.breaker.is_open:
+                    return 'unavailable'
+                time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+            except PaystackError:
+                return 'error'
@@ -0,0 +1,133 @@
+import hashlib
+import hmac
+import threading
+import time
+from urllib.parse import quote
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+
+class PaystackError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class PaystackUnavailable(PaystackError):
+    """Paystack timed out, failed or the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures and then rejects calls
+    for reset_timeout seconds, so a slow or failing Paystack costs one fast
+    error per request instead of a worker blocked until the timeout. After
+    that a single trial call is let through, its outcome closes or reopens
+    the circuit.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if not self._trial and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+
+class PaystackClient:
+    def __init__(self, secret_key, base_url='https://api.paystack.co', connect_timeout=3.05,
+                 read_timeout=10, pool_size=10, breaker=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker = breaker or CircuitBreaker()
+
+        # One keep-alive connection pool for every call made by this process.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Authorization'] = f'Bearer {secret_key}'
+
+    def verify_transaction(self, reference):
+        """Returns the `data` object of Paystack's verify endpoint for reference."""
+        return self._get(f'/transaction/verify/{quote(reference, safe="")}')['data']
+
+    def _get(self, path):
+        if not self.breaker.allow():
+            raise PaystackUnavailable('Paystack is unavailable, try again later.')
+        try:
+            response = self.session.get(self.base_url + path, timeout=self.timeout)
+        except requests.RequestException as e:
+            self.breaker.record_failure()
+            raise PaystackUnavailable(f'Error contacting Paystack: {e}') from e
+
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+            raise PaystackUnavailable('Paystack failed to respond.', response.status_code)
+        self.breaker.record_success()
+
+        if response.status_code != 200:
+            raise PaystackError('Verification failed with Paystack.', response.status_code)
+        try:
+            return response.json()
+        except ValueError as e:
+            raise PaystackError('Invalid response from Paystack.', response.status_code) from e
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """The process wide PaystackClient, configured from the PAYSTACK_* settings."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = PaystackClient(
+                settings.PAYSTACK_SECRET_KEY,
+                base_url=settings.PAYSTACK_BASE_URL,
+                connect_timeout=settings.PAYSTACK_CONNECT_TIMEOUT,
+                read_timeout=settings.PAYSTACK_READ_TIMEOUT,
+                pool_size=settings.PAYSTACK_POOL_SIZE,
+            )
+        return _client
+
+
+def sign(body, secret_key):
+    return hmac.new(secret_key.encode('utf-8'), body, hashlib.sha512).hexdigest()
+
+
+def is_valid_signature(body, signature, secret_key):
+    """Checks the X-Paystack-Signature header, an HMAC-SHA512 of the raw body."""
+    if not signature or not secret_key:
+        return False
+    return hmac.compare_digest(sign(body, secret_key), signature)
@@ -0,0 +1,121 @@
+import logging
+from collections import Counter
+
+from django.db import transaction
+
+from main.events import publish_order_status
+from main.models import Order, Payment
+from main.sales import record_sales
+from main.signals import resources_changed
+
+logger = logging.getLogger(__name__)
+
+# Paystack transaction statuses that will never turn into a success.
+FAILED_STATUSES = {'failed', 'abandoned', 'reversed'}
+
+
+def transaction_outcome(payment, data):
+    """
+    The Payment status a Paystack transaction `data` moves payment to, or
+    None when it stays as it is.
+    """
+    if payment.is_verified:
+        return None
+    paystack_status = data.get('status')
+    if paystack_status == 'success':
+        # Paystack amounts are in the currency's subunit.
+        if data.get('amount') is not None and _subunits(data['amount']) != int(payment.amount * 100):
+            logger.error("Paystack amount %s does not match payment %s", data['amount'], payment.payment_reference)
+            return None
+        return Payment.STATUS_SUCCESSFUL
+    if paystack_status in FAILED_STATUSES and payment.status != Payment.STATUS_FAILED:
+        return Payment.STATUS_FAILED
+    return None
+
+
+def _subunits(amount):
+    """amount as an int, or None when it isn't one: a malformed amount matches no payment."""
+    try:
+        return int(amount)
+    except (TypeError, ValueError):
+        return None
+
+
+def record_transaction(reference, data):
+    """
+    Applies a Paystack transaction (the `data` of a verify response or of a
+    charge webhook) to the Payment with that reference and its Order.
+
+    Returns the Payment, or None when there is none with that reference.
+    Idempotent: a verified payment is never touched again, so webhooks,
+    verify calls and retries can race freely.
+    """
+    with transaction.atomic():
+        payment = Payment.objects.select_for_update().filter(payment_reference=reference).first()
+        if payment is None:
+            return None
+
+        outcome = transaction_outcome(payment, data)
+        if outcome == Payment.STATUS_SUCCESSFUL:
+            payment.status = Payment.STATUS_SUCCESSFUL
+            payment.is_verified = True
+            payment.payment_method = data.get('channel') or payment.payment_method
+            payment.save(update_fields=['status', 'is_verified', 'payment_method'])
+
+            # Locked, so an order cancelled meanwhile is not moved back to processing.
+            order = Order.objects.select_for_update().get(pk=payment.order_id)
+            if order.status == Order.STATUS_PENDING:
+                order.status = Order.STATUS_PROCESSING
+                order.save(update_fields=['status'])
+        elif outcome == Payment.STATUS_FAILED:
+            payment.status = Payment.STATUS_FAILED
+            payment.save(update_fields=['status'])
+    return payment
+
+
+def record_transactions(transactions):
+    """
+    Batch version of record_transaction for a {reference: data} dict, with
+    one locking SELECT of the payments and one of their pending orders, one
+    bulk UPDATE of the payments, one UPDATE of the paid orders and the
+    upserts of their sales rollups. Returns how many payments moved to each
+    status.
+    """
+    with transaction.atomic():
+        payments = list(
+            Payment.objects.select_for_update().select_related('order')
+            .filter(payment_reference__in=list(transactions), is_verified=False).order_by('pk')
+        )
+        changed, paid_orders = [], []
+        for payment in payments:
+            data = transactions[payment.payment_reference]
+            outcome = transaction_outcome(payment, data)
+            if outcome is None:
+                continue
+            payment.status = outcome
+            if outcome == Payment.STATUS_SUCCESSFUL:
+                payment.is_verified = True
+                payment.payment_method = data.get('channel') or payment.payment_method
+                if payment.order.status == Order.STATUS_PENDING:
+                    paid_orders.append(payment.order)
+            changed.append(payment)
+
+        if changed:
+            Payment.objects.bulk_update(changed, ['status', 'is_verified', 'payment_method'])
+        if paid_orders:
+            # Locked and filtered again, an order cancelled since it was read
+            # above stays cancelled and out of the sales.
+            moved = set(Order.objects.select_for_update().filter(
+                pk__in=[order.pk for order in paid_orders], status=Order.STATUS_PENDING
+            ).values_list('pk', flat=True))
+            paid_orders = [order for order in paid_orders if order.pk in moved]
+        if paid_orders:
+            Order.objects.filter(pk__in=moved).update(status=Order.STATUS_PROCESSING)
+            # The UPDATE bypasses the Order signals.
+            record_sales([order.pk for order in paid_orders])
+            for order in paid_orders:
+                order.status = Order.STATUS_PROCESSING
+                publish_order_status(order, Order.STATUS_PENDING)
+            store_ids = {order.store_id for order in paid_orders}
+            resources_changed(['stores'] + [f'store:{store_id}' for store_id in store_ids])
+    return Counter(payment.status for payment in changed)
@@ -1,3 +1,205 @@
-from django.test import TestCase
+import json
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from main.models import Cart, Order, Payment, Store
+from . import services
+from .fake_paystack import FakePaystack
+from .paystack import sign
+
+SECRET_KEY = 'sk_test_payments'
+
+
+class PaystackTestCase(TestCase):
+    """A pending order of 50.00 and its payment, against a FakePaystack started for every test."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('customer')
+        cls.store = Store.objects.create(user=User.objects.create_user('owner'), name='Store', description='Gadgets',
+                                         contact_info='0800000000', address='Lagos')
+        cls.order, cls.payment = cls.create_payment('ref-1')
+
+    @classmethod
+    def create_payment(cls, reference, amount=Decimal('50.00')):
+        cart = Cart.objects.create(user=cls.user, store=cls.store, status=Cart.STATUS_INACTIVE)
+        order = Order.objects.create(cart=cart, user=cls.user, store=cls.store, total_price=amount,
+                                     shipping_address='Lagos', contact_info='0800000000')
+        return order, Payment.objects.create(order=order, payment_reference=reference, amount=amount)
+
+    def setUp(self):
+        self.paystack = self.enterContext(FakePaystack())
+        self.enterContext(override_settings(PAYSTACK_BASE_URL=self.paystack.url, PAYSTACK_SECRET_KEY=SECRET_KEY))
+        # The views share one client per process, built from the settings on first use.
+        self.enterContext(mock.patch('payment.paystack._client', None))
+
+    def assertPaid(self, payment, paid=True):
+        payment = Payment.objects.select_related('order').get(pk=payment.pk)
+        self.assertEqual(payment.is_verified, paid)
+        self.assertEqual(payment.order.status, Order.STATUS_PROCESSING if paid else Order.STATUS_PENDING)
+
+
+class VerifyPaymentTests(PaystackTestCase):
+    def verify(self, reference):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client.post(reverse('verify-paystack-payment'), {'reference': reference}, format='json')
+
+    def test_successful_payment(self):
+        self.paystack.add_transaction('ref-1', amount=5000)
+        self.assertEqual(self.verify('ref-1').status_code, 200)
+        self.assertPaid(self.payment)
+        # Verified payments are answered without asking Paystack again.
+        self.assertEqual(self.verify('ref-1').status_code, 200)
+        self.assertEqual(self.paystack.request_count, 1)
+
+    def test_failed_payment(self):
+        self.paystack.add_transaction('ref-1', amount=5000, status='failed')
+        self.assertEqual(self.verify('ref-1').status_code, 400)
+        self.assertPaid(self.payment, False)
+        self.assertEqual(Payment.objects.get(pk=self.payment.pk).status, Payment.STATUS_FAILED)
+
+    def test_mismatched_amount(self):
+        self.paystack.add_transaction('ref-1', amount=100)
+        with self.assertLogs('payment.services', 'ERROR'):
+            self.assertEqual(self.verify('ref-1').status_code, 400)
+        self.assertPaid(self.payment, False)
+
+    def test_malformed_amount(self):
+        self.paystack.add_transaction('ref-1', amount='fifty')
+        with self.assertLogs('payment.services', 'ERROR'):
+            self.assertEqual(self.verify('ref-1').status_code, 400)
+        self.assertPaid(self.payment, False)
+
+    def test_unknown_payment(self):
+        self.assertEqual(self.verify('ref-unknown').status_code, 404)
+        self.assertEqual(self.paystack.request_count, 0)
+
+    def test_payment_deleted_while_verifying(self):
+        self.paystack.add_transaction('ref-1', amount=5000)
+        with mock.patch('payment.views.record_transaction', return_value=None):
+            self.assertEqual(self.verify('ref-1').status_code, 404)
+
+    def test_paystack_unavailable(self):
+        self.paystack.fail_status = 503
+        with self.assertLogs('payment.views', 'WARNING'):
+            self.assertEqual(self.verify('ref-1').status_code, 503)
+        self.assertPaid(self.payment, False)
+
+
+class PaystackWebhookTests(PaystackTestCase):
+    def post(self, body, headers):
+        return self.client.post(reverse('paystack-webhook'), body, content_type='application/json', **headers)
+
+    def test_charge_success(self):
+        self.assertEqual(self.post(*FakePaystack.webhook('ref-1', SECRET_KEY, amount=5000)).status_code, 200)
+        self.assertPaid(self.payment)
+        # Retries of the same event change nothing.
+        self.assertEqual(self.post(*FakePaystack.webhook('ref-1', SECRET_KEY, amount=5000)).status_code, 200)
+        self.assertPaid(self.payment)
+        self.assertEqual(self.paystack.request_count, 0)
+
+    def test_mismatched_amount(self):
+        with self.assertLogs('payment.services', 'ERROR'):
+            self.assertEqual(self.post(*FakePaystack.webhook('ref-1', SECRET_KEY, amount=100)).status_code, 200)
+        self.assertPaid(self.payment, False)
+
+    def test_malformed_amount(self):
+        # Treated like any other amount that doesn't match.
+        for amount in ['5000.00', 'fifty', [5000], {'value': 5000}]:
+            with self.assertLogs('payment.services', 'ERROR'):
+                response = self.post(*FakePaystack.webhook('ref-1', SECRET_KEY, amount=amount))
+            self.assertEqual(response.status_code, 200, amount)
+        self.assertPaid(self.payment, False)
+
+    def test_unknown_reference_is_acknowledged(self):
+        with self.assertLogs('payment.views', 'WARNING'):
+            self.assertEqual(self.post(*FakePaystack.webhook('ref-unknown', SECRET_KEY)).status_code, 200)
+
+    def test_invalid_signature(self):
+        body, _ = FakePaystack.webhook('ref-1', SECRET_KEY, amount=5000)
+        self.assertEqual(self.post(body, {'HTTP_X_PAYSTACK_SIGNATURE': sign(body, 'sk_other')}).status_code, 401)
+        self.assertEqual(self.post(body, {}).status_code, 401)
+        self.assertPaid(self.payment, False)
+
+    def test_malformed_body(self):
+        for event in ['not an object', {'event': 'charge.success', 'data': 'ref-1'},
+                      {'event': 'charge.success', 'data': ['ref-1']}, {'event': 'charge.success', 'data': 5}]:
+            body = json.dumps(event).encode('utf-8')
+            response = self.post(body, {'HTTP_X_PAYSTACK_SIGNATURE': sign(body, SECRET_KEY)})
+            self.assertEqual(response.status_code, 400, event)
+
+
+class ReconcilePaymentsTests(PaystackTestCase):
+    def reconcile(self, stale=None, **options):
+        # Payments pending for long enough to be reconciled, all of them by default.
+        payments = Payment.objects.filter(pk__in=[payment.pk for payment in stale]) if stale else Payment.objects
+        payments.update(date_paid=timezone.now() - timedelta(hours=1))
+        stdout = StringIO()
+        call_command('reconcile_payments', retries=0, backoff=0, stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def test_records_the_outcome_of_every_payment(self):
+        payments = {reference: self.create_payment(reference)[1] for reference in ['ref-2', 'ref-3', 'ref-4']}
+        self.paystack.add_transaction('ref-1', amount=5000)
+        self.paystack.add_transaction('ref-2', amount=5000, status='failed')
+        self.paystack.add_transaction('ref-3', amount=100)
+        # ref-4 is unknown to Paystack, which rejects it.
+
+        with self.assertLogs('payment.services', 'ERROR'):
+            output = self.reconcile()
+        self.assertIn('Checked 4 payments', output)
+        self.assertIn('1 successful, 1 failed, 0 unreachable, 1 rejected by Paystack', output)
+        self.assertPaid(self.payment)
+        self.assertEqual(Payment.objects.get(pk=payments['ref-2'].pk).status, Payment.STATUS_FAILED)
+        for reference in ['ref-3', 'ref-4']:
+            self.assertPaid(payments[reference], False)
+            self.assertEqual(Payment.objects.get(pk=payments[reference].pk).status, Payment.STATUS_PENDING)
+
+    def test_recent_and_verified_payments_are_skipped(self):
+        self.paystack.add_transaction('ref-1', amount=5000)
+        self.reconcile()
+        recent = self.create_payment('ref-2')[1]
+        self.paystack.add_transaction('ref-2', amount=5000)
+        output = self.reconcile(stale=[self.payment])
+        self.assertIn('Checked 0 payments', output)
+        self.assertEqual(self.paystack.request_count, 1)
+        self.assertPaid(recent, False)
+
+    def test_order_cancelled_meanwhile_stays_cancelled(self):
+        self.paystack.add_transaction('ref-1', amount=5000)
+        outcome = services.transaction_outcome
+
+        def cancel_then_outcome(payment, data):
+            # The customer cancels after the payments were read.
+            Order.objects.filter(pk=payment.order_id).update(status=Order.STATUS_CANCELLED)
+            return outcome(payment, data)
+
+        with mock.patch('payment.services.transaction_outcome', cancel_then_outcome), \
+                mock.patch('payment.services.record_sales') as record_sales, \
+                mock.patch('payment.services.publish_order_status') as publish_order_status:
+            self.reconcile()
+        payment = Payment.objects.select_related('order').get(pk=self.payment.pk)
+        self.assertTrue(payment.is_verified)
+        self.assertEqual(payment.order.status, Order.STATUS_CANCELLED)
+        record_sales.assert_not_called()
+        publish_order_status.assert_not_called()
+
+    def test_open_breaker_stops_calling_paystack(self):
+        for i in range(2, 9):
+            self.create_payment(f'ref-{i}')
+        self.paystack.fail_status = 503
+        output = self.reconcile(workers=1)
+        self.assertIn('0 successful, 0 failed, 8 unreachable', output)
+        # The default breaker opens after five failures in a row.
+        self.assertEqual(self.paystack.request_count, 5)
+        self.assertEqual(Payment.objects.filter(is_verified=False, status=Payment.STATUS_PENDING).count(), 8)
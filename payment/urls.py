@@ -1,6 +1,7 @@
 from django.urls import path
-from .views import verify_paystack_payment
+from .views import paystack_webhook, verify_paystack_payment
 
 urlpatterns = [
     path('api/paystack/verify/', verify_paystack_payment, name='verify-paystack-payment'),
+    path('api/paystack/webhook/', paystack_webhook, name='paystack-webhook'),
 ]
@@ -2,9 +2,14 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
-import requests
+import json
 from django.conf import settings
-from main.models import Payment, Order
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from main.models import Payment
+from .paystack import PaystackError, PaystackUnavailable, get_client, is_valid_signature
+from .services import record_transaction
 import logging
 
 logger = logging.getLogger(__name__)
@@ -17,44 +22,53 @@ def verify_paystack_payment(request):
     if not reference:
         return Response({'error': 'Payment reference not provided.'}, status=status.HTTP_400_BAD_REQUEST)
 
-    # Call Paystack's verify endpoint.
-    url = f"https://api.paystack.co/transaction/verify/{reference}"
-    headers = {"Authorization": f"Bearer {settings.PAYSTACK_SECRET_KEY}"}
+    # Answer from the database when the webhook already confirmed the payment.
+    payment = Payment.objects.filter(payment_reference=reference).first()
+    if payment is None:
+        return Response({'error': 'Payment not found.'}, status=status.HTTP_404_NOT_FOUND)
+    if payment.is_verified:
+        return Response({'message': 'Payment already verified.'}, status=status.HTTP_200_OK)
 
     try:
-        paystack_response = requests.get(url, headers=headers)
-    except requests.RequestException as e:
-        logger.exception("Error calling Paystack verify endpoint:")
-        return Response({'error': 'Error contacting Paystack.'}, status=status.HTTP_502_BAD_GATEWAY)
+        data = get_client().verify_transaction(reference)
+    except PaystackUnavailable as e:
+        logger.warning("Error calling Paystack verify endpoint: %s", e)
+        return Response({'error': 'Error contacting Paystack.'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    except PaystackError as e:
+        logger.error("Paystack verification failed with status %s", e.status_code)
+        return Response({'error': 'Verification failed with Paystack.'},
+                        status=e.status_code or status.HTTP_502_BAD_GATEWAY)
 
-    if paystack_response.status_code != 200:
-        logger.error("Paystack verification failed with status %s", paystack_response.status_code)
-        return Response({'error': 'Verification failed with Paystack.'}, status=paystack_response.status_code)
-
-    response_data = paystack_response.json()
-
-    # Check the status in the response.
-    if response_data.get('data', {}).get('status') == 'success':
-        try:
-            payment = Payment.objects.get(payment_reference=reference)
-        except Payment.DoesNotExist:
-            return Response({'error': 'Payment not found.'}, status=status.HTTP_404_NOT_FOUND)
-
-        # Check for idempotency: if already verified, return a success message.
-        if payment.is_verified:
-            return Response({'message': 'Payment already verified.'}, status=status.HTTP_200_OK)
-
-        # Update payment status and mark as verified.
-        payment.status = Payment.STATUS_SUCCESSFUL
-        payment.is_verified = True
-        payment.save()
+    payment = record_transaction(reference, data)
+    if payment is None:
+        # Deleted while Paystack was being asked.
+        return Response({'error': 'Payment not found.'}, status=status.HTTP_404_NOT_FOUND)
+    if payment.is_verified:
+        return Response({'message': 'Payment verified successfully.'}, status=status.HTTP_200_OK)
+    return Response({'error': 'Payment was not successful.'}, status=status.HTTP_400_BAD_REQUEST)
 
 
-        order = payment.order
-        order.status = Order.STATUS_PROCESSING
-        order.save()
+@csrf_exempt
+@require_POST
+def paystack_webhook(request):
+    """
+    Paystack event receiver. Events are authenticated by the HMAC-SHA512
+    signature of the body and applied without calling Paystack back.
+    """
+    signature = request.headers.get('X-Paystack-Signature')
+    if not is_valid_signature(request.body, signature, settings.PAYSTACK_SECRET_KEY):
+        return HttpResponse(status=401)
 
+    try:
+        event = json.loads(request.body)
+        data = event.get('data') or {}
+    except (ValueError, AttributeError):
+        return HttpResponse(status=400)
+    if not isinstance(data, dict):
+        return HttpResponse(status=400)
 
-        return Response({'message': 'Payment verified successfully.'}, status=status.HTTP_200_OK)
-    else:
-        return Response({'error': 'Payment was not successful.'}, status=status.HTTP_400_BAD_REQUEST)
+    if event.get('event') == 'charge.success' and data.get('reference'):
+        if record_transaction(data['reference'], data) is None:
+            logger.warning("Paystack webhook for unknown payment %s", data['reference'])
+    # Anything else is acknowledged so Paystack stops retrying it.
+    return HttpResponse(status=200)
@@ -25,6 +25,11 @@ DEBUG = os.getenv("DEBUG") == 'False'
 SECRET_KEY = os.getenv("SECRET_KEY")
 PAYSTACK_SECRET_KEY = os.getenv("PAYSTACK_SECRET_KEY")
 PAYSTACK_PUBLIC_KEY = os.getenv("PAYSTACK_PUBLIC_KEY")
+# Point PAYSTACK_BASE_URL at `manage.py fake_paystack` to work without Paystack.
+PAYSTACK_BASE_URL = os.getenv("PAYSTACK_BASE_URL", "https://api.paystack.co")
+PAYSTACK_CONNECT_TIMEOUT = float(os.getenv("PAYSTACK_CONNECT_TIMEOUT", 3.05))
+PAYSTACK_READ_TIMEOUT = float(os.getenv("PAYSTACK_READ_TIMEOUT", 10))
+PAYSTACK_POOL_SIZE = int(os.getenv("PAYSTACK_POOL_SIZE", 10))
 AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 AWS_STORAGE_BUCKET_NAME = os.getenv("AWS_STORAGE_BUCKET_NAME")
@@ -40,6 +45,19 @@ DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
 # URL that handles the media served from S3
 MEDIA_URL = f"https://{AWS_S3_CUSTOM_DOMAIN}/"
 
+# Object storage used by the upload views (main.storage). Point SUPABASE_URL
+# at `manage.py fake_storage` to work without Supabase.
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+STORAGE_PUBLIC_URL = os.getenv("STORAGE_PUBLIC_URL", MEDIA_URL)
+STORAGE_POOL_SIZE = int(os.getenv("STORAGE_POOL_SIZE", 10))
+# Files accepted by one upload request.
+UPLOAD_MAX_FILES = 10
+# Threads rendering image variants (main.images) in each process.
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", 2))
+# Images waiting for a worker, beyond that they are left to generate_image_variants.
+IMAGE_QUEUE_SIZE = int(os.getenv("IMAGE_QUEUE_SIZE", 100))
+
 ALLOWED_HOSTS=['*']
 
 
@@ -80,6 +98,48 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
+    'DEFAULT_PAGINATION_CLASS': 'main.pagination.KeysetPagination',
+    'PAGE_SIZE': 20,
+}
+
+# Cache of anonymous read-only API responses (main.response_cache). Set
+# SHARED_CACHE to a CACHES alias to share entries between processes. Without
+# one, each process invalidates only its own entries: with several workers,
+# the others serve a response for up to TIMEOUT seconds after a write.
+RESPONSE_CACHE = {
+    'MAX_ENTRIES': 1000,
+    'MAX_BYTES': 32 * 1024 * 1024,
+    'TIMEOUT': 300,
+    'SHARED_CACHE': os.getenv('RESPONSE_CACHE_SHARED_CACHE') or None,
+}
+
+# Per-user sets of wishlisted product ids (main.wishlist). Without SHARED_CACHE
+# (a CACHES alias), every process checks its sets against a version stamp.
+WISHLIST_CACHE = {
+    'TIMEOUT': 300,
+    'SHARED_CACHE': os.getenv('WISHLIST_CACHE_SHARED_CACHE') or None,
+}
+
+# Seconds a process serves the category tree (main.category_tree) before
+# checking it for category writes of other processes.
+CATEGORY_TREE_MAX_AGE = 5
+
+# Precomputed homepage payload (main.homepage), rebuilt in the background after
+# hero image, category and product writes. MAX_AGE is how often a process checks
+# it against the version stamps for writes of other processes.
+HOMEPAGE = {
+    'PRODUCTS': 12,
+    'DELAY': 1,
+    'MAX_AGE': 5,
+}
+
+# Server-sent events (main.events). The default backend only reaches streams
+# of the publishing process; with several processes set EVENTS_BACKEND to
+# main.events.PostgresBackend.
+EVENTS = {
+    'BACKEND': os.getenv('EVENTS_BACKEND', 'main.events.LocalBackend'),
+    'HEARTBEAT': 15,
+    'MAX_DURATION': 300,
 }
 
 